@@ -1,4 +1,5 @@
 from snaketalk.bot import Bot
+from snaketalk.cache import cached_reply
 from snaketalk.function import (
     MessageFunction,
     WebHookFunction,
@@ -12,6 +13,7 @@ from snaketalk.wrappers import ActionEvent, Message, WebHookEvent
 
 __all__ = [
     "Bot",
+    "cached_reply",
     "MessageFunction",
     "WebHookFunction",
     "listen_to",
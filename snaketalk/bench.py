@@ -0,0 +1,474 @@
+"""Load generator that runs a Bot against a FakeMattermostServer and reports how it
+holds up, to size deployments and compare releases.
+
+Usage: python -m snaketalk.bench --rate 200 --duration 30 --webhook-rate 50
+"""
+
+import asyncio
+import concurrent.futures
+import importlib
+import json
+import logging
+import resource
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import click
+from aiohttp import ClientError, ClientSession
+
+from snaketalk.bot import Bot
+from snaketalk.fake_server import FakeMattermostServer
+from snaketalk.function import listen_to, listen_webhook
+from snaketalk.plugins import Plugin
+from snaketalk.recording import replay_recording
+from snaketalk.settings import Settings
+from snaketalk.stats import percentile
+from snaketalk.wrappers import Message, WebHookEvent
+
+PERCENTILES = [0.5, 0.9, 0.99]
+
+
+class BenchPlugin(Plugin):
+    """Replies to every benchmark message and webhook without doing any work, to measure
+    the overhead of the bot itself."""
+
+    @listen_to("^ping")
+    def ping(self, message: Message):
+        self.driver.reply_to(message, "pong")
+
+    @listen_webhook("^bench$")
+    async def bench_webhook(self, event: WebHookEvent):
+        self.driver.respond_to_web(event, {"text": "pong"})
+
+
+def load_plugin(path: str) -> Plugin:
+    """Instantiates the plugin class at the given path, e.g. "snaketalk:ExamplePlugin"
+    or "my_bot.plugins.MyPlugin"."""
+    module_name, _, class_name = path.replace(":", ".").rpartition(".")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def _start_bot(
+    settings: Settings, plugins: Sequence[Plugin]
+) -> Tuple[Bot, asyncio.AbstractEventLoop]:
+    """Runs a Bot on its own event loop in a background thread, and returns it and its
+    loop once it has been created."""
+    created = threading.Event()
+    loop = asyncio.new_event_loop()
+    bots = []
+
+    def run():
+        asyncio.set_event_loop(loop)
+        try:
+            bots.append(Bot(settings=settings, plugins=plugins))
+        finally:
+            created.set()
+        bots[0].run()
+
+    threading.Thread(target=run, name="bench-bot", daemon=True).start()
+    created.wait()
+    if len(bots) == 0:
+        raise RuntimeError("The bot could not be created, see the log for details.")
+    return bots[0], loop
+
+
+def _send_messages(
+    server: FakeMattermostServer,
+    channel_id: str,
+    user_id: str,
+    messages: Sequence[str],
+    rate: float,
+    duration: float,
+) -> Dict[str, float]:
+    """Posts the messages in a loop at the given rate, and returns the time at which
+    each was sent, by post id."""
+    sent = {}
+    start = time.perf_counter()
+    for i in range(int(rate * duration)):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        post = server.send_message(channel_id, user_id, messages[i % len(messages)])
+        sent[post["id"]] = server.post_times[post["id"]]
+    return sent
+
+
+def _replay_messages(
+    bot: Bot,
+    loop: asyncio.AbstractEventLoop,
+    path: Union[str, Path],
+    speed: float,
+) -> Dict[str, float]:
+    """Feeds a recording of websocket frames directly to the EventHandler of the bot,
+    and returns the time at which each post was handled, by post id."""
+    sent = {}
+
+    async def handle_event(data: str):
+        event = json.loads(data)
+        if event.get("event") == "posted":
+            sent[json.loads(event["data"]["post"])["id"]] = time.perf_counter()
+        await bot.event_handler._handle_event(data)
+
+    asyncio.run_coroutine_threadsafe(
+        replay_recording(path, handle_event, speed), loop
+    ).result()
+    return sent
+
+
+async def _fire_webhooks(
+    url: str, rate: float, duration: float, concurrency: int
+) -> List[Tuple[float, int]]:
+    """Sends webhook requests at the given rate with at most concurrency requests in
+    flight, and returns the latency and status of each (0 for connection errors)."""
+    results = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with ClientSession() as session:
+
+        async def fire():
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    async with session.post(url, json={"text": "ping"}) as response:
+                        await response.read()
+                        status = response.status
+                except ClientError:
+                    status = 0
+                results.append((time.perf_counter() - start, status))
+
+        tasks = []
+        start = time.perf_counter()
+        for i in range(int(rate * duration)):
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(fire()))
+        await asyncio.gather(*tasks)
+    return results
+
+
+def _get_replies(server: FakeMattermostServer, sent: Sequence[str]) -> Dict[str, str]:
+    """Returns the id of the first reply of the bot to each of the sent posts that has
+    one, by the id of the sent post."""
+    sent_ids = set(sent)
+    replies = {}
+    # Posts are stored in creation order, so the first reply comes first
+    for post_id, post in list(server.posts.items()):
+        root_id = post["root_id"]
+        if (
+            post["user_id"] == server.bot["id"]
+            and root_id in sent_ids
+            and root_id not in replies
+        ):
+            replies[root_id] = post_id
+    return replies
+
+
+def _wait_for_replies(
+    server: FakeMattermostServer, sent: Sequence[str], drain_timeout: float
+) -> Dict[str, str]:
+    """Waits until every sent post has a reply, or until no new replies arrived for
+    drain_timeout seconds, since not every message necessarily triggers one."""
+    replies = _get_replies(server, sent)
+    last_progress = time.perf_counter()
+    while len(replies) < len(sent):
+        if time.perf_counter() - last_progress > drain_timeout:
+            break
+        time.sleep(0.05)
+        num_replies = len(replies)
+        replies = _get_replies(server, sent)
+        if len(replies) > num_replies:
+            last_progress = time.perf_counter()
+    return replies
+
+
+def _latency_summary(latencies: Sequence[float]) -> Dict[str, float]:
+    summary = {f"p{int(p * 100)}": percentile(latencies, p) for p in PERCENTILES}
+    summary["max"] = max(latencies, default=0.0)
+    return summary
+
+
+def run_benchmark(
+    plugins: Optional[Sequence[Plugin]] = None,
+    messages: Sequence[str] = ["ping"],
+    rate: float = 50.0,
+    duration: float = 10.0,
+    webhook_rate: float = 0.0,
+    webhook_concurrency: int = 10,
+    webhook_id: str = "bench",
+    latency: float = 0.0,
+    port: int = 8065,
+    webhook_port: int = 8579,
+    drain_timeout: float = 5.0,
+    trace_memory: bool = False,
+    recording: Optional[Union[str, Path]] = None,
+    speed: float = 1.0,
+) -> Dict:
+    """Runs a Bot with the given plugins against a FakeMattermostServer, posts the
+    messages in a loop at the given rate and fires webhook requests at the same time.
+
+    Returns a dictionary with the throughput, latency percentiles (in seconds), CPU time
+    and memory usage. Since the fake server and load generator run in the same process
+    as the bot, the CPU time includes their overhead as well.
+
+    Arguments:
+    - plugins: the plugins to run, by default a BenchPlugin that answers "ping" messages
+        and "bench" webhooks.
+    - messages: the messages to post, in order, e.g. recorded from a real channel.
+    - rate: float, messages per second.
+    - duration: float, number of seconds to generate load for.
+    - webhook_rate: float, webhook requests per second, 0 to disable the webhook server.
+    - webhook_concurrency: int, maximum number of webhook requests in flight.
+    - webhook_id: str, id of the webhook to send requests to.
+    - latency: float, number of seconds the fake server takes to answer API requests.
+    - drain_timeout: float, how long to wait for new replies once the load stops.
+    - trace_memory: bool, whether to trace memory allocations of the bot with
+        tracemalloc, which itself slows the bot down considerably.
+    - recording: path of a recording made with Settings.RECORD_FILE. If given, its
+        frames are replayed instead of posting the messages, and the duration only
+        applies to the webhook requests. Listeners that need a mention only respond if
+        the recording was made by a bot with the same user id as the fake one.
+    - speed: float, how much faster than real time to replay the recording, 0 for as
+        fast as possible.
+    """
+    # Leave tracemalloc running if it was already started outside of the benchmark
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    server = FakeMattermostServer(port=port, latency=latency)
+    server.start_thread()
+    user = server.add_user("bench_user")
+    channel = server.add_channel("bench")
+
+    settings = Settings(
+        MATTERMOST_URL="http://127.0.0.1",
+        MATTERMOST_PORT=port,
+        BOT_TOKEN=server.token,
+        SSL_VERIFY=False,
+        WEBHOOK_HOST_ENABLED=webhook_rate > 0,
+        WEBHOOK_HOST_PORT=webhook_port,
+    )
+    bot, loop = _start_bot(settings, plugins or [BenchPlugin()])
+    try:
+        if not server.wait_for_clients(1):
+            raise RuntimeError("The bot did not connect to the websocket.")
+        while webhook_rate > 0 and not bot.webhook_server.running:
+            time.sleep(0.01)
+
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            webhooks = executor.submit(
+                asyncio.run,
+                _fire_webhooks(
+                    f"{settings.WEBHOOK_HOST_URL}:{webhook_port}/hooks/{webhook_id}",
+                    webhook_rate,
+                    duration,
+                    webhook_concurrency,
+                ),
+            )
+            if recording is not None:
+                sent = _replay_messages(bot, loop, recording, speed)
+            else:
+                sent = _send_messages(
+                    server, channel["id"], user["id"], messages, rate, duration
+                )
+            send_time = time.perf_counter() - start
+            replies = _wait_for_replies(server, list(sent), drain_timeout)
+            webhook_results = webhooks.result()
+        # Measure until the last reply, without the time spent waiting for more
+        wall_time = (
+            max(
+                [start + send_time]
+                + [server.post_times[reply_id] for reply_id in replies.values()]
+            )
+            - start
+        )
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    finally:
+        bot.stop()
+        bot.driver.websocket.disconnect()
+        server.stop_thread()
+
+    reply_latencies = [
+        server.post_times[reply_id] - sent[post_id]
+        for post_id, reply_id in replies.items()
+    ]
+    statuses: Dict[str, int] = {}
+    for _, status in webhook_results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    cpu_user = usage_after.ru_utime - usage_before.ru_utime
+    cpu_system = usage_after.ru_stime - usage_before.ru_stime
+
+    results = {
+        "messages": {
+            "sent": len(sent),
+            "send_rate": len(sent) / send_time if send_time > 0 else 0.0,
+            "replies": len(replies),
+            "throughput": len(replies) / wall_time if wall_time > 0 else 0.0,
+            "latency": _latency_summary(reply_latencies),
+        },
+        "webhooks": {
+            "sent": len(webhook_results),
+            "statuses": statuses,
+            "latency": _latency_summary([latency for latency, _ in webhook_results]),
+        },
+        "api_requests": sum(server.request_counts.values()),
+        "wall_time": wall_time,
+        "cpu": {
+            "user": cpu_user,
+            "system": cpu_system,
+            "utilization": (cpu_user + cpu_system) / wall_time if wall_time else 0.0,
+        },
+        # ru_maxrss is in KiB on Linux
+        "memory": {"peak_rss_mib": usage_after.ru_maxrss / 1024},
+    }
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        results["memory"]["traced_mib"] = current / (1024 * 1024)
+        results["memory"]["traced_peak_mib"] = peak / (1024 * 1024)
+    return results
+
+
+def format_report(results: Dict) -> str:
+    def latencies(summary: Dict[str, float]) -> str:
+        return ", ".join(
+            f"{name} {value * 1000:.1f} ms" for name, value in summary.items()
+        )
+
+    messages = results["messages"]
+    webhooks = results["webhooks"]
+    memory = results["memory"]
+    report = (
+        f"Messages sent:    {messages['sent']} ({messages['send_rate']:.1f}/s)\n"
+        f"Replies received: {messages['replies']} ({messages['throughput']:.1f}/s)\n"
+        f"Reply latency:    {latencies(messages['latency'])}\n"
+    )
+    if webhooks["sent"] > 0:
+        statuses = ", ".join(
+            f"{status}: {count}"
+            for status, count in sorted(webhooks["statuses"].items())
+        )
+        report += (
+            f"Webhooks sent:    {webhooks['sent']} ({statuses})\n"
+            f"Webhook latency:  {latencies(webhooks['latency'])}\n"
+        )
+    report += (
+        f"API requests:     {results['api_requests']}\n"
+        f"CPU time:         {results['cpu']['user']:.2f} s user,"
+        f" {results['cpu']['system']:.2f} s system"
+        f" ({results['cpu']['utilization']:.0%} of one core)\n"
+        f"Peak RSS:         {memory['peak_rss_mib']:.1f} MiB\n"
+    )
+    if "traced_mib" in memory:
+        report += (
+            f"Traced memory:    {memory['traced_mib']:.1f} MiB"
+            f" (peak {memory['traced_peak_mib']:.1f} MiB)\n"
+        )
+    return report
+
+
+@click.command()
+@click.option(
+    "--plugin",
+    "plugins",
+    multiple=True,
+    help='Plugin class to run, e.g. "snaketalk:ExamplePlugin". Defaults to a plugin'
+    ' that answers "ping" messages and "bench" webhooks.',
+)
+@click.option(
+    "--messages",
+    "messages_file",
+    type=click.File(),
+    help="File with one message per line to post in a loop, instead of 'ping'.",
+)
+@click.option(
+    "--recording",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Recording of websocket frames (see Settings.RECORD_FILE) to replay instead.",
+)
+@click.option(
+    "--speed",
+    default=1.0,
+    show_default=True,
+    help="How much faster than real time to replay, 0 for as fast as possible.",
+)
+@click.option("--rate", default=50.0, show_default=True, help="Messages per second.")
+@click.option("--duration", default=10.0, show_default=True, help="Seconds of load.")
+@click.option(
+    "--webhook-rate",
+    default=0.0,
+    show_default=True,
+    help="Webhook requests per second, 0 to disable.",
+)
+@click.option(
+    "--webhook-concurrency",
+    default=10,
+    show_default=True,
+    help="Maximum number of webhook requests in flight.",
+)
+@click.option("--webhook-id", default="bench", show_default=True)
+@click.option(
+    "--latency",
+    default=0.0,
+    show_default=True,
+    help="Seconds the fake server takes to answer API requests.",
+)
+@click.option("--port", default=8065, show_default=True, help="Fake server port.")
+@click.option("--webhook-port", default=8579, show_default=True)
+@click.option(
+    "--drain-timeout",
+    default=5.0,
+    show_default=True,
+    help="Seconds to wait for new replies once the load stops.",
+)
+@click.option("--trace-memory", is_flag=True, help="Trace allocations (slow).")
+@click.option("--json", "as_json", is_flag=True, help="Print the results as JSON.")
+def main(
+    plugins,
+    messages_file,
+    recording,
+    speed,
+    rate,
+    duration,
+    webhook_rate,
+    webhook_concurrency,
+    webhook_id,
+    latency,
+    port,
+    webhook_port,
+    drain_timeout,
+    trace_memory,
+    as_json,
+):
+    # Keep the log of the bot from drowning out the report
+    logging.basicConfig(level=logging.WARNING)
+    messages = ["ping"]
+    if messages_file is not None:
+        messages = [line for line in messages_file.read().splitlines() if line]
+    results = run_benchmark(
+        plugins=[load_plugin(path) for path in plugins],
+        messages=messages,
+        rate=rate,
+        duration=duration,
+        webhook_rate=webhook_rate,
+        webhook_concurrency=webhook_concurrency,
+        webhook_id=webhook_id,
+        latency=latency,
+        port=port,
+        webhook_port=webhook_port,
+        drain_timeout=drain_timeout,
+        trace_memory=trace_memory,
+        recording=recording,
+        speed=speed,
+    )
+    click.echo(json.dumps(results, indent=2) if as_json else format_report(results))
+
+
+if __name__ == "__main__":
+    main()
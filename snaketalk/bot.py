@@ -5,9 +5,11 @@ from typing import Sequence
 
 from snaketalk.driver import Driver
 from snaketalk.event_handler import EventHandler
+from snaketalk.loop_monitor import LoopMonitor
 from snaketalk.plugins import ExamplePlugin, Plugin, WebHookExample
 from snaketalk.settings import Settings
-from snaketalk.webhook_server import WebHookServer
+from snaketalk.tracing import TRACER
+from snaketalk.webhook_server import WebHookServer, WebHookServerPool
 
 
 class Bot:
@@ -29,6 +31,7 @@ class Bot:
             }
         )
         self.settings = settings
+        TRACER.configure(settings.TRACE_FILE, settings.TRACE_SAMPLE_RATE)
         self.driver = Driver(
             {
                 "url": settings.MATTERMOST_URL,
@@ -44,6 +47,10 @@ class Bot:
             self.driver, settings=self.settings, plugins=self.plugins
         )
         self.webhook_server = None
+        # Keeps an eye on the event loop, and looks for blocking code in debug mode
+        self.loop_monitor = LoopMonitor(
+            block_threshold=settings.LOOP_BLOCK_THRESHOLD if settings.DEBUG else None
+        )
 
         if self.settings.WEBHOOK_HOST_ENABLED:
             self._initialize_webhook_server()
@@ -54,10 +61,23 @@ class Bot:
         return plugins
 
     def _initialize_webhook_server(self):
-        self.webhook_server = WebHookServer(
-            url=self.settings.WEBHOOK_HOST_URL, port=self.settings.WEBHOOK_HOST_PORT
+        if self.settings.WEBHOOK_HOST_WORKERS > 1:
+            self.webhook_server = WebHookServerPool(
+                self.settings, num_workers=self.settings.WEBHOOK_HOST_WORKERS
+            )
+        else:
+            self.webhook_server = WebHookServer(self.settings)
+        # Let the server answer requests to webhooks without listeners by itself, and
+        # tell it which webhooks can be acknowledged before they are processed.
+        self.webhook_server.register_webhook_routes(
+            {
+                matcher: all(function.fire_and_forget for function in functions)
+                for matcher, functions in self.event_handler.webhook_listeners.items()
+            }
+        )
+        self.driver.register_webhook_server(
+            self.webhook_server, loopback=self.event_handler._handle_webhook
         )
-        self.driver.register_webhook_server(self.webhook_server)
         # Schedule the queue loop to the current event loop so that it starts together
         # with self.init_websocket.
         asyncio.get_event_loop().create_task(
@@ -77,8 +97,12 @@ class Bot:
                 self.driver.threadpool.start_webhook_server_thread(self.webhook_server)
 
             for plugin in self.plugins:
+                plugin.start_pool()
                 plugin.on_start()
 
+            # Starts measuring together with the websocket loop
+            self.loop_monitor.start()
+
             # Start listening for events
             self.event_handler.start()
 
@@ -88,8 +112,17 @@ class Bot:
 
     def stop(self):
         logging.info("Stopping bot.")
+        self.loop_monitor.stop()
         # Shutdown the running plugins
         for plugin in self.plugins:
             plugin.on_stop()
-        # Stop the threadpool
+            plugin.stop_pool()
+        # Stop the threadpool and process pool
         self.driver.threadpool.stop()
+        self.driver.process_pool.stop()
+        # Close any connections used for outgoing webhook traffic
+        self.driver.close_http_sessions()
+        # Write the remaining traces and recorded events to disk
+        TRACER.close()
+        if self.event_handler.recorder is not None:
+            self.event_handler.recorder.close()
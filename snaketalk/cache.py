@@ -0,0 +1,169 @@
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Sequence, Tuple, Union
+
+from snaketalk.wrappers import Message
+
+# Message attributes that can be used to build the cache key.
+KEY_ATTRIBUTES = {
+    "text": "text",
+    "channel": "channel_id",
+    "user": "user_id",
+}
+
+
+class ReplyCache(object):
+    def __init__(self, ttl: float, maxsize: int):
+        """Thread-safe cache that remembers at most `maxsize` values for `ttl` seconds
+        each, and keeps track of the values that are currently being computed.
+
+        Arguments:
+        - ttl: float, number of seconds to remember each value.
+        - maxsize: int, maximum number of values to remember. The least recently used
+            values are evicted first.
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self._values: "OrderedDict[Hashable, Tuple[float, object]]" = OrderedDict()
+        # Futures of the values that are being computed right now.
+        self.pending: Dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable):
+        """Returns a (found, value) tuple.
+
+        Should be called while holding the lock.
+        """
+        try:
+            expires, value = self._values[key]
+        except KeyError:
+            return False, None
+        if expires < time.monotonic():
+            del self._values[key]
+            return False, None
+        self._values.move_to_end(key)
+        return True, value
+
+    def put(self, key: Hashable, value):
+        """Should be called while holding the lock."""
+        self._values[key] = (time.monotonic() + self.ttl, value)
+        self._values.move_to_end(key)
+        while len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self._values.clear()
+
+
+def cached_reply(
+    ttl: float = 60,
+    key: Union[str, Sequence[str], Callable[[Message], Hashable]] = "text",
+    maxsize: int = 128,
+):
+    """Memoizes the reply of a listener function, so that repeated questions don't
+    trigger the same work over and over again.
+
+    The decorated function should return its reply text rather than send it, and is
+    placed below listen_to:
+
+        @listen_to("^status$")
+        @cached_reply(ttl=30, key=("text", "channel"))
+        async def status(self, message):
+            return expensive_lookup()
+
+    The reply is then sent by the decorator, or not at all if the function returned
+    None. Replies are cached per plugin instance. If the function is a coroutine,
+    invocations with the same key that arrive while it is still running wait for its
+    result instead of calling it again. Synchronous functions run in the thread pool,
+    where waiting would hold up a worker, so those invocations compute the reply
+    themselves.
+
+    Arguments:
+    - ttl: float, number of seconds to remember each reply.
+    - key: "text", "channel", "user" or a sequence of these, or a function that takes
+        the message and returns a hashable key. Any arguments of the listener are
+        always part of the key.
+    - maxsize: int, maximum number of replies to remember.
+    """
+    if callable(key):
+        get_key = key
+    else:
+        attributes = [
+            KEY_ATTRIBUTES[part] for part in ([key] if isinstance(key, str) else key)
+        ]
+
+        def get_key(message: Message):
+            return tuple(getattr(message, attribute) for attribute in attributes)
+
+    def decorator(func):
+        cache = ReplyCache(ttl=ttl, maxsize=maxsize)
+
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(self, message: Message, *args):
+                cache_key = (self, get_key(message), args)
+                with cache.lock:
+                    found, reply = cache.get(cache_key)
+                    future = cache.pending.get(cache_key)
+                    owner = not found and future is None
+                    if owner:
+                        future = asyncio.get_event_loop().create_future()
+                        cache.pending[cache_key] = future
+
+                if owner:
+                    try:
+                        reply = await func(self, message, *args)
+                        with cache.lock:
+                            cache.put(cache_key, reply)
+                        future.set_result(reply)
+                    except asyncio.CancelledError:
+                        # Let the waiting callers try again themselves
+                        future.cancel()
+                        raise
+                    except BaseException as e:
+                        future.set_exception(e)
+                        # Don't warn about the exception if nobody was waiting for it
+                        future.exception()
+                        raise
+                    finally:
+                        with cache.lock:
+                            del cache.pending[cache_key]
+                elif not found:
+                    try:
+                        reply = await asyncio.shield(future)
+                    except asyncio.CancelledError:
+                        # Unless we were cancelled ourselves, the caller that was
+                        # computing the reply was, so take over.
+                        if not future.cancelled():
+                            raise
+                        return await async_wrapper(self, message, *args)
+
+                if reply is not None:
+                    self.driver.reply_to(message, reply)
+
+            async_wrapper.cache = cache
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, message: Message, *args):
+            cache_key = (self, get_key(message), args)
+            with cache.lock:
+                found, reply = cache.get(cache_key)
+
+            if not found:
+                reply = func(self, message, *args)
+                with cache.lock:
+                    cache.put(cache_key, reply)
+
+            if reply is not None:
+                self.driver.reply_to(message, reply)
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
@@ -1,12 +1,37 @@
+import asyncio
+import json
+import logging
+import os
 import queue
+import ssl
+import time
 from pathlib import Path
-from typing import Dict, List, Optional, Sequence, Union
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 import mattermostdriver
 from aiohttp.client import ClientSession
 
+from snaketalk.metrics import API_ERRORS, API_REQUEST_SECONDS, THREADPOOL_QUEUE_SIZE
+from snaketalk.process_pool import ProcessPool
 from snaketalk.threadpool import ThreadPool
-from snaketalk.webhook_server import WebHookServer
+from snaketalk.tracing import TRACER
+from snaketalk.webhook_server import (
+    LoopbackResponse,
+    NoResponse,
+    WebHookServer,
+    WebHookServerPool,
+    create_webhook_event,
+)
 from snaketalk.wrappers import Message, WebHookEvent
 
 
@@ -14,27 +39,91 @@ class Driver(mattermostdriver.Driver):
     user_id: str = ""
     username: str = ""
 
-    def __init__(self, *args, num_threads=10, **kwargs):
+    def __init__(self, *args, num_threads=10, num_processes=None, **kwargs):
         """Wrapper around the mattermostdriver Driver with some convenience functions
         and attributes.
 
         Arguments:
         - num_threads: int, number of threads to use for the default worker threadpool.
+        - num_processes: int, number of processes to use for functions that should run
+            in a separate process. Defaults to the number of CPUs.
         """
         super().__init__(*args, **kwargs)
         self.threadpool = ThreadPool(num_workers=num_threads)
+        self.process_pool = ProcessPool(num_workers=num_processes)
+        # Dedicated thread and process pools of individual plugins, by plugin name.
+        self.plugin_pools: Dict[str, Union[ThreadPool, ProcessPool]] = {}
         # Queue to communicate with the WebHookServer
         self.response_queue: Optional[queue.Queue] = None
         self.webhook_url = None
+        self.webhook_server: Optional[Union[WebHookServer, WebHookServerPool]] = None
+        # Function that passes webhook events directly to the EventHandler, and the
+        # futures of the self-triggered webhooks that are waiting for a response.
+        self.webhook_loopback: Optional[Callable[[WebHookEvent], Awaitable]] = None
+        self._loopback_handlers: Dict[
+            str, Tuple[asyncio.AbstractEventLoop, asyncio.Future]
+        ] = {}
+        # Fire-and-forget loopback handlers that are still running. The event loop only
+        # keeps weak references to tasks, so they could be garbage collected otherwise.
+        self._loopback_tasks: Set[asyncio.Task] = set()
+        # Keep-alive HTTP sessions for outgoing webhook traffic, one per event loop.
+        # While the bot is running, all traffic goes through the one of its main loop.
+        self._http_sessions: Dict[asyncio.AbstractEventLoop, ClientSession] = {}
+        self._http_loop: Optional[asyncio.AbstractEventLoop] = None
+        # SSL context for outgoing webhook traffic, if verify is a CA bundle path
+        self._ssl_context: Optional[ssl.SSLContext] = None
+        # Calls to incoming webhooks that are waiting to be sent as a single batch.
+        self._webhook_batches: Dict[Tuple, Tuple[List[Dict], asyncio.Future]] = {}
+
+        # Keep track of the latency and errors of all Mattermost API requests
+        self.client.make_request = self._timed_request(self.client.make_request)
+        # The metrics are global, so only the queues of the most recently created
+        # Driver are reported. A process normally runs a single bot.
+        THREADPOOL_QUEUE_SIZE.set_function(self.get_queue_sizes)
+
+    @staticmethod
+    def _timed_request(make_request: Callable):
+        def timed_request(method: str, endpoint: str, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with TRACER.span("api_request", method=method, endpoint=endpoint):
+                    return make_request(method, endpoint, *args, **kwargs)
+            except Exception:
+                API_ERRORS.inc(method=method)
+                raise
+            finally:
+                API_REQUEST_SECONDS.observe(time.perf_counter() - start, method=method)
+
+        return timed_request
+
+    def get_queue_sizes(self) -> Dict[str, int]:
+        """Returns the number of tasks waiting for a free worker, by pool."""
+        sizes = {"default": self.threadpool.get_queue_size()}
+        if self.process_pool.alive:
+            sizes["process"] = self.process_pool.get_queue_size()
+        for name, pool in self.plugin_pools.items():
+            sizes[name] = pool.get_queue_size()
+        return sizes
 
     def login(self, *args, **kwargs):
         super().login(*args, **kwargs)
         self.user_id = self.client._userid
         self.username = self.client._username
 
-    def register_webhook_server(self, server: WebHookServer):
+    def register_webhook_server(
+        self,
+        server: Union[WebHookServer, WebHookServerPool],
+        loopback: Optional[Callable[[WebHookEvent], Awaitable]] = None,
+    ):
+        """Registers the running webhook server.
+
+        If a loopback function is given, webhooks triggered through trigger_own_webhook
+        are passed to it directly rather than sent over the network.
+        """
+        self.webhook_server = server
         self.response_queue = server.response_queue
         self.webhook_url = f"{server.url}:{server.port}/hooks"
+        self.webhook_loopback = loopback
 
     def create_post(
         self,
@@ -139,20 +228,212 @@ class Driver(mattermostdriver.Driver):
 
     def respond_to_web(self, event: WebHookEvent, response):
         """Send a web response to the given WebHookEvent."""
-        self.response_queue.put((event.request_id, response))
+        if event.request_id in self._loopback_handlers:
+            # This event was triggered by the bot itself, so there's no need to go
+            # through the webhook server.
+            loop, future = self._loopback_handlers[event.request_id]
+            loop.call_soon_threadsafe(_set_future_result, future, response)
+        else:
+            self.response_queue.put((event.request_id, response))
         event.responded = True
 
-    async def trigger_own_webhook(self, webhook_id: str, data: Dict):
-        """Triggers a a webhook with id webhook_id on the running WebHookServer."""
+    def init_websocket(self, event_handler, *args, **kwargs):
+        # Outgoing webhook traffic of other threads is sent from this loop, which runs
+        # for as long as the bot does.
+        self._http_loop = asyncio.get_event_loop()
+        return super().init_websocket(event_handler, *args, **kwargs)
+
+    def get_http_session(self) -> ClientSession:
+        """Returns a keep-alive HTTP session for the current event loop, which is shared
+        by all outgoing webhook traffic."""
+        loop = asyncio.get_event_loop()
+        session = self._http_sessions.get(loop)
+        if session is None or session.closed:
+            session = ClientSession()
+            self._http_sessions[loop] = session
+        return session
+
+    def close_http_sessions(self):
+        """Closes the HTTP sessions created by get_http_session."""
+        for loop, session in self._http_sessions.items():
+            if session.closed:
+                continue
+            if loop.is_closed():
+                # The loop of this session is gone, so close it on a temporary one
+                temporary_loop = asyncio.new_event_loop()
+                try:
+                    temporary_loop.run_until_complete(session.close())
+                finally:
+                    temporary_loop.close()
+            elif loop.is_running():
+                future = asyncio.run_coroutine_threadsafe(session.close(), loop)
+                if not _is_running_loop(loop):
+                    future.result(timeout=5)
+            else:
+                loop.run_until_complete(session.close())
+        self._http_sessions = {}
+
+    def get_ssl_context(self) -> Union[ssl.SSLContext, bool, None]:
+        """Returns the SSL setting for outgoing webhook requests that matches the verify
+        option of the REST client: None for the default verification, False to disable
+        it, or a context that trusts the CA bundle at the given path."""
+        verify = self.options["verify"]
+        if verify is True:
+            return None
+        if not verify:
+            return False
+        if self._ssl_context is None:
+            if os.path.isdir(verify):
+                self._ssl_context = ssl.create_default_context(capath=verify)
+            else:
+                self._ssl_context = ssl.create_default_context(cafile=verify)
+        return self._ssl_context
+
+    async def trigger_own_webhook(
+        self, webhook_id: str, data: Dict, loopback: bool = True
+    ):
+        """Triggers a a webhook with id webhook_id on the running WebHookServer.
+
+        Unless loopback is False, the event is passed to the EventHandler directly
+        rather than sent over the network, and a LoopbackResponse is returned.
+        """
         if not self.webhook_url:
             raise ValueError("The Driver is not aware of any running webhook server!")
 
-        async with ClientSession() as session:
-            return await session.post(
-                f"{self.webhook_url}/{webhook_id}",
-                json=data,
+        if loopback and self.webhook_loopback and self.webhook_server.running:
+            return await self._trigger_loopback(webhook_id, data)
+
+        return await self._http_post(f"{self.webhook_url}/{webhook_id}", json=data)
+
+    async def _trigger_loopback(self, webhook_id: str, data: Dict):
+        """Handles a self-triggered webhook just like the WebHookServer would."""
+        route = self.webhook_server.match_route(webhook_id)
+        if route is None:
+            return LoopbackResponse(200)
+
+        loop = asyncio.get_running_loop()
+        event = create_webhook_event(data, webhook_id)
+        if route:
+            # Fire-and-forget, so we don't wait for the listeners to finish.
+            event.responded = True
+            task = loop.create_task(self.webhook_loopback(event))
+            self._loopback_tasks.add(task)
+            task.add_done_callback(self._loopback_task_done)
+            return LoopbackResponse(202)
+
+        future = loop.create_future()
+        self._loopback_handlers[event.request_id] = (loop, future)
+        try:
+            await self.webhook_loopback(event)
+            result = await asyncio.wait_for(
+                future, timeout=self.webhook_server.settings.WEBHOOK_RESPONSE_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            return LoopbackResponse(
+                504, {"status": "failed", "reason": "Timed out waiting for a response."}
+            )
+        finally:
+            self._loopback_handlers.pop(event.request_id, None)
+
+        if result is NoResponse:
+            return LoopbackResponse(200)
+        return LoopbackResponse(200, result)
+
+    def _loopback_task_done(self, task: asyncio.Task):
+        self._loopback_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(
+                "Exception occurred in fire-and-forget webhook: ",
+                exc_info=task.exception(),
             )
 
+    async def call_webhook(
+        self, webhook_id: str, options: Dict, batch_delay: float = 0.0
+    ):
+        """Calls the mattermost incoming webhook with id webhook_id.
+
+        Non-blocking alternative to driver.webhooks.call_webhook, which re-uses the
+        shared HTTP session. If batch_delay is larger than 0, calls to the same webhook
+        (with the same options other than text and attachments) within that many seconds
+        are combined into a single post, with their texts separated by newlines.
+        """
+        if batch_delay <= 0:
+            return await self._post_webhook(webhook_id, options)
+
+        loop = asyncio.get_event_loop()
+        key = (
+            loop,
+            webhook_id,
+            json.dumps(
+                {
+                    name: value
+                    for name, value in options.items()
+                    if name not in ["text", "attachments"]
+                },
+                sort_keys=True,
+            ),
+        )
+        if key not in self._webhook_batches:
+            # This is the first call of a new batch, so schedule sending it.
+            self._webhook_batches[key] = ([], loop.create_future())
+            loop.create_task(self._send_webhook_batch(key, batch_delay))
+
+        batch, result = self._webhook_batches[key]
+        batch.append(options)
+        return await asyncio.shield(result)
+
+    async def _send_webhook_batch(self, key: Tuple, delay: float):
+        await asyncio.sleep(delay)
+        batch, result = self._webhook_batches.pop(key)
+        options = dict(batch[0])
+        texts = [call["text"] for call in batch if call.get("text")]
+        if texts:
+            options["text"] = "\n".join(texts)
+        attachments = [
+            attachment for call in batch for attachment in call.get("attachments", [])
+        ]
+        if attachments:
+            options["attachments"] = attachments
+
+        try:
+            result.set_result(await self._post_webhook(key[1], options))
+        except Exception as e:
+            result.set_exception(e)
+
+    async def _post_webhook(self, webhook_id: str, options: Dict):
+        url = "{scheme}://{url}:{port}/hooks/{webhook_id}".format(
+            webhook_id=webhook_id, **self.options
+        )
+        return await self._http_post(url, json=options, ssl=self.get_ssl_context())
+
+    async def _http_post(self, url: str, **kwargs):
+        """Posts to url with a keep-alive HTTP session.
+
+        Requests from other threads, e.g. sync listeners that use asyncio.run, are sent
+        from the main loop of the bot, so that they share its session instead of each
+        creating their own.
+        """
+        loop = asyncio.get_event_loop()
+        http_loop = self._http_loop
+        if http_loop is not None and http_loop is not loop and http_loop.is_running():
+            return await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(
+                    self._http_post(url, **kwargs), http_loop
+                )
+            )
+
+        # Close the sessions of loops that are gone, e.g. those of asyncio.run calls
+        for other_loop in [other for other in self._http_sessions if other.is_closed()]:
+            session = self._http_sessions.pop(other_loop, None)
+            if session is not None:
+                await session.close()
+
+        async with self.get_http_session().post(url, **kwargs) as response:
+            # Read the body, so that the connection goes back to the pool while the
+            # response can still be inspected.
+            await response.read()
+        return response
+
     def upload_files(
         self, file_paths: Sequence[Union[str, Path]], channel_id: str
     ) -> List[str]:
@@ -165,3 +446,16 @@ class Driver(mattermostdriver.Driver):
 
         result = self.files.upload_file(channel_id, file_dict)
         return list(info["id"] for info in result["file_infos"])
+
+
+def _is_running_loop(loop: asyncio.AbstractEventLoop) -> bool:
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+def _set_future_result(future: asyncio.Future, result):
+    # The future might have timed out in the meantime.
+    if not future.done():
+        future.set_result(result)
@@ -3,12 +3,18 @@ import json
 import logging
 import queue
 import re
+import time
 from collections import defaultdict
-from typing import Sequence
+from typing import Dict, List, Sequence, Tuple
 
 from snaketalk.driver import Driver
+from snaketalk.function import MessageFunction
+from snaketalk.metrics import DISPATCH_SECONDS, EVENTS_RECEIVED
 from snaketalk.plugins import Plugin
+from snaketalk.rate_limit import RateLimiter
+from snaketalk.recording import EventRecorder
 from snaketalk.settings import Settings
+from snaketalk.tracing import TRACER
 from snaketalk.webhook_server import NoResponse
 from snaketalk.wrappers import Message, WebHookEvent
 
@@ -29,6 +35,12 @@ class EventHandler(object):
         self.plugins = plugins
 
         self._name_matcher = re.compile(rf"^@?{self.driver.username}\:?\s?")
+        self.rate_limiter = RateLimiter(
+            default_limit=settings.RATE_LIMIT, reply=settings.RATE_LIMIT_REPLY
+        )
+        self.recorder = (
+            EventRecorder(settings.RECORD_FILE) if settings.RECORD_FILE else None
+        )
 
         # Collect the listeners from all plugins
         self.message_listeners = defaultdict(list)
@@ -39,6 +51,24 @@ class EventHandler(object):
             for matcher, functions in plugin.webhook_listeners.items():
                 self.webhook_listeners[matcher].extend(functions)
 
+        # The message listeners that can be triggered by a message, given whether it is
+        # a direct message and whether it mentions us. This way, we don't have to match
+        # messages against listeners that will ignore them anyway.
+        self._listener_index: Dict[
+            Tuple[bool, bool], Dict[re.Pattern, List[MessageFunction]]
+        ] = {}
+        for is_direct in [True, False]:
+            for is_mentioned in [True, False]:
+                listeners = defaultdict(list)
+                for matcher, functions in self.message_listeners.items():
+                    for function in functions:
+                        if function.direct_only and not is_direct:
+                            continue
+                        if function.needs_mention and not (is_direct or is_mentioned):
+                            continue
+                        listeners[matcher].append(function)
+                self._listener_index[(is_direct, is_mentioned)] = listeners
+
     def start(self):
         # This is blocking, will loop forever
         self.driver.init_websocket(self._handle_event)
@@ -63,10 +93,16 @@ class EventHandler(object):
             await asyncio.sleep(0.0001)
 
     async def _handle_event(self, data):
+        start = time.perf_counter()
+        if self.recorder is not None:
+            self.recorder.record(data)
         post = json.loads(data)
         event_action = post.get("event")
+        EVENTS_RECEIVED.inc(event=str(event_action))
         if event_action == "posted":
-            await self._handle_post(post)
+            with TRACER.trace("handle_event", event=event_action):
+                await self._handle_post(post)
+            DISPATCH_SECONDS.observe(time.perf_counter() - start)
 
     async def _handle_post(self, post):
         # For some reason these are JSON strings, so need to parse them first
@@ -79,29 +115,62 @@ class EventHandler(object):
             "", post["data"]["post"]["message"]
         )
         message = Message(post)
+        message.trace_id = TRACER.current_trace_id()
         if self._should_ignore(message):
             return
 
+        with TRACER.span("dispatch"):
+            self._dispatch_post(message)
+
+    def _dispatch_post(self, message: Message):
         # Find all the listeners that match this message, and have their plugins handle
         # the rest.
+        listeners = self._listener_index[
+            (
+                message.is_direct_message,
+                self.driver.user_id in message.mentions,
+            )
+        ]
         tasks = []
-        for matcher, functions in self.message_listeners.items():
+        for matcher, functions in listeners.items():
             match = matcher.match(message.text)
             if match:
                 groups = list([group for group in match.groups() if group != ""])
                 for function in functions:
-                    # Create an asyncio task to handle this callback
+                    if not function.allows_sender(message):
+                        self.driver.threadpool.add_task(
+                            self.driver.reply_to,
+                            message,
+                            "You do not have permission to perform this action!",
+                        )
+                        continue
+                    # Drop this invocation if the sender exceeded the rate limit
+                    allowed, reply = self.rate_limiter.check(function, message)
+                    if reply:
+                        self.driver.threadpool.add_task(
+                            self.driver.reply_to, message, self.rate_limiter.reply
+                        )
+                    if not allowed:
+                        continue
+                    # Create an asyncio task to handle this callback. It is named
+                    # after the function, so that we know what's running on the loop.
                     tasks.append(
                         asyncio.create_task(
                             function.plugin.call_function(
                                 function, message, groups=groups
-                            )
+                            ),
+                            name=function.name,
                         )
                     )
         # Execute the callbacks in parallel
         asyncio.gather(*tasks)
 
     async def _handle_webhook(self, event: WebHookEvent):
+        with TRACER.trace("handle_webhook", webhook_id=event.webhook_id):
+            event.trace_id = TRACER.current_trace_id()
+            self._dispatch_webhook(event)
+
+    def _dispatch_webhook(self, event: WebHookEvent):
         # Find all the listeners that match this webhook id, and have their plugins
         # handle the rest.
         tasks = []
@@ -112,7 +181,8 @@ class EventHandler(object):
                     # Create an asyncio task to handle this callback
                     tasks.append(
                         asyncio.create_task(
-                            function.plugin.call_function(function, event)
+                            function.plugin.call_function(function, event),
+                            name=function.name,
                         )
                     )
         # If this webhook doesn't correspond to any listeners, signal the WebHookServer
@@ -0,0 +1,415 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import WSMsgType, web
+
+from snaketalk.rate_limit import TokenBucket
+
+API_PATH = "/api/v4"
+
+
+def _create_id() -> str:
+    # Mattermost ids are 26 characters long
+    return uuid.uuid4().hex[:26]
+
+
+def _json_response(data, status: int = 200, headers: Dict = {}):
+    # The Driver only parses responses with exactly this content type, without charset
+    return web.Response(
+        body=json.dumps(data).encode(),
+        status=status,
+        headers={**headers, "Content-Type": "application/json"},
+    )
+
+
+def _error(status: int, message: str):
+    return _json_response(
+        {"id": "fake_server.error", "message": message, "status_code": status},
+        status=status,
+    )
+
+
+class FakeMattermostServer(object):
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8065,
+        bot_username: str = "bot",
+        token: str = "token",
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: Optional[Tuple[int, float]] = None,
+    ):
+        """In-memory stand-in for a Mattermost server, implementing the REST and
+        websocket endpoints that the Driver uses. Useful to run a Bot end-to-end without
+        a real server, e.g. for load testing.
+
+        Arguments:
+        - bot_username: str, name of the user that logs in with the token.
+        - token: str, the only access token that is accepted.
+        - latency: float, number of seconds to delay every REST response.
+        - error_rate: float, fraction of REST requests to fail with a 500 error.
+        - rate_limit: (requests, period) tuple, maximum number of REST requests per
+            period (in seconds) before responding with a 429 error, None for no limit.
+        """
+        self.host = host
+        self.port = port
+        self.token = token
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self._bucket = TokenBucket(*rate_limit) if rate_limit else None
+
+        self.users: Dict[str, Dict] = {}
+        self.channels: Dict[str, Dict] = {}
+        self.posts: Dict[str, Dict] = {}
+        self.reactions: List[Dict] = []
+        self.files: Dict[str, bytes] = {}
+        # time.perf_counter() at which each post was created, by post id
+        self.post_times: Dict[str, float] = {}
+        # Number of REST requests that were handled, by method and path
+        self.request_counts: Dict[Tuple[str, str], int] = {}
+
+        self.bot = self.add_user(bot_username)
+        self.running = False
+        self._websockets: List[web.WebSocketResponse] = []
+        self._seq = 0
+        self._posts_created = threading.Condition()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+        self.app = web.Application(middlewares=[self._fault_middleware])
+        self.app.add_routes(
+            [
+                web.get(f"{API_PATH}/websocket", self._websocket),
+                web.post(f"{API_PATH}/users/login", self._login),
+                web.get(f"{API_PATH}/users/{{user_id}}", self._get_user),
+                web.post(f"{API_PATH}/posts", self._create_post),
+                web.post(f"{API_PATH}/posts/ephemeral", self._create_ephemeral_post),
+                web.get(f"{API_PATH}/posts/{{post_id}}/thread", self._get_thread),
+                web.post(f"{API_PATH}/reactions", self._create_reaction),
+                web.post(f"{API_PATH}/files", self._upload_files),
+            ]
+        )
+        self.app_runner = web.AppRunner(self.app)
+
+    @property
+    def url(self):
+        return f"http://{self.host}"
+
+    def add_user(self, username: str, email: Optional[str] = None) -> Dict:
+        user = {
+            "id": _create_id(),
+            "username": username,
+            "email": email or f"{username}@example.com",
+            "roles": "system_user",
+        }
+        self.users[user["id"]] = user
+        return user
+
+    def add_channel(self, name: str, channel_type: str = "O") -> Dict:
+        """Adds a channel.
+
+        The type is "O" for public, "P" for private and "D" for direct message channels.
+        """
+        channel = {
+            "id": _create_id(),
+            "name": name,
+            "display_name": name,
+            "type": channel_type,
+            "team_id": "",
+        }
+        self.channels[channel["id"]] = channel
+        return channel
+
+    async def start(self):
+        self._loop = asyncio.get_event_loop()
+        await self.app_runner.setup()
+        site = web.TCPSite(self.app_runner, self.host, self.port)
+        await site.start()
+        self.running = True
+
+    async def stop(self):
+        for websocket in list(self._websockets):
+            await websocket.close()
+        await self.app_runner.cleanup()
+        self.running = False
+
+    def start_thread(self):
+        """Runs the server on its own event loop in a background thread, and returns
+        once it accepts connections."""
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop_thread(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def send_message(
+        self,
+        channel_id: str,
+        user_id: str,
+        message: str,
+        root_id: str = "",
+    ) -> Dict:
+        """Posts a message as the given user and broadcasts it over the websocket, like
+        a user writing in the Mattermost client would.
+
+        Can be called from any thread while the server is running.
+        """
+        post = self._store_post(channel_id, user_id, message, root_id)
+        asyncio.run_coroutine_threadsafe(self._broadcast_post(post), self._loop)
+        return post
+
+    @property
+    def num_clients(self):
+        """Number of authenticated websocket connections."""
+        return len(self._websockets)
+
+    def wait_for_clients(self, num_clients: int = 1, timeout=10):
+        """Waits until at least num_clients websockets are connected, and returns
+        whether that happened before the timeout."""
+        deadline = time.perf_counter() + timeout
+        while self.num_clients < num_clients:
+            if time.perf_counter() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def wait_for_posts(self, num_posts: int, user_id: Optional[str] = None, timeout=10):
+        """Waits until there are at least num_posts posts (by the given user, if any),
+        and returns whether that happened before the timeout."""
+
+        def enough_posts():
+            return (
+                len(
+                    [
+                        post
+                        for post in list(self.posts.values())
+                        if user_id is None or post["user_id"] == user_id
+                    ]
+                )
+                >= num_posts
+            )
+
+        with self._posts_created:
+            return self._posts_created.wait_for(enough_posts, timeout=timeout)
+
+    @web.middleware
+    async def _fault_middleware(self, request: web.Request, handler):
+        """Applies the configured latency, error rate and rate limit to REST requests,
+        and checks their access token."""
+        if request.path == f"{API_PATH}/websocket":
+            return await handler(request)
+
+        resource = request.match_info.route.resource
+        key = (request.method, resource.canonical if resource else request.path)
+        self.request_counts[key] = self.request_counts.get(key, 0) + 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if self._bucket is not None and not self._bucket.consume(time.monotonic()):
+            return _error(429, "Too many requests.")
+        if self.error_rate > 0 and random.random() < self.error_rate:
+            return _error(500, "Injected error.")
+        if (
+            request.path != f"{API_PATH}/users/login"
+            and request.headers.get("Authorization") != f"Bearer {self.token}"
+        ):
+            return _error(401, "Invalid or expired session.")
+        return await handler(request)
+
+    async def _websocket(self, request: web.Request):
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+
+        # The client first authenticates with its token
+        message = await websocket.receive()
+        if message.type != WSMsgType.TEXT:
+            return websocket
+        challenge = json.loads(message.data)
+        if challenge.get("data", {}).get("token") != self.token:
+            await websocket.close()
+            return websocket
+        await websocket.send_json(
+            {
+                "event": "hello",
+                "data": {"server_version": "fake"},
+                "broadcast": {"user_id": self.bot["id"]},
+                "seq": 0,
+            }
+        )
+        await websocket.send_json({"status": "OK", "seq_reply": challenge.get("seq")})
+
+        self._websockets.append(websocket)
+        try:
+            async for message in websocket:
+                if message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self._websockets.remove(websocket)
+        return websocket
+
+    def _store_post(
+        self,
+        channel_id: str,
+        user_id: str,
+        message: str,
+        root_id: str = "",
+        file_ids: Sequence[str] = [],
+        props: Dict = {},
+    ) -> Dict:
+        now = int(time.time() * 1000)
+        post = {
+            "id": _create_id(),
+            "create_at": now,
+            "update_at": now,
+            "edit_at": 0,
+            "delete_at": 0,
+            "is_pinned": False,
+            "user_id": user_id,
+            "channel_id": channel_id,
+            "root_id": root_id,
+            "parent_id": root_id,
+            "original_id": "",
+            "message": message,
+            "type": "",
+            "props": props,
+            "hashtags": "",
+            "file_ids": list(file_ids),
+            "pending_post_id": "",
+        }
+        with self._posts_created:
+            self.posts[post["id"]] = post
+            self.post_times[post["id"]] = time.perf_counter()
+            self._posts_created.notify_all()
+        return post
+
+    async def _broadcast_post(self, post: Dict):
+        channel = self.channels.get(post["channel_id"], {})
+        # Mention the users whose name appears in the message
+        mentioned_names = set(re.findall(r"@([\w.-]+)", post["message"]))
+        mentions = [
+            user["id"]
+            for user in self.users.values()
+            if user["username"] in mentioned_names
+        ]
+        self._seq += 1
+        data = {
+            "channel_display_name": channel.get("display_name", ""),
+            "channel_name": channel.get("name", ""),
+            "channel_type": channel.get("type", "O"),
+            "post": json.dumps(post),
+            "sender_name": f"@{self.users[post['user_id']]['username']}",
+            "team_id": channel.get("team_id", ""),
+        }
+        if len(mentions) > 0:
+            data["mentions"] = json.dumps(mentions)
+        event = {
+            "event": "posted",
+            "data": data,
+            "broadcast": {"channel_id": post["channel_id"]},
+            "seq": self._seq,
+        }
+        for websocket in list(self._websockets):
+            try:
+                await websocket.send_json(event)
+            except ConnectionError:
+                logging.debug("Websocket closed while broadcasting.")
+
+    async def _login(self, request: web.Request):
+        body = await request.json()
+        user = next(
+            (u for u in self.users.values() if u["username"] == body.get("login_id")),
+            None,
+        )
+        if user is None:
+            return _error(401, "Invalid login.")
+        return _json_response(user, headers={"Token": self.token})
+
+    async def _get_user(self, request: web.Request):
+        user_id = request.match_info["user_id"]
+        if user_id == "me":
+            user_id = self.bot["id"]
+        if user_id not in self.users:
+            return _error(404, "Unable to find the user.")
+        return _json_response(self.users[user_id])
+
+    async def _create_post(self, request: web.Request):
+        body = await request.json()
+        post = self._store_post(
+            body["channel_id"],
+            self.bot["id"],
+            body.get("message", ""),
+            root_id=body.get("root_id", ""),
+            file_ids=body.get("file_ids", []),
+            props=body.get("props", {}),
+        )
+        # Like a real server, send the new post to all websocket clients
+        await self._broadcast_post(post)
+        return _json_response(post, status=201)
+
+    async def _create_ephemeral_post(self, request: web.Request):
+        body = await request.json()
+        post = body["post"]
+        return _json_response(
+            {**post, "id": _create_id(), "user_id": self.bot["id"]}, status=201
+        )
+
+    async def _get_thread(self, request: web.Request):
+        post_id = request.match_info["post_id"]
+        if post_id not in self.posts:
+            return _error(404, "Unable to find the post.")
+        root_id = self.posts[post_id]["root_id"] or post_id
+        thread = {
+            id: post
+            for id, post in self.posts.items()
+            if id == root_id or post["root_id"] == root_id
+        }
+        # Posts are stored in creation order, the newest comes first in a thread
+        order = list(reversed(list(thread)))
+        return _json_response({"order": order, "posts": thread})
+
+    async def _create_reaction(self, request: web.Request):
+        body = await request.json()
+        if body.get("post_id") not in self.posts:
+            return _error(404, "Unable to find the post.")
+        reaction = {**body, "create_at": int(time.time() * 1000)}
+        self.reactions.append(reaction)
+        return _json_response(reaction, status=201)
+
+    async def _upload_files(self, request: web.Request):
+        form = await request.post()
+        file_infos = []
+        for name, field in form.items():
+            if name == "channel_id":
+                continue
+            file_id = _create_id()
+            self.files[file_id] = field.file.read()
+            file_infos.append(
+                {
+                    "id": file_id,
+                    "name": field.filename,
+                    "size": len(self.files[file_id]),
+                    "channel_id": form.get("channel_id"),
+                }
+            )
+        return _json_response({"file_infos": file_infos, "client_ids": []}, status=201)
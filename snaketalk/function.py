@@ -1,11 +1,13 @@
 from __future__ import annotations
 
 import asyncio
+import copy
+import functools
 import inspect
 import logging
 import re
 from abc import ABC, abstractmethod
-from typing import Callable, Optional, Sequence
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
 import click
 
@@ -13,6 +15,29 @@ from snaketalk.utils import completed_future, spaces
 from snaketalk.webhook_server import NoResponse
 from snaketalk.wrappers import Message, WebHookEvent
 
+# Parameter types whose parsed values are immutable and don't depend on anything but the
+# argument string.
+CACHEABLE_PARAM_TYPES = (
+    click.types.StringParamType,
+    click.types.IntParamType,
+    click.types.FloatParamType,
+    click.types.BoolParamType,
+    click.Choice,
+)
+
+
+def _is_cacheable_param(param: click.Parameter) -> bool:
+    """Returns whether parsing the given parameter always gives the same value for the
+    same arguments, i.e. it has no callback, environment variable, prompt or computed
+    default, and a plain type."""
+    return (
+        isinstance(param.type, CACHEABLE_PARAM_TYPES)
+        and param.callback is None
+        and param.envvar is None
+        and not getattr(param, "prompt", None)
+        and not callable(param.default)
+    )
+
 
 class Function(ABC):
     def __init__(
@@ -59,6 +84,9 @@ class MessageFunction(Function):
         direct_only: bool = False,
         needs_mention: bool = False,
         allowed_users: Sequence[str] = [],
+        executor: Optional[str] = None,
+        rate_limit: Optional[Tuple[int, float]] = None,
+        debounce: Optional[float] = None,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
@@ -66,15 +94,35 @@ class MessageFunction(Function):
         self.is_click_function = isinstance(self.function, click.Command)
         self.direct_only = direct_only
         self.needs_mention = needs_mention
-        self.allowed_users = [user.lower() for user in allowed_users]
+        # Usernames (case insensitive) or user ids of the users that may call this
+        self.allowed_users = frozenset(user.lower() for user in allowed_users)
+        # Where to execute this function if it is not a coroutine. None or "thread"
+        # means a thread pool, "process" means the process pool of the driver.
+        self.executor = executor
+        # Maximum number of calls per user and channel in a given number of seconds
+        self.rate_limit = rate_limit
+        # Number of seconds to collect messages per channel before calling the function
+        # once with all of them.
+        self.debounce = debounce
+        # Messages collected so far, per channel id
+        self.batches: Dict[str, List[Message]] = {}
+
+        if rate_limit is not None and not (rate_limit[0] > 0 and rate_limit[1] > 0):
+            raise ValueError(
+                "Rate limits need a positive number of calls and period, got"
+                f" {rate_limit[0]} calls per {rate_limit[1]} seconds!"
+            )
 
         if self.is_click_function:
-            _function = self.function.callback
-            if asyncio.iscoroutinefunction(_function):
+            if debounce is not None:
                 raise ValueError(
-                    "Combining click functions and coroutines is currently not supported!"
-                    " Consider using a regular function, which will be threaded by default."
+                    "Click commands can't be debounced, since each message has its own"
+                    " arguments!"
                 )
+            _function = self.function.callback
+            # Click parses the arguments synchronously, after which the callback
+            # coroutine can be awaited on the event loop.
+            self.is_coroutine = asyncio.iscoroutinefunction(_function)
             with click.Context(
                 self.function,
                 info_name=self.matcher.pattern.strip("^").split(" (.*)?")[0],
@@ -83,38 +131,96 @@ class MessageFunction(Function):
                 self.docstring = self.function.get_help(ctx).replace(
                     "\n", f"\n{spaces(8)}"
                 )
+                # Click would build a new parser and help option for every message.
+                # Since make_context gets both from the command, a private copy of
+                # the command can hand out the ones built here instead.
+                parser = self.function.make_parser(ctx)
+                params = self.function.get_params(ctx)
+            self._parse_command = copy.copy(self.function)
+            self._parse_command.make_parser = lambda ctx: parser
+            self._parse_command.get_params = lambda ctx: params
+            # Parsing the same arguments always gives the same result if all
+            # parameters are plain values with fixed defaults.
+            if all(_is_cacheable_param(param) for param in self.function.params):
+                self._parse_click_arguments = functools.lru_cache(maxsize=256)(
+                    self._parse_click_arguments
+                )
         else:
             _function = self.function
             self.docstring = self.function.__doc__
 
         self.name = _function.__qualname__
 
+        if self.executor not in [None, "thread", "process"]:
+            raise ValueError(
+                f"Unknown executor {self.executor} for function {self.name}, should be"
+                " one of None, 'thread' or 'process'."
+            )
+        if self.executor is not None and self.is_coroutine:
+            raise ValueError(
+                f"Function {self.name} is a coroutine and will run on the event loop,"
+                " so it can't have an executor."
+            )
+
         argspec = list(inspect.signature(_function).parameters.keys())
-        if not argspec[:2] == ["self", "message"]:
+        if self.is_click_function and argspec[:1] != ["self"]:
+            # Commands decorated with click.pass_context get the context first
+            argspec = argspec[1:]
+        if self.debounce is not None:
+            if not argspec == ["self", "messages"]:
+                raise TypeError(
+                    "A debounced listener function should have exactly two arguments:"
+                    f" `self` and `messages`, but function {self.name} has arguments"
+                    f" {argspec}."
+                )
+        elif not argspec[:2] == ["self", "message"]:
             raise TypeError(
                 "Any message listener function should at least have the positional"
                 f" arguments `self` and `message`, but function {self.name} has"
                 f" arguments {argspec}."
             )
 
-    def __call__(self, message: Message, *args):
-        # We need to return this so that if this MessageFunction was called with `await`,
-        # asyncio doesn't crash.
-        return_value = None if not self.is_coroutine else completed_future()
-
-        # Check if this message meets our requirements
+    def check_requirements(self, message: Message) -> bool:
+        """Returns whether the given message meets the requirements of this function,
+        and tells the sender if they are not allowed to call it."""
         if self.direct_only and not message.is_direct_message:
-            return return_value
+            return False
 
         if self.needs_mention and not (
             message.is_direct_message or self.plugin.driver.user_id in message.mentions
         ):
-            return return_value
+            return False
 
-        if self.allowed_users and message.sender_name not in self.allowed_users:
+        if not self.allows_sender(message):
             self.plugin.driver.reply_to(
                 message, "You do not have permission to perform this action!"
             )
+            return False
+
+        return True
+
+    def allows_sender(self, message: Message) -> bool:
+        """Returns whether the sender of the given message may call this function."""
+        return (
+            not self.allowed_users
+            or message.sender_name.lower() in self.allowed_users
+            or message.user_id in self.allowed_users
+        )
+
+    def __call__(self, message: Message, *args):
+        # We need to return this so that if this MessageFunction was called with `await`,
+        # asyncio doesn't crash.
+        return_value = None if not self.is_coroutine else completed_future()
+
+        # A debounced function receives a batch of messages, of which we only pass on
+        # the ones that meet our requirements.
+        if self.debounce is not None:
+            messages = [m for m in message if self.check_requirements(m)]
+            if len(messages) == 0:
+                return return_value
+            return self.function(self.plugin, messages)
+
+        if not self.check_requirements(message):
             return return_value
 
         if self.is_click_function:
@@ -123,18 +229,52 @@ class MessageFunction(Function):
                 # Turn space-separated string into list
                 args = args[0].strip(" ").split(" ")
             try:
-                ctx = self.function.make_context(
-                    info_name=self.plugin.__class__.__name__, args=list(args)
+                # Invoke the command through a context as usual, so that the callback
+                # can still use click.get_current_context or click.pass_context.
+                ctx = click.Context(
+                    self.function, info_name=self.plugin.__class__.__name__
                 )
-                ctx.params.update({"self": self.plugin, "message": message})
-                return self.function.invoke(ctx)
+                ctx.params = {
+                    **self._parse_click_arguments(tuple(args)),
+                    "self": self.plugin,
+                    "message": message,
+                }
             # If there are any missing arguments or the function is otherwise called
             # incorrectly, send the click message back to the user and print help string.
             except click.exceptions.ClickException as e:
-                return self.plugin.driver.reply_to(message, f"{e}\n{self.docstring}")
+                self.plugin.driver.reply_to(message, f"{e}\n{self.docstring}")
+                return return_value
+
+            if self.is_coroutine:
+                return self._invoke_click_coroutine(ctx, message)
+            try:
+                with ctx:
+                    return self.function.invoke(ctx)
+            except click.exceptions.ClickException as e:
+                self.plugin.driver.reply_to(message, f"{e}\n{self.docstring}")
+                return return_value
 
         return self.function(self.plugin, message, *args)
 
+    async def _invoke_click_coroutine(self, ctx: click.Context, message: Message):
+        # The context has to stay active until the callback has finished, not just
+        # until it has returned its coroutine.
+        try:
+            with ctx:
+                return await self.function.invoke(ctx)
+        except click.exceptions.ClickException as e:
+            self.plugin.driver.reply_to(message, f"{e}\n{self.docstring}")
+
+    def _parse_click_arguments(self, args: Tuple[str, ...]) -> Dict:
+        """Parses the given arguments into the keyword arguments of the click command.
+
+        Results are cached if possible, so the returned dict should not be modified.
+        """
+        ctx = self._parse_command.make_context(
+            info_name=self.plugin.__class__.__name__, args=list(args)
+        )
+        return ctx.params
+
     def get_help_string(self):
         string = super().get_help_string()
         if any(
@@ -142,6 +282,7 @@ class MessageFunction(Function):
                 self.needs_mention,
                 self.direct_only,
                 self.allowed_users,
+                self.debounce,
             ]
         ):
             # Print some information describing the usage settings.
@@ -157,6 +298,12 @@ class MessageFunction(Function):
             if self.allowed_users:
                 string += f"{spaces(4)}- Restricted to certain users.\n"
 
+            if self.debounce:
+                string += (
+                    f"{spaces(4)}- Handles all messages in a channel within"
+                    f" {self.debounce} seconds at once.\n"
+                )
+
         return string
 
 
@@ -167,9 +314,26 @@ def listen_to(
     direct_only=False,
     needs_mention=False,
     allowed_users=[],
+    executor=None,
+    rate_limit=None,
+    debounce=None,
 ):
     """Wrap the given function in a MessageFunction class so we can register some
-    properties."""
+    properties.
+
+    Regular (non-async) functions are executed on a thread pool by default. With
+    executor="process", CPU-bound functions run in the process pool of the driver
+    instead. Such functions receive a bare instance of their plugin, on which only the
+    create_post, react_to and reply_to methods of the driver are available.
+
+    rate_limit can be set to a (calls, period) tuple to allow each user at most that
+    many calls per period (in seconds) in each channel, overriding Settings.RATE_LIMIT.
+
+    If debounce is set to a number of seconds, the first matching message in a channel
+    starts a window of that length, during which all matching messages in that channel
+    are collected. The function is then called once with the whole batch, so it should
+    take a `messages` argument (a list of Messages) instead of `message`.
+    """
 
     def wrapped_func(func):
         reg = regexp
@@ -193,6 +357,9 @@ def listen_to(
             direct_only=direct_only,
             needs_mention=needs_mention,
             allowed_users=allowed_users,
+            executor=executor,
+            rate_limit=rate_limit,
+            debounce=debounce,
         )
 
     return wrapped_func
@@ -202,9 +369,11 @@ class WebHookFunction(Function):
     def __init__(
         self,
         *args,
+        fire_and_forget: bool = False,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
+        self.fire_and_forget = fire_and_forget
 
         if isinstance(self.function, click.Command):
             raise TypeError(
@@ -230,7 +399,9 @@ class WebHookFunction(Function):
 
         # If this is a coroutine, wrap it in a task with ensure_response as callback
         if self.is_coroutine:
-            task = asyncio.create_task(self.function(self.plugin, event))
+            task = asyncio.create_task(
+                self.function(self.plugin, event), name=self.name
+            )
             task.add_done_callback(ensure_response)
             return task
 
@@ -245,14 +416,22 @@ class WebHookFunction(Function):
 
 def listen_webhook(
     regexp: str,
+    *,
+    fire_and_forget=False,
 ):
-    """Wrap the given function in a WebHookFunction class with the specified regexp."""
+    """Wrap the given function in a WebHookFunction class with the specified regexp.
+
+    If fire_and_forget is True, the WebHookServer immediately acknowledges incoming
+    requests with a 202 response and the function is called in the background. It can
+    then no longer send a web response.
+    """
 
     def wrapped_func(func):
         pattern = re.compile(regexp)
         return WebHookFunction(
             func,
             matcher=pattern,
+            fire_and_forget=fire_and_forget,
         )
 
     return wrapped_func
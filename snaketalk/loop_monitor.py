@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from snaketalk.metrics import LOOP_LAG_SECONDS
+
+
+class LoopMonitor(object):
+    def __init__(self, interval: float = 0.25, block_threshold: Optional[float] = None):
+        """Continuously measures how late the event loop wakes up from a sleep, and
+        optionally detects the code that keeps it from doing so.
+
+        Arguments:
+        - interval: float, number of seconds between measurements.
+        - block_threshold: float, if set, a watchdog thread logs the stack trace of the
+            event loop whenever it has not responded for this many seconds, together
+            with the name of the running task (i.e. the listener function).
+        """
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.running = False
+        # Lag of the last measurement and the largest lag so far, in seconds
+        self.lag = 0.0
+        self.max_lag = 0.0
+        # Number of times the loop was found to be blocked
+        self.blocked_calls = 0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = time.perf_counter()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Schedules the monitor on the given loop, or the current one.
+
+        Measurements start once the loop runs.
+        """
+        self._loop = loop or asyncio.get_event_loop()
+        self.running = True
+        self._loop.create_task(self._measure_lag())
+
+    def stop(self):
+        self.running = False
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    async def _measure_lag(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        if self.block_threshold is not None:
+            self._watchdog = threading.Thread(target=self._watch, daemon=True)
+            self._watchdog.start()
+
+        while self.running:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self._heartbeat = time.perf_counter()
+            self.lag = max(self._heartbeat - start - self.interval, 0.0)
+            self.max_lag = max(self.max_lag, self.lag)
+            LOOP_LAG_SECONDS.observe(self.lag)
+
+    def _watch(self):
+        reported_heartbeat = None
+        while self.running:
+            time.sleep(self.block_threshold / 4)
+            heartbeat = self._heartbeat
+            blocked = time.perf_counter() - heartbeat - self.interval
+            # Report every stall only once
+            if blocked > self.block_threshold and heartbeat != reported_heartbeat:
+                reported_heartbeat = heartbeat
+                self._report_blocking(blocked)
+
+    def _report_blocking(self, blocked: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        self.blocked_calls += 1
+        task = asyncio.current_task(self._loop)
+        name = task.get_name() if task is not None else "a callback"
+        logging.warning(
+            f"Event loop blocked for at least {blocked:.2f} seconds by {name}, which is"
+            " currently at:\n" + "".join(traceback.format_stack(frame))
+        )
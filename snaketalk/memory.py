@@ -0,0 +1,100 @@
+import asyncio
+import concurrent.futures
+import gc
+import tracemalloc
+from typing import Dict, List, Optional
+
+import schedule
+
+from snaketalk.wrappers import Message, WebHookEvent
+
+# Types of which the live instances are counted, by display name.
+TRACKED_TYPES = {
+    "Message": Message,
+    "WebHookEvent": WebHookEvent,
+    "schedule.Job": schedule.Job,
+}
+
+
+class MemoryTracker(object):
+    def __init__(self, frames: int = 10):
+        """Compares the memory allocations of the bot against a baseline, to find out
+        where memory keeps growing.
+
+        Arguments:
+        - frames: int, number of stack frames to store per allocation when tracing.
+        """
+        self.frames = frames
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        # Whether we started tracemalloc, rather than someone else
+        self._started_tracing = False
+
+    @property
+    def tracing(self):
+        return self.baseline is not None
+
+    def start(self):
+        """Starts tracing memory allocations and takes the baseline snapshot."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        self.baseline = self._take_snapshot()
+
+    def stop(self):
+        """Drops the baseline, and stops tracing if start() was the one to start it."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self.baseline = None
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        # Ignore the memory used by tracemalloc itself
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+
+    def top_growth(self, limit: int = 10) -> List[tracemalloc.StatisticDiff]:
+        """Returns the allocation sites that grew the most since the baseline."""
+        if not self.tracing:
+            raise RuntimeError("Memory tracing hasn't been started.")
+        return self._take_snapshot().compare_to(self.baseline, "lineno")[:limit]
+
+    @staticmethod
+    def count_objects() -> Dict[str, int]:
+        """Counts the live instances of the tracked types and the pending futures."""
+        counts = {name: 0 for name in TRACKED_TYPES}
+        counts["pending futures"] = 0
+        for obj in gc.get_objects():
+            for name, cls in TRACKED_TYPES.items():
+                if isinstance(obj, cls):
+                    counts[name] += 1
+            if isinstance(obj, (asyncio.Future, concurrent.futures.Future)):
+                if not obj.done():
+                    counts["pending futures"] += 1
+        return counts
+
+    def report(self, limit: int = 10) -> str:
+        """Returns a markdown report of the object counts and, if tracing, the top
+        allocation sites since the baseline."""
+        report = "| Object | Count |\n| --- | --- |\n"
+        for name, count in self.count_objects().items():
+            report += f"| {name} | {count} |\n"
+
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            report += (
+                f"\nTraced memory: {current / 1024**2:.1f} MiB"
+                f" (peak {peak / 1024**2:.1f} MiB)\n\n"
+                "| Allocation site | Growth (KiB) | Blocks |\n| --- | --- | --- |\n"
+            )
+            for stat in self.top_growth(limit):
+                frame = stat.traceback[0]
+                report += (
+                    f"| {frame.filename}:{frame.lineno} | {stat.size_diff / 1024:+.1f} |"
+                    f" {stat.count_diff:+d} |\n"
+                )
+        return report
+
+
+# Memory tracker of this process, used by the !memory command of the ExamplePlugin.
+MEMORY_TRACKER = MemoryTracker()
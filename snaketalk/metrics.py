@@ -0,0 +1,325 @@
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# Upper bounds (in seconds) of the default histogram buckets.
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    math.inf,
+)
+
+
+def _format_labels(labels: LabelKey) -> str:
+    if len(labels) == 0:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric(object):
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        """Base class of the metrics that can be exposed in the Prometheus text format.
+
+        Every thread records its values in its own shard, so that recording a value
+        never has to wait for a lock. The shards are only combined when the metrics are
+        collected, at which point the shards of finished threads are folded into a
+        single one.
+        """
+        self.name = name
+        self.documentation = documentation
+        self._local = threading.local()
+        self._shards: Dict[threading.Thread, Dict] = {}
+        # Values recorded by threads that have finished
+        self._base: Dict = {}
+        # Totals reported by other processes, e.g. webhook server workers, by source
+        self._remote: Dict[Hashable, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _shard(self) -> Dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            # First value recorded by this thread
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards[threading.current_thread()] = shard
+            return shard
+
+    def _merge(self, into: Dict, shard: Dict):
+        """Adds the values of the shard to those of into."""
+        raise NotImplementedError
+
+    def _samples(self) -> List[Tuple[str, LabelKey, float]]:
+        raise NotImplementedError
+
+    def collect(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _shard_items(self):
+        with self._lock:
+            for thread in [thread for thread in self._shards if not thread.is_alive()]:
+                self._merge(self._base, self._shards.pop(thread))
+            shards = [self._base, *self._shards.values(), *self._remote.values()]
+            # Copy the items, since the owning threads might be adding new labels
+            items = [list(shard.items()) for shard in shards]
+        for shard_items in items:
+            yield from shard_items
+
+    def snapshot(self) -> Dict:
+        """Returns the totals of all threads, by label values."""
+        totals: Dict = {}
+        for key, value in self._shard_items():
+            self._merge(totals, {key: value})
+        return totals
+
+    def clear(self):
+        with self._lock:
+            self._local = threading.local()
+            self._shards = {}
+            self._base = {}
+            self._remote = {}
+
+    def set_remote(self, source: Hashable, totals: Dict):
+        """Replaces the totals reported by another process, identified by source, so
+        that they are included when collecting this metric."""
+        with self._lock:
+            self._remote[source] = totals
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        shard = self._shard()
+        key = tuple(sorted(labels.items()))
+        shard[key] = shard.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        key = tuple(sorted(labels.items()))
+        return sum(value for k, value in self._shard_items() if k == key)
+
+    def _merge(self, into: Dict, shard: Dict):
+        for key, value in list(shard.items()):
+            into[key] = into.get(key, 0) + value
+
+    def _samples(self):
+        return [
+            (self.name, key, value) for key, value in sorted(self.snapshot().items())
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+
+    def observe(self, value: float, **labels: str):
+        shard = self._shard()
+        key = tuple(sorted(labels.items()))
+        try:
+            counts = shard[key]
+        except KeyError:
+            # Bucket counts, followed by the sum and count of all observations
+            counts = shard[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def get_count(self, **labels: str) -> int:
+        key = tuple(sorted(labels.items()))
+        return sum(counts[-1] for k, counts in self._shard_items() if k == key)
+
+    def _merge(self, into: Dict, shard: Dict):
+        for key, counts in list(shard.items()):
+            # Always create a new list, since the old one may be read elsewhere
+            total = into.get(key)
+            into[key] = (
+                list(counts)
+                if total is None
+                else [a + b for a, b in zip(total, list(counts))]
+            )
+
+    def _samples(self):
+        samples = []
+        for key, total in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, total):
+                cumulative += count
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        key + (("le", _format_value(bound)),),
+                        cumulative,
+                    )
+                )
+            samples.append((f"{self.name}_sum", key, total[-2]))
+            samples.append((f"{self.name}_count", key, total[-1]))
+        return samples
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, label: Optional[str] = None):
+        """Gauge whose values are either changed through inc and dec, or computed by a
+        function when the metrics are collected.
+
+        Arguments:
+        - label: str, name of the label that distinguishes the values returned by the
+            function passed to set_function.
+        """
+        super().__init__(name, documentation)
+        self.label = label
+        self._function: Optional[Callable[[], Dict[str, float]]] = None
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], Dict[str, float]]):
+        """Sets the function that returns the current values, by label value."""
+        self._function = function
+
+    def _samples(self):
+        samples = super()._samples()
+        if self._function is not None:
+            samples += [
+                (self.name, ((self.label, label),), value)
+                for label, value in sorted(self._function().items())
+            ]
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        """Collection of metrics that are exposed together."""
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"A metric named {metric.name} was already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self.register(Counter(name, documentation))
+
+    def histogram(self, name: str, documentation: str, **kwargs) -> Histogram:
+        return self.register(Histogram(name, documentation, **kwargs))
+
+    def gauge(
+        self, name: str, documentation: str, label: Optional[str] = None
+    ) -> Gauge:
+        return self.register(Gauge(name, documentation, label))
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format."""
+        return "".join(metric.collect() for metric in self.metrics.values())
+
+    def clear(self):
+        """Forgets all recorded values, e.g. those inherited by a forked process."""
+        for metric in self.metrics.values():
+            metric.clear()
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Returns the totals of all metrics, by metric name."""
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def set_remote(self, source: Hashable, snapshot: Dict[str, Dict]):
+        """Includes the snapshot of the registry of another process, identified by
+        source, in the metrics of this one."""
+        for name, totals in snapshot.items():
+            if name in self.metrics:
+                self.metrics[name].set_remote(source, totals)
+
+
+# Metrics of this process, exposed on the /metrics route of the WebHookServer.
+REGISTRY = Registry()
+
+EVENTS_RECEIVED = REGISTRY.counter(
+    "snaketalk_events_received_total", "Websocket events received, by event type."
+)
+DISPATCH_SECONDS = REGISTRY.histogram(
+    "snaketalk_dispatch_seconds",
+    "Time between receiving a websocket event and dispatching it to the listeners.",
+)
+LISTENER_SECONDS = REGISTRY.histogram(
+    "snaketalk_listener_seconds", "Execution time of listener functions, by function."
+)
+THREADPOOL_QUEUE_SIZE = REGISTRY.gauge(
+    "snaketalk_threadpool_queue_size",
+    "Number of tasks waiting for a free worker, by pool.",
+    label="pool",
+)
+THREADPOOL_WAIT_SECONDS = REGISTRY.histogram(
+    "snaketalk_threadpool_wait_seconds",
+    "Time tasks spent waiting for a free worker thread.",
+)
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "snaketalk_event_loop_lag_seconds",
+    "How late the event loop woke up from a sleep.",
+)
+SCHEDULER_LAG_SECONDS = REGISTRY.histogram(
+    "snaketalk_scheduler_lag_seconds",
+    "Time between the scheduled and actual start of scheduled jobs.",
+)
+WEBHOOK_RESPONSE_SECONDS = REGISTRY.histogram(
+    "snaketalk_webhook_response_seconds",
+    "Time taken to respond to incoming webhook requests, by status code.",
+)
+WEBHOOK_PENDING_REQUESTS = REGISTRY.gauge(
+    "snaketalk_webhook_pending_requests",
+    "Webhook requests that are waiting for a response.",
+)
+WEBHOOK_TIMEOUTS = REGISTRY.counter(
+    "snaketalk_webhook_timeouts_total",
+    "Webhook requests that did not receive a response before the deadline.",
+)
+API_REQUEST_SECONDS = REGISTRY.histogram(
+    "snaketalk_api_request_seconds",
+    "Latency of Mattermost API requests, by HTTP method.",
+)
+API_ERRORS = REGISTRY.counter(
+    "snaketalk_api_errors_total", "Failed Mattermost API requests, by HTTP method."
+)
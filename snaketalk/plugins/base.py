@@ -1,14 +1,20 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 import re
+import time
 from abc import ABC
 from collections import defaultdict
-from typing import Dict, Optional, Sequence
+from typing import Dict, Optional, Sequence, Union
 
 from snaketalk.driver import Driver
 from snaketalk.function import Function, MessageFunction, WebHookFunction, listen_to
+from snaketalk.process_pool import ProcessPool
 from snaketalk.settings import Settings
+from snaketalk.stats import LISTENER_STATS, get_event_type
+from snaketalk.threadpool import ThreadPool
+from snaketalk.tracing import TRACER
 from snaketalk.wrappers import EventWrapper, Message
 
 
@@ -19,16 +25,24 @@ class Plugin(ABC):
     It will be called by the EventHandler whenever one of its listeners is triggered,
     but execution of the corresponding function is handled by the plugin itself. This
     way, you can implement multithreading or multiprocessing as desired.
+
+    By default, regular (non-async) functions run on the shared threadpool of the
+    driver. A plugin can isolate its functions from other plugins by setting `executor`
+    on the subclass to "thread" or "process" for a dedicated pool of `executor_workers`
+    threads or processes, or "inline" to call them directly on the event loop.
     """
 
+    executor: Optional[str] = None
+    executor_workers: int = 1
+
     def __init__(self):
         self.driver = None
-        self.message_listeners: Dict[
-            re.Pattern, Sequence[MessageFunction]
-        ] = defaultdict(list)
-        self.webhook_listeners: Dict[
-            re.Pattern, Sequence[WebHookFunction]
-        ] = defaultdict(list)
+        self.pool: Optional[Union[ThreadPool, ProcessPool]] = None
+        self._help_string: Optional[str] = None
+        self.message_listeners: Dict[re.Pattern, Sequence[MessageFunction]]
+        self.message_listeners = defaultdict(list)
+        self.webhook_listeners: Dict[re.Pattern, Sequence[WebHookFunction]]
+        self.webhook_listeners = defaultdict(list)
 
         # We have to register the help function listeners at runtime to prevent the
         # Function object from being shared across different Plugins.
@@ -38,25 +52,46 @@ class Plugin(ABC):
     def initialize(self, driver: Driver, settings: Optional[Settings] = None):
         self.driver = driver
 
+        if self.executor == "thread":
+            self.pool = ThreadPool(num_workers=self.executor_workers)
+        elif self.executor == "process":
+            self.pool = ProcessPool(num_workers=self.executor_workers)
+        elif self.executor not in [None, "inline"]:
+            raise ValueError(
+                f"Unknown executor {self.executor} for {self.__class__.__name__},"
+                " should be one of None, 'thread', 'process' or 'inline'."
+            )
+        if self.pool is not None:
+            # Make the pool visible next to the default threadpool
+            driver.plugin_pools[self.__class__.__name__] = self.pool
+
         # Register listeners for any listener functions we might have
         for attribute in dir(self):
             attribute = getattr(self, attribute)
             if isinstance(attribute, Function):
                 # Register this function and any potential siblings
                 for function in [attribute] + attribute.siblings:
-                    function.plugin = self
-                    if isinstance(function, MessageFunction):
-                        self.message_listeners[function.matcher].append(function)
-                    elif isinstance(function, WebHookFunction):
-                        self.webhook_listeners[function.matcher].append(function)
-                    else:
-                        raise TypeError(
-                            f"{self.__class__.__name__} has a function of unsupported"
-                            f" type {type(function)}."
-                        )
+                    self.register_function(function)
 
+        # Build the help string once, rather than on every help request
+        self.get_help_string()
         return self
 
+    def register_function(self, function: Function):
+        """Registers a listener function on this plugin."""
+        function.plugin = self
+        if isinstance(function, MessageFunction):
+            self.message_listeners[function.matcher].append(function)
+        elif isinstance(function, WebHookFunction):
+            self.webhook_listeners[function.matcher].append(function)
+        else:
+            raise TypeError(
+                f"{self.__class__.__name__} has a function of unsupported"
+                f" type {type(function)}."
+            )
+        # The listeners changed, so the help string has to be rebuilt
+        self._help_string = None
+
     def on_start(self):
         """Will be called after initialization.
 
@@ -73,20 +108,94 @@ class Plugin(ABC):
         logging.debug(f"Plugin {self.__class__.__name__} stopped!")
         return self
 
+    def start_pool(self):
+        """Starts the dedicated thread pool of this plugin, if it has one.
+
+        Process pools start by themselves once they are needed.
+        """
+        if isinstance(self.pool, ThreadPool):
+            self.pool.start()
+
+    def stop_pool(self):
+        """Stops the dedicated thread or process pool of this plugin, if it has one."""
+        if self.pool is not None and self.pool.alive:
+            self.pool.stop()
+
     async def call_function(
         self,
         function: Function,
         event: EventWrapper,
         groups: Optional[Sequence[str]] = [],
     ):
+        if isinstance(function, MessageFunction) and function.debounce is not None:
+            batch = function.batches.setdefault(event.channel_id, [])
+            batch.append(event)
+            # The first message of a batch waits for the others, and then passes on
+            # the whole batch.
+            if len(batch) > 1:
+                return
+            try:
+                await asyncio.sleep(function.debounce)
+            finally:
+                # If we were cancelled, the batch is dropped rather than dispatched,
+                # and the next message starts a new one.
+                event = function.batches.pop(event.channel_id)
+            groups = []
+
         if function.is_coroutine:
-            await function(event, *groups)  # type:ignore
+            start = time.perf_counter()
+            success = False
+            try:
+                with TRACER.span(function.name):
+                    await function(event, *groups)  # type: ignore
+                success = True
+            finally:
+                self._record_call(function, event, start, success)
+            return
+
+        executor = self.executor
+        # An executor on the function itself takes precedence over the plugin-wide one
+        if isinstance(function, MessageFunction) and function.executor is not None:
+            executor = function.executor
+        elif isinstance(function, WebHookFunction) and executor == "process":
+            # Webhook functions always need access to the full driver
+            executor = None
+
+        if executor == "inline":
+            start = time.perf_counter()
+            success = False
+            try:
+                with TRACER.span(function.name):
+                    function(event, *groups)
+                success = True
+            finally:
+                self._record_call(function, event, start, success)
+        elif executor == "process":
+            # Use the plugin-specific pool if we have one, and the global one if not
+            pool = self.pool if isinstance(self.pool, ProcessPool) else None
+            (pool or self.driver.process_pool).add_task(function, event, *groups)
         else:
-            # By default, we use the global threadpool of the driver, but we could use
-            # a plugin-specific thread or process pool if we wanted.
-            self.driver.threadpool.add_task(function, event, *groups)
+            pool = self.pool if isinstance(self.pool, ThreadPool) else None
+            (pool or self.driver.threadpool).add_task(function, event, *groups)
+
+    def _record_call(
+        self, function: Function, event: EventWrapper, start: float, success: bool
+    ):
+        """Records a call that ran on the event loop, so without any queue wait."""
+        LISTENER_STATS.record(
+            function.name,
+            event_type=get_event_type(event),
+            queue_wait=0.0,
+            duration=time.perf_counter() - start,
+            success=success,
+        )
 
     def get_help_string(self):
+        if self._help_string is None:
+            self._help_string = self._build_help_string()
+        return self._help_string
+
+    def _build_help_string(self):
         string = f"Plugin {self.__class__.__name__} has the following functions:\n"
         string += "----\n"
         for functions in self.message_listeners.values():
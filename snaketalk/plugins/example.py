@@ -1,13 +1,20 @@
 import asyncio
 import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+from typing import List, Optional
 
 import click
 import mattermostdriver
 
+from snaketalk.cache import cached_reply
+from snaketalk.memory import MEMORY_TRACKER
 from snaketalk.plugins.base import Plugin, listen_to
+from snaketalk.profiler import SamplingProfiler
 from snaketalk.scheduler import schedule
+from snaketalk.stats import LISTENER_STATS
 from snaketalk.wrappers import Message
 
 
@@ -19,21 +26,86 @@ class ExamplePlugin(Plugin):
         """Showcases a function with restricted access."""
         self.driver.reply_to(message, "Access allowed!")
 
-    @listen_to("^busy|jobs$", re.IGNORECASE, needs_mention=True)
-    async def busy_reply(self, message: Message):
-        """Show the number of busy worker threads."""
-        busy = self.driver.threadpool.get_busy_workers()
-        self.driver.reply_to(
-            message,
-            f"Number of busy worker threads: {busy}",
+    @listen_to("^!stats$", allowed_users=["admin", "root"])
+    async def stats_reply(self, message: Message):
+        """Shows how busy the worker pools are and how each listener performs."""
+        pools = {"default": self.driver.threadpool, **self.driver.plugin_pools}
+        reply = "| Pool | Busy workers | Queued tasks |\n| --- | --- | --- |\n"
+        for name, pool in pools.items():
+            reply += (
+                f"| {name} | {pool.get_busy_workers()}/{pool.num_workers} |"
+                f" {pool.get_queue_size()} |\n"
+            )
+
+        reply += (
+            "\n| Listener | Calls | Failures | Time p50/p90/p99 (ms) |"
+            " Queue wait p90 (ms) |\n| --- | --- | --- | --- | --- |\n"
         )
+        for name, stats in LISTENER_STATS.summary().items():
+            duration = "/".join(
+                f"{value * 1000:.1f}" for value in stats["duration"].values()
+            )
+            reply += (
+                f"| {name} | {stats['calls']} | {stats['failures']} | {duration} |"
+                f" {stats['queue_wait']['p90'] * 1000:.1f} |\n"
+            )
+        self.driver.reply_to(message, reply)
+
+    @listen_to("^!profile ([0-9]+)$", allowed_users=["admin", "root"])
+    async def profile(self, message: Message, seconds: str):
+        """Profiles all bot threads for the given number of seconds (at most 300), and
+        replies with the samples in the collapsed stack format for flame graphs."""
+        seconds = min(int(seconds), 300)
+        self.driver.reply_to(message, f"Profiling for {seconds} seconds...")
+        profiler = SamplingProfiler()
+        # Sample from a dedicated thread, so that profiling doesn't occupy one of the
+        # threadpool workers for minutes.
+        with ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="profiler"
+        ) as executor:
+            await asyncio.get_event_loop().run_in_executor(
+                executor, profiler.run, seconds
+            )
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / f"profile_{datetime.now():%Y%m%d_%H%M%S}.txt"
+            profiler.write_collapsed(path)
+            self.driver.reply_to(
+                message,
+                f"Collected {sum(profiler.samples.values())} samples.",
+                file_paths=[path],
+            )
+
+    @listen_to("^!memory ?(start|stop)?$", allowed_users=["admin", "root"])
+    def memory(self, message: Message, action: Optional[str] = None):
+        """Reports the number of live bot objects.
+
+        `!memory start` takes a baseline of the memory allocations, after which
+        `!memory` also shows where memory grew since then. `!memory stop` stops tracing
+        allocations again.
+        """
+        if action == "start":
+            MEMORY_TRACKER.start()
+            self.driver.reply_to(message, "Started tracing memory allocations.")
+            return
+        if action == "stop":
+            MEMORY_TRACKER.stop()
+            self.driver.reply_to(message, "Stopped tracing memory allocations.")
+            return
+
+        reply = MEMORY_TRACKER.report()
+        reply += f"\nScheduled jobs: {len(schedule.jobs)}\n"
+        reply += f"Queued tasks: {self.driver.threadpool.get_queue_size()}\n"
+        if self.driver.webhook_server is not None:
+            pending = self.driver.webhook_server.get_pending_requests()
+            reply += f"Pending webhook requests: {pending}\n"
+        self.driver.reply_to(message, reply)
 
     @listen_to("hello_click", needs_mention=True)
     @click.command(help="An example click command with various arguments.")
     @click.argument("POSITIONAL_ARG", type=str)
     @click.option("--keyword-arg", type=float, default=5.0, help="A keyword arg.")
     @click.option("-f", "--flag", is_flag=True, help="Can be toggled.")
-    def hello_click(
+    async def hello_click(
         self, message: Message, positional_arg: str, keyword_arg: float, flag: bool
     ):
         response = (
@@ -75,7 +147,7 @@ class ExamplePlugin(Plugin):
 
     @listen_to("^!hello_webhook$", re.IGNORECASE)
     async def hello_webhook(self, message: Message):
-        self.driver.webhooks.call_webhook(
+        await self.driver.call_webhook(
             "eauegoqk4ibxigfybqrsfmt48r",
             options={
                 "username": "webhook_test",  # Requires the right webhook permissions
@@ -94,22 +166,27 @@ class ExamplePlugin(Plugin):
         )
 
     @listen_to("^!info$")
+    @cached_reply(ttl=60, key=("user", "channel"))
     async def info(self, message: Message):
         """Responds with the user info of the requesting user."""
         user_email = self.driver.get_user_info(message.user_id)["email"]
-        reply = (
+        return (
             f"TEAM-ID: {message.team_id}\nUSERNAME: {message.sender_name}\n"
             f"EMAIL: {user_email}\nUSER-ID: {message.user_id}\n"
             f"IS-DIRECT: {message.is_direct_message}\nMENTIONS: {message.mentions}\n"
             f"MESSAGE: {message.text}"
         )
-        self.driver.reply_to(message, reply)
 
     @listen_to("^ping$", re.IGNORECASE, needs_mention=True)
     async def ping_reply(self, message: Message):
         """Pong."""
         self.driver.reply_to(message, "pong")
 
+    @listen_to("^alert: ", debounce=2)
+    def alerts(self, messages: List[Message]):
+        """Acknowledges all alerts posted in a channel within two seconds at once."""
+        self.driver.reply_to(messages[0], f"Received {len(messages)} alert(s)!")
+
     @listen_to("^reply at (.*)$", re.IGNORECASE, needs_mention=True)
     def schedule_once(self, message: Message, trigger_time: str):
         """Schedules a reply to be sent at the given time.
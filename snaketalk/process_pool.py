@@ -0,0 +1,192 @@
+import functools
+import importlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from snaketalk.function import MessageFunction
+from snaketalk.stats import LISTENER_STATS, get_event_type
+from snaketalk.wrappers import Message
+
+# Driver methods that can be called from a worker process. They are executed in the
+# main process, and their return values are not passed back.
+PROXIED_DRIVER_METHODS = ["create_post", "react_to", "reply_to"]
+
+# Set in every worker process by _initialize_worker.
+_driver_proxy = None
+
+
+class DriverProxy:
+    """Takes the place of the Driver in worker processes, forwarding supported calls to
+    the Driver in the main process."""
+
+    def __init__(self, calls: multiprocessing.Queue, user_id: str, username: str):
+        self._calls = calls
+        self.user_id = user_id
+        self.username = username
+
+    def __getattr__(self, name: str):
+        if name not in PROXIED_DRIVER_METHODS:
+            raise AttributeError(
+                f"Driver.{name} can't be used from a worker process. Only"
+                f" {PROXIED_DRIVER_METHODS} are supported."
+            )
+
+        def call(*args, **kwargs):
+            self._calls.put((name, args, kwargs))
+
+        return call
+
+
+def _initialize_worker(calls: multiprocessing.Queue, user_id: str, username: str):
+    global _driver_proxy
+    _driver_proxy = DriverProxy(calls, user_id, username)
+
+
+def _function_reference(function: MessageFunction) -> Tuple[str, str, str, int]:
+    """Returns a picklable reference to the given function, consisting of the module and
+    qualified name of the function it wraps and the pattern and flags of its matcher."""
+    wrapped = function.function
+    if function.is_click_function:
+        wrapped = wrapped.callback
+    return (
+        wrapped.__module__,
+        wrapped.__qualname__,
+        function.matcher.pattern,
+        function.matcher.flags,
+    )
+
+
+def _run_function(reference: Tuple[str, str, str, int], message: Message, *args):
+    """Looks up the referenced MessageFunction in this worker process and calls it.
+
+    Returns the execution time of the function in seconds.
+    """
+    module, qualname, pattern, flags = reference
+    *class_path, name = qualname.split(".")
+    plugin_class = importlib.import_module(module)
+    for attribute in class_path:
+        plugin_class = getattr(plugin_class, attribute)
+
+    # The same function can be registered with multiple listeners, so find the one
+    # that was triggered.
+    outer = getattr(plugin_class, name)
+    function = next(
+        f
+        for f in [outer] + outer.siblings
+        if f.matcher.pattern == pattern and f.matcher.flags == flags
+    )
+
+    # The plugin instance lives in the main process, so we create a bare one that
+    # only has access to the proxied driver.
+    plugin = plugin_class.__new__(plugin_class)
+    plugin.driver = _driver_proxy
+    function.plugin = plugin
+    start = time.perf_counter()
+    function(message, *args)
+    return time.perf_counter() - start
+
+
+class ProcessPool(object):
+    def __init__(self, num_workers: Optional[int] = None):
+        """Process pool class to run CPU-bound MessageFunctions on multiple cores.
+
+        The worker processes are only started once the first task is added.
+
+        Arguments:
+        - num_workers: int, how many processes to run simultaneously. Defaults to the
+            number of CPUs.
+        """
+        self.num_workers = num_workers or os.cpu_count()
+        self.alive = False
+        self.driver = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._driver_calls: Optional[multiprocessing.Queue] = None
+        self._driver_thread: Optional[threading.Thread] = None
+        self._pending_tasks = 0
+        self._lock = threading.Lock()
+
+    def add_task(self, function: MessageFunction, message: Message, *args):
+        if not self.alive:
+            self.start(function.plugin.driver)
+
+        with self._lock:
+            self._pending_tasks += 1
+        future = self._executor.submit(
+            _run_function, _function_reference(function), message, *args
+        )
+        future.add_done_callback(
+            functools.partial(
+                self._task_done,
+                function.name,
+                get_event_type(message),
+                time.perf_counter(),
+            )
+        )
+
+    def get_busy_workers(self):
+        return min(self._pending_tasks, self.num_workers)
+
+    def get_queue_size(self):
+        """Returns the number of tasks that are waiting for a free worker."""
+        return max(self._pending_tasks - self.num_workers, 0)
+
+    def start(self, driver):
+        self.alive = True
+        self.driver = driver
+        self._driver_calls = multiprocessing.Queue()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            initializer=_initialize_worker,
+            initargs=(self._driver_calls, driver.user_id, driver.username),
+        )
+        # Execute the driver calls from the worker processes on a dedicated thread.
+        self._driver_thread = threading.Thread(target=self._handle_driver_calls)
+        self._driver_thread.start()
+
+    def stop(self):
+        """Waits for all running tasks to finish and stops the worker processes."""
+        if not self.alive:
+            return
+        self.alive = False
+        logging.info("Stopping process pool, waiting for processes...")
+        self._executor.shutdown(wait=True)
+        # Signal the driver thread that it's time to stop
+        self._driver_calls.put(None)
+        self._driver_thread.join()
+        logging.info("Process pool stopped.")
+
+    def _task_done(self, name: str, event_type: str, submitted: float, future: Future):
+        with self._lock:
+            self._pending_tasks -= 1
+        total = time.perf_counter() - submitted
+        if future.exception() is not None:
+            logging.error(
+                "Exception occurred in worker process: ", exc_info=future.exception()
+            )
+            # We don't know how long the function ran before failing
+            duration = total
+        else:
+            duration = future.result()
+        LISTENER_STATS.record(
+            name,
+            event_type=event_type,
+            queue_wait=max(total - duration, 0.0),
+            duration=duration,
+            success=future.exception() is None,
+        )
+
+    def _handle_driver_calls(self):
+        while True:
+            call = self._driver_calls.get()
+            if call is None:
+                break
+            name, args, kwargs = call
+            try:
+                getattr(self.driver, name)(*args, **kwargs)
+            except Exception:
+                logging.exception("Exception occurred: ")
@@ -0,0 +1,55 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+from typing import Union
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    # Semicolons separate the frames in the collapsed stack format
+    label = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label.replace(";", ":")
+
+
+class SamplingProfiler(object):
+    def __init__(self, interval: float = 0.005):
+        """Statistical profiler that periodically records the stacks of all running
+        threads, without slowing down the profiled code itself.
+
+        Arguments:
+        - interval: float, number of seconds between samples.
+        """
+        self.interval = interval
+        # Number of samples per collapsed stack
+        self.samples: Counter = Counter()
+
+    def run(self, duration: float) -> Counter:
+        """Samples all threads except the calling one for the given number of seconds,
+        and returns the samples collected so far."""
+        own_thread = threading.get_ident()
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)).replace(";", ":"))
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+        return self.samples
+
+    def write_collapsed(self, path: Union[str, Path]):
+        """Writes the samples in the collapsed stack format, which tools like
+        flamegraph.pl and speedscope turn into a flame graph."""
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
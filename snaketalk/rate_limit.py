@@ -0,0 +1,107 @@
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from snaketalk.function import MessageFunction
+from snaketalk.wrappers import Message
+
+
+class TokenBucket(object):
+    """Allows bursts of up to `calls` invocations, refilling at a rate of `calls` per
+    `period` seconds."""
+
+    __slots__ = ["calls", "period", "tokens", "last_update"]
+
+    def __init__(self, calls: int, period: float):
+        if not (calls > 0 and period > 0):
+            raise ValueError(
+                f"Rate limits need a positive number of calls and period, got {calls}"
+                f" calls per {period} seconds!"
+            )
+        self.calls = calls
+        self.period = period
+        self.tokens = float(calls)
+        self.last_update = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(
+            self.calls,
+            self.tokens + (now - self.last_update) * self.calls / self.period,
+        )
+        self.last_update = now
+
+    def consume(self, now: float) -> bool:
+        """Takes a token if there is one, and returns whether that succeeded."""
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class RateLimiter(object):
+    def __init__(
+        self,
+        default_limit: Optional[Tuple[int, float]] = None,
+        reply: Optional[str] = None,
+    ):
+        """Keeps track of how often each user triggers each listener in each channel,
+        and decides whether new invocations should be dropped.
+
+        Arguments:
+        - default_limit: (calls, period) tuple, the limit for listeners that don't
+            specify their own, or None to not limit them.
+        - reply: str, message to send to users that exceed the limit. It is sent at
+            most once per period, or never if None.
+        """
+        if default_limit is not None:
+            # Raises on invalid limits now rather than on the first message.
+            TokenBucket(*default_limit)
+        self.default_limit = default_limit
+        self.reply = reply
+        self._buckets: Dict[Tuple[MessageFunction, str, str], TokenBucket] = {}
+        # When we last told each user to slow down.
+        self._last_replies: Dict[Tuple[MessageFunction, str, str], float] = {}
+        self._checks = 0
+        # Number of dropped invocations per listener. Keyed by the function itself,
+        # since listeners of different plugins can have the same name.
+        self.dropped: Dict[MessageFunction, int] = defaultdict(int)
+
+    def check(self, function: MessageFunction, message: Message) -> Tuple[bool, bool]:
+        """Returns whether the function may be called for this message, and whether the
+        sender should be told to slow down."""
+        limit = function.rate_limit or self.default_limit
+        if limit is None:
+            return True, False
+
+        now = time.monotonic()
+        key = (function, message.user_id, message.channel_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*limit)
+
+        self._checks += 1
+        if self._checks % 1000 == 0:
+            self._purge(now)
+
+        if bucket.consume(now):
+            return True, False
+
+        self.dropped[function] += 1
+        # Only tell the sender to slow down once per period
+        last_reply = self._last_replies.get(key)
+        if self.reply is None or (
+            last_reply is not None and now - last_reply < bucket.period
+        ):
+            return False, False
+        self._last_replies[key] = now
+        return False, True
+
+    def _purge(self, now: float):
+        """Forgets about buckets that are full again, since they are equivalent to new
+        ones."""
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.calls:
+                del self._buckets[key]
+                self._last_replies.pop(key, None)
@@ -0,0 +1,104 @@
+import asyncio
+import gzip
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Iterator, Optional, Tuple, Union
+
+
+class EventRecorder(object):
+    def __init__(self, path: Union[str, Path], flush_interval: float = 1.0):
+        """Appends raw websocket frames, together with the time they were received, to a
+        gzip-compressed JSON lines file.
+
+        Every run appends a new gzip member to the file, so existing recordings are
+        never overwritten.
+
+        Arguments:
+        - path: the file to record to, conventionally ending in .jsonl.gz.
+        - flush_interval: float, a frame is written to disk at most this many seconds
+            after it was recorded, so that a crash loses at most that much of the
+            recording. Outside of an event loop, every frame is written immediately.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def record(self, data: Union[str, bytes], timestamp: Optional[float] = None):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        if timestamp is None:
+            timestamp = time.time()
+        self._file.write(json.dumps({"time": timestamp, "data": data}) + "\n")
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or self.flush_interval <= 0:
+            self.flush()
+        else:
+            # Flush once the interval has passed, even if no more frames arrive
+            self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        self._flush_handle = None
+        if not self._file.closed:
+            self._file.flush()
+
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._file.closed:
+            self._file.close()
+
+
+def read_recording(path: Union[str, Path]) -> Iterator[Tuple[float, str]]:
+    """Yields the (timestamp, frame) pairs of a recording in order.
+
+    A recording that was cut off, e.g. because the bot crashed, is read up to the last
+    frame that was written to disk.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                # The last line may have been cut off halfway
+                if not line.endswith("\n"):
+                    break
+                frame = json.loads(line)
+                yield frame["time"], frame["data"]
+        except EOFError:
+            logging.warning(f"Recording {path} ends abruptly, replaying what's left.")
+
+
+async def replay_recording(
+    path: Union[str, Path],
+    handle_event: Callable[[str], Awaitable],
+    speed: float = 1.0,
+) -> int:
+    """Feeds the frames of a recording to handle_event, e.g. EventHandler._handle_event,
+    with the same time in between them as when they were recorded. Returns the number of
+    frames replayed.
+
+    Arguments:
+    - speed: float, how much faster than real time to replay, 0 to replay every frame
+        as soon as the previous one was handled.
+    """
+    start = time.perf_counter()
+    first_timestamp = None
+    num_frames = 0
+    for timestamp, data in read_recording(path):
+        if first_timestamp is None:
+            first_timestamp = timestamp
+        delay = 0.0
+        if speed > 0:
+            delay = start + (timestamp - first_timestamp) / speed - time.perf_counter()
+        # Always yield to the loop, so that the listeners get to run in between
+        await asyncio.sleep(max(delay, 0))
+        await handle_event(data)
+        num_frames += 1
+    return num_frames
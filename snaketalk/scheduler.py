@@ -7,6 +7,8 @@ from typing import Optional
 import schedule
 from schedule import default_scheduler
 
+from snaketalk.metrics import SCHEDULER_LAG_SECONDS
+
 
 class OneTimeJob(schedule.Job):
     # Override schedule.Job._schedule_next_run to avoid periodic job generation.
@@ -37,6 +39,10 @@ def _run_job(self, job):
     Either way, this waits for the result in a dedicated thread to prevent blocking the
     event loop.
     """
+    if job.next_run is not None:
+        SCHEDULER_LAG_SECONDS.observe(
+            max((datetime.now() - job.next_run).total_seconds(), 0)
+        )
 
     def launch_and_wait():
         # Launch job in a dedicated process and send the result through a pipe.
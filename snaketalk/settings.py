@@ -1,5 +1,5 @@
 from dataclasses import dataclass, field
-from typing import Sequence
+from typing import Optional, Sequence, Tuple
 
 
 @dataclass
@@ -18,10 +18,37 @@ class Settings:
     WEBHOOK_HOST_ENABLED: bool = True
     WEBHOOK_HOST_URL: str = "http://127.0.0.1"
     WEBHOOK_HOST_PORT: int = 8579
+    # How many seconds a webhook request may wait for a response, None to wait forever
+    WEBHOOK_RESPONSE_TIMEOUT: Optional[float] = 30.0
+    # Number of webhook server processes. If larger than 1, they will share the same
+    # port through SO_REUSEPORT.
+    WEBHOOK_HOST_WORKERS: int = 1
+    # Webhook requests with a larger body (in bytes) are rejected
+    WEBHOOK_MAX_BODY_SIZE: int = 1024 * 1024
+    # Bodies larger than this (in bytes) are parsed on a worker thread, None to disable
+    WEBHOOK_THREADED_PARSE_SIZE: Optional[int] = 64 * 1024
     DEBUG: bool = False
+    # In debug mode, log the stack trace of any code that blocks the event loop for
+    # longer than this many seconds.
+    LOOP_BLOCK_THRESHOLD: float = 0.5
     IGNORE_USERS: Sequence[str] = field(default_factory=list)
     # How often to check whether any scheduled jobs need to be run, default every second
     SCHEDULER_PERIOD: float = 1.0
+    # Default (calls, period) limit on how often each user can trigger each listener in
+    # a channel, None for no limit. Can be overridden per listener.
+    RATE_LIMIT: Optional[Tuple[int, float]] = None
+    # Reply to users that exceed the rate limit, at most once per period. None to
+    # silently drop their messages.
+    RATE_LIMIT_REPLY: Optional[str] = "Slow down! You're sending too many commands."
+    # File to write traces of incoming events to in the Chrome trace event format,
+    # None to disable tracing.
+    TRACE_FILE: Optional[str] = None
+    # Fraction of the incoming events to trace
+    TRACE_SAMPLE_RATE: float = 0.01
+    # File to append the raw websocket frames to as gzip-compressed JSON lines, so
+    # that they can be replayed with snaketalk.recording.replay_recording. None to
+    # disable recording.
+    RECORD_FILE: Optional[str] = None
 
     SCHEME: str = field(init=False)  # Will be taken from the URL. Defaults to https.
 
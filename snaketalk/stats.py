@@ -0,0 +1,111 @@
+import threading
+from collections import Counter, deque
+from typing import Deque, Dict, List, NamedTuple
+
+from snaketalk.metrics import LISTENER_SECONDS
+
+
+class ListenerCall(NamedTuple):
+    event_type: str
+    queue_wait: float
+    duration: float
+    success: bool
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Returns the nearest-rank percentile of the given values, or 0 if there are
+    none."""
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def get_event_type(event) -> str:
+    """Returns the name of the event type, which for debounced listeners is the type of
+    the events in the batch."""
+    if isinstance(event, list) and len(event) > 0:
+        event = event[0]
+    return type(event).__name__
+
+
+class ListenerStats(object):
+    def __init__(self, window: int = 1000):
+        """Keeps track of the most recent invocations of every listener function.
+
+        Arguments:
+        - window: int, number of invocations per listener to compute the statistics
+            over.
+        """
+        self.window = window
+        self._calls: Dict[str, Deque[ListenerCall]] = {}
+        self._totals: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        name: str,
+        event_type: str,
+        queue_wait: float,
+        duration: float,
+        success: bool,
+    ):
+        """Records a single invocation of the listener with the given name.
+
+        Arguments:
+        - queue_wait: float, seconds between dispatching the event and the start of the
+            invocation.
+        - duration: float, execution time in seconds.
+        """
+        LISTENER_SECONDS.observe(duration, function=name)
+        with self._lock:
+            if name not in self._calls:
+                self._calls[name] = deque(maxlen=self.window)
+                self._totals[name] = Counter()
+            self._calls[name].append(
+                ListenerCall(event_type, queue_wait, duration, success)
+            )
+            self._totals[name]["calls"] += 1
+            if not success:
+                self._totals[name]["failures"] += 1
+
+    def get(self, name: str) -> Dict:
+        """Returns the statistics of the listener with the given name.
+
+        Call counts are totals, the percentiles are computed over the last `window`
+        invocations.
+        """
+        with self._lock:
+            calls = list(self._calls.get(name, []))
+            totals = Counter(self._totals.get(name, {}))
+
+        durations = [call.duration for call in calls]
+        waits = [call.queue_wait for call in calls]
+        return {
+            "calls": totals["calls"],
+            "failures": totals["failures"],
+            "event_types": dict(Counter(call.event_type for call in calls)),
+            "duration": {
+                f"p{int(fraction * 100)}": percentile(durations, fraction)
+                for fraction in [0.5, 0.9, 0.99]
+            },
+            "queue_wait": {
+                f"p{int(fraction * 100)}": percentile(waits, fraction)
+                for fraction in [0.5, 0.9, 0.99]
+            },
+        }
+
+    def summary(self) -> Dict[str, Dict]:
+        """Returns the statistics of all listeners, by function name."""
+        with self._lock:
+            names = list(self._calls.keys())
+        return {name: self.get(name) for name in sorted(names)}
+
+    def clear(self):
+        with self._lock:
+            self._calls.clear()
+            self._totals.clear()
+
+
+# Statistics of all listener functions that were called in this process.
+LISTENER_STATS = ListenerStats()
@@ -1,11 +1,17 @@
 import asyncio
+import contextvars
 import logging
 import threading
 import time
 from queue import Queue
+from typing import Union
 
+from snaketalk.function import Function
+from snaketalk.metrics import THREADPOOL_WAIT_SECONDS
 from snaketalk.scheduler import default_scheduler
-from snaketalk.webhook_server import WebHookServer
+from snaketalk.stats import LISTENER_STATS, get_event_type
+from snaketalk.tracing import TRACER
+from snaketalk.webhook_server import WebHookServer, WebHookServerPool
 
 
 class ThreadPool(object):
@@ -23,11 +29,19 @@ class ThreadPool(object):
         self._threads = []
 
     def add_task(self, function, *args):
-        self._queue.put((function, args))
+        # Run the task in a copy of the current context, so that it is part of the
+        # same trace.
+        self._queue.put(
+            (function, args, time.perf_counter(), contextvars.copy_context())
+        )
 
     def get_busy_workers(self):
         return self._busy_workers.qsize()
 
+    def get_queue_size(self):
+        """Returns the number of tasks that are waiting for a free worker."""
+        return self._queue.qsize()
+
     def start(self):
         self.alive = True
         # Spawn num_workers threads that will wait for work to be added to the queue
@@ -41,7 +55,9 @@ class ThreadPool(object):
         self.alive = False
         # Signal every thread that it's time to stop
         for _ in range(self.num_workers):
-            self._queue.put((self._stop_thread, tuple()))
+            self._queue.put(
+                (self._stop_thread, tuple(), time.perf_counter(), contextvars.Context())
+            )
         # Wait for each of them to finish
         logging.info("Stopping threadpool, waiting for threads...")
         for thread in self._threads:
@@ -55,14 +71,40 @@ class ThreadPool(object):
     def handle_work(self):
         while self.alive:
             # Wait for a new task (blocking)
-            function, arguments = self._queue.get()
+            function, arguments, queued_at, context = self._queue.get()
             # Notify the pool that we started working
             self._busy_workers.put(1)
-            function(*arguments)
+            start = time.perf_counter()
+            THREADPOOL_WAIT_SECONDS.observe(start - queued_at)
+            success = True
+            try:
+                context.run(self._run_task, function, arguments, queued_at, start)
+            except Exception:
+                success = False
+                logging.exception("Exception occurred: ")
+            if isinstance(function, Function):
+                LISTENER_STATS.record(
+                    function.name,
+                    event_type=get_event_type(arguments[0]),
+                    queue_wait=start - queued_at,
+                    duration=time.perf_counter() - start,
+                    success=success,
+                )
             # Notify the pool that we finished working
             self._queue.task_done()
             self._busy_workers.get()
 
+    @staticmethod
+    def _run_task(function, arguments, queued_at: float, start: float):
+        TRACER.record("threadpool_queue", queued_at, start)
+        name = (
+            function.name
+            if isinstance(function, Function)
+            else getattr(function, "__qualname__", repr(function))
+        )
+        with TRACER.span(name):
+            function(*arguments)
+
     def start_scheduler_thread(self, trigger_period: float):
         def run_pending():
             logging.info("Scheduler thread started.")
@@ -73,7 +115,9 @@ class ThreadPool(object):
 
         self.add_task(run_pending)
 
-    def start_webhook_server_thread(self, webhook_server: WebHookServer):
+    def start_webhook_server_thread(
+        self, webhook_server: Union[WebHookServer, WebHookServerPool]
+    ):
         async def start_server():
             logging.info("Webhook server thread started.")
             await webhook_server.start()
@@ -0,0 +1,146 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+# Id of the trace that the current code is part of, if it is being traced. Asyncio
+# tasks inherit it automatically, and the ThreadPool passes it on to its workers.
+_current_trace: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "snaketalk_trace", default=None
+)
+
+
+class _Span(object):
+    """Context manager that records the time spent inside it as a span."""
+
+    __slots__ = ["tracer", "name", "args", "start"]
+
+    def __init__(self, tracer: "Tracer", name: str, args: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(self.name, self.start, time.perf_counter(), **self.args)
+
+
+class Tracer(object):
+    # Number of buffered spans after which they are written to the trace file
+    flush_size = 1000
+
+    def __init__(self):
+        """Records spans of sampled events and writes them to a file in the Chrome trace
+        event format, which can be opened in chrome://tracing or Perfetto.
+
+        Tracing is disabled until a trace file is configured.
+        """
+        self.path: Optional[str] = None
+        self.sample_rate = 0.0
+        self._events: List[Dict] = []
+        self._lock = threading.Lock()
+        self._file = None
+
+    def configure(self, path: Optional[str], sample_rate: float = 1.0):
+        """Sets the file to write the traces to, or None to disable tracing.
+
+        Arguments:
+        - sample_rate: float, fraction of the events to trace.
+        """
+        self.close()
+        self.path = path
+        self.sample_rate = sample_rate
+
+    @property
+    def enabled(self):
+        return self.path is not None and self.sample_rate > 0
+
+    @staticmethod
+    def current_trace_id() -> Optional[str]:
+        return _current_trace.get()
+
+    @contextlib.contextmanager
+    def trace(self, name: str, **args):
+        """Starts a new trace with a root span of the given name, if this event is
+        sampled. Any spans recorded inside it become part of this trace.
+
+        Yields the trace id, or None if the event is not traced.
+        """
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield None
+            return
+
+        trace_id = uuid.uuid4().hex[:16]
+        token = _current_trace.set(trace_id)
+        try:
+            with self.span(name, **args):
+                yield trace_id
+        finally:
+            _current_trace.reset(token)
+
+    def span(self, name: str, **args):
+        """Returns a context manager that records a span of the given name, if we are
+        inside a trace."""
+        if _current_trace.get() is None:
+            return contextlib.nullcontext()
+        return _Span(self, name, args)
+
+    def record(self, name: str, start: float, end: float, **args):
+        """Records a span between the given time.perf_counter() values, if we are inside
+        a trace."""
+        trace_id = _current_trace.get()
+        if trace_id is None:
+            return
+        event = {
+            "name": name,
+            "cat": "snaketalk",
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {"trace_id": trace_id, **args},
+        }
+        # Spans are recorded from many threads, while flush swaps out the buffer
+        with self._lock:
+            self._events.append(event)
+            should_flush = len(self._events) >= self.flush_size
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered spans to the trace file."""
+        with self._lock:
+            events, self._events = self._events, []
+            if len(events) == 0 or self.path is None:
+                return
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "w")
+                    # The trace viewers accept an array without closing bracket, which
+                    # allows us to keep appending to it.
+                    self._file.write("[\n")
+                self._file.writelines(json.dumps(event) + ",\n" for event in events)
+                self._file.flush()
+            except OSError:
+                logging.exception(f"Could not write traces to {self.path}: ")
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# Tracer of this process, configured through Settings.TRACE_FILE.
+TRACER = Tracer()
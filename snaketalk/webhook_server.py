@@ -1,11 +1,22 @@
 import asyncio
-import random
+import json
+import logging
+import multiprocessing
+import re
 import time
+import uuid
 from queue import Empty, Queue
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from aiohttp import web
 
+from snaketalk.metrics import (
+    REGISTRY,
+    WEBHOOK_PENDING_REQUESTS,
+    WEBHOOK_RESPONSE_SECONDS,
+    WEBHOOK_TIMEOUTS,
+)
+from snaketalk.settings import Settings
 from snaketalk.wrappers import ActionEvent, WebHookEvent
 
 
@@ -15,10 +26,84 @@ class NoResponse:
     pass
 
 
+class BodyTooLarge(Exception):
+    """Raised when a webhook request body exceeds WEBHOOK_MAX_BODY_SIZE."""
+
+    pass
+
+
+class LoopbackResponse:
+    """Response to a webhook that was triggered from within the bot itself, without
+    going through the network.
+
+    Mimics the parts of aiohttp.ClientResponse that are useful to inspect a webhook
+    response.
+    """
+
+    def __init__(self, status: int, body=None):
+        self.status = status
+        self.body = body
+
+    @property
+    def ok(self):
+        return self.status < 400
+
+    async def json(self):
+        return self.body
+
+    async def text(self):
+        return "" if self.body is None else json.dumps(self.body)
+
+
+class MetricsSnapshot:
+    """Totals of the metrics of a WebHookServerPool worker, sent to the main process so
+    that they can be exposed together with its own.
+
+    If a request id is set, the worker is waiting for the combined metrics to answer a
+    request to /metrics.
+    """
+
+    def __init__(self, snapshot: Dict[str, Dict], request_id: Optional[str] = None):
+        self.snapshot = snapshot
+        self.request_id = request_id
+
+
+def create_webhook_event(data: Dict, webhook_id: str) -> WebHookEvent:
+    """Wraps the body of a webhook request in the corresponding event class."""
+    if "trigger_id" in data:
+        # Use the trigger ID to identify this request
+        return ActionEvent(data, request_id=data["trigger_id"], webhook_id=webhook_id)
+
+    # Generate a random ID, which is unique even under heavy load.
+    return WebHookEvent(data, request_id=uuid.uuid4().hex, webhook_id=webhook_id)
+
+
+def match_webhook_route(
+    routes: Optional[Dict[re.Pattern, bool]], webhook_id: str
+) -> Optional[bool]:
+    """Returns whether requests to webhook_id are fire-and-forget according to the given
+    routes, or None if none of them match.
+
+    If the routes are unknown, every request is treated as a regular one.
+    """
+    if routes is None:
+        return False
+
+    matches = [
+        fire_and_forget
+        for matcher, fire_and_forget in routes.items()
+        if matcher.match(webhook_id)
+    ]
+    if len(matches) == 0:
+        return None
+    # We only respond right away if none of the listeners can send a response.
+    return all(matches)
+
+
 def handle_json_error(func):
-    async def handler(instance, request: web.Request):
+    async def handler(instance, request: web.Request, *args, **kwargs):
         try:
-            return await func(instance, request)
+            return await func(instance, request, *args, **kwargs)
         except asyncio.CancelledError:
             raise
         except Exception as e:
@@ -27,43 +112,138 @@ def handle_json_error(func):
     return handler
 
 
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    """Records how long it takes to respond to each webhook request."""
+    if not request.path.startswith("/hooks/"):
+        return await handler(request)
+
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        WEBHOOK_RESPONSE_SECONDS.observe(
+            time.perf_counter() - start, status=str(status)
+        )
+
+
 class WebHookServer:
     """A small server that listens to incoming webhooks and forwards them to the bot
     EventHandler in the main thread/process."""
 
     def __init__(
         self,
-        url: str,
-        port: int,
+        settings: Settings,
         event_queue: Optional[Queue] = None,
         response_queue: Optional[Queue] = None,
+        reuse_port: bool = False,
+        forward_metrics: bool = False,
     ):
-        self.app = web.Application()
+        self.app = web.Application(middlewares=[metrics_middleware])
         self.app_runner = web.AppRunner(self.app)
-        self.url = url
-        self.port = port
+        self.settings = settings
+        # Whether to bind with SO_REUSEPORT, so that several processes can share a port
+        self.reuse_port = reuse_port
+        # Whether this server runs in a worker process, and should send its metrics to
+        # the main process instead of exposing them by itself.
+        self.forward_metrics = forward_metrics
         self.running = False
 
         # Create queues if necessary.
         self.event_queue = event_queue or Queue()
         self.response_queue = response_queue or Queue()
         self.response_handlers = {}
+        # Patterns of the webhook ids that have listeners. If None, every request is
+        # forwarded to the EventHandler.
+        self.webhook_routes: Optional[Dict[re.Pattern, bool]] = None
+
+    @property
+    def url(self):
+        return self.settings.WEBHOOK_HOST_URL
+
+    @property
+    def port(self):
+        return self.settings.WEBHOOK_HOST_PORT
+
+    @property
+    def timed_out_requests(self):
+        """Number of requests that did not receive a response before the deadline."""
+        return WEBHOOK_TIMEOUTS.get()
+
+    def get_pending_requests(self):
+        """Returns the number of requests that are still waiting for a response."""
+        return len(self.response_handlers)
+
+    def register_webhook_routes(self, routes: Dict[re.Pattern, bool]):
+        """Makes the server aware of the webhook ids that have listeners, so that
+        requests to any other id can be answered right away.
 
-        # Register /hooks endpoint
-        self.app.add_routes([web.post("/hooks/{webhook_id}", self.process_webhook)])
+        Arguments:
+        - routes: dict mapping the webhook id patterns to whether they are
+            fire-and-forget, i.e. whether they should immediately be acknowledged with
+            a 202 response instead of waiting for a listener to respond.
+
+        Should be called before the server is started.
+        """
+        self.webhook_routes = dict(routes)
+
+    def match_route(self, webhook_id: str) -> Optional[bool]:
+        """Returns whether requests to this webhook id are fire-and-forget, or None if
+        it has no listeners at all."""
+        return match_webhook_route(self.webhook_routes, webhook_id)
+
+    def _add_routes(self):
+        routes = []
+        # Webhook ids without any special characters get their own route, so that
+        # aiohttp can look them up directly.
+        for matcher in self.webhook_routes or {}:
+            if not matcher.flags & re.IGNORECASE and re.fullmatch(
+                r"[A-Za-z0-9_-]+", matcher.pattern
+            ):
+                routes.append(
+                    web.post(
+                        f"/hooks/{matcher.pattern}",
+                        self._exact_route_handler(
+                            matcher.pattern, self.match_route(matcher.pattern)
+                        ),
+                    )
+                )
+        # Any other id is handled by the generic /hooks endpoint
+        routes.append(web.post("/hooks/{webhook_id}", self.process_webhook))
+        routes.append(web.get("/metrics", self.metrics))
+        self.app.add_routes(routes)
+
+    def _exact_route_handler(self, webhook_id: str, fire_and_forget: bool):
+        async def handler(request: web.Request):
+            return await self.process_webhook(
+                request, webhook_id=webhook_id, fire_and_forget=fire_and_forget
+            )
+
+        return handler
 
     async def start(self):
         webhook_host_ip = self.url.replace("http://", "")
+        self._add_routes()
         await self.app_runner.setup()
-        site = web.TCPSite(self.app_runner, webhook_host_ip, self.port)
+        site = web.TCPSite(
+            self.app_runner, webhook_host_ip, self.port, reuse_port=self.reuse_port
+        )
         await site.start()
         self.running = True
 
         # Schedule the response awaiting function to the same loop as the web server
         asyncio.get_event_loop().create_task(self._obtain_responses_loop())
+        if self.forward_metrics:
+            asyncio.get_event_loop().create_task(self._forward_metrics_loop())
 
     async def stop(self):
-        self.app_runner.cleanup()
+        await self.app_runner.cleanup()
         self.running = False
 
     async def _obtain_responses_loop(self):
@@ -72,44 +252,326 @@ class WebHookServer:
         while True:
             try:
                 request_id, response = self.response_queue.get_nowait()
-                print(f"Received response {response} for request {request_id}")
+                logging.debug(f"Received response {response} for request {request_id}")
                 try:
-                    if not self.response_handlers[request_id].cancelled():
+                    if not self.response_handlers[request_id].done():
                         self.response_handlers[request_id].set_result(response)
                     del self.response_handlers[request_id]
                 except KeyError:
-                    # If this handler already received a response, we can skip this.
+                    # If this handler already received a response or timed out, we can
+                    # skip this.
                     pass
             except Empty:
                 pass
             await asyncio.sleep(0.0001)
 
-    @handle_json_error
-    async def process_webhook(self, request: web.Request):
-        data = await request.json()
-        webhook_id = request.match_info.get("webhook_id", "")
-        if "trigger_id" in data:
-            # Use the trigger ID to identify this request
-            event = ActionEvent(
-                data, request_id=data["trigger_id"], webhook_id=webhook_id
+    async def _forward_metrics_loop(self):
+        """Regularly sends the metrics of this process to the main process."""
+        while True:
+            await asyncio.sleep(1)
+            self.event_queue.put(MetricsSnapshot(REGISTRY.snapshot()))
+
+    async def _read_json(self, request: web.Request):
+        """Reads the request body in chunks and parses it, or raises BodyTooLarge if the
+        body is larger than WEBHOOK_MAX_BODY_SIZE.
+
+        Large bodies are parsed on a worker thread to keep the server responsive.
+        """
+        max_size = self.settings.WEBHOOK_MAX_BODY_SIZE
+        # Reject the request before reading anything if it announces a large body
+        if request.content_length is not None and request.content_length > max_size:
+            raise BodyTooLarge()
+
+        # The content length might be missing or wrong, so keep checking the size
+        body = bytearray()
+        async for chunk in request.content.iter_chunked(64 * 1024):
+            body.extend(chunk)
+            if len(body) > max_size:
+                raise BodyTooLarge()
+
+        threaded_size = self.settings.WEBHOOK_THREADED_PARSE_SIZE
+        if threaded_size is not None and len(body) > threaded_size:
+            return await asyncio.get_event_loop().run_in_executor(
+                None, json.loads, body
             )
+        return json.loads(body)
+
+    async def metrics(self, request: web.Request):
+        """Exposes the metrics of the bot in the Prometheus text format.
+
+        Worker processes ask the main process for them, so that every scrape sees the
+        metrics of the EventHandler and of all workers, no matter which worker it
+        reaches.
+        """
+        if not self.forward_metrics:
+            body = REGISTRY.render()
         else:
-            # Generate an ID based on the current time and a random number.
-            event = WebHookEvent(
-                data,
-                request_id=f"{time.time()}_{random.randint(0, 10000)}",
-                webhook_id=webhook_id,
+            request_id = uuid.uuid4().hex
+            await_response = asyncio.get_event_loop().create_future()
+            self.response_handlers[request_id] = await_response
+            self.event_queue.put(MetricsSnapshot(REGISTRY.snapshot(), request_id))
+            try:
+                body = await asyncio.wait_for(await_response, timeout=5)
+            except asyncio.TimeoutError:
+                return web.Response(status=504)
+            finally:
+                self.response_handlers.pop(request_id, None)
+
+        return web.Response(
+            body=body.encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    @handle_json_error
+    async def process_webhook(
+        self,
+        request: web.Request,
+        webhook_id: Optional[str] = None,
+        fire_and_forget: bool = False,
+    ):
+        if webhook_id is None:
+            webhook_id = request.match_info.get("webhook_id", "")
+            route = self.match_route(webhook_id)
+            # If nobody listens to this webhook, there's no need to bother the
+            # EventHandler.
+            if route is None:
+                return web.Response(status=200)
+            fire_and_forget = route
+
+        try:
+            data = await self._read_json(request)
+        except BodyTooLarge:
+            return web.json_response(
+                {
+                    "status": "failed",
+                    "reason": "Request body exceeds the maximum size of"
+                    f" {self.settings.WEBHOOK_MAX_BODY_SIZE} bytes.",
+                },
+                status=413,
             )
-        self.event_queue.put(event)
+        event = create_webhook_event(data, webhook_id)
+
+        if fire_and_forget:
+            # Acknowledge the request right away and let the listeners process it in
+            # the background. Marking the event as responded makes sure nobody tries
+            # to send another response.
+            event.responded = True
+            self.event_queue.put(event)
+            return web.Response(status=202)
 
         # Register a Future object that will signal us when a response has arrived,
-        # and wait for it to complete.
+        # and wait for it to complete or for the deadline to pass.
         await_response = asyncio.get_event_loop().create_future()
         self.response_handlers[event.request_id] = await_response
-        await await_response
+        self.event_queue.put(event)
+        WEBHOOK_PENDING_REQUESTS.inc()
+        try:
+            result = await asyncio.wait_for(
+                await_response, timeout=self.settings.WEBHOOK_RESPONSE_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            WEBHOOK_TIMEOUTS.inc()
+            logging.warning(
+                f"Webhook {webhook_id} did not respond to request {event.request_id}"
+                f" within {self.settings.WEBHOOK_RESPONSE_TIMEOUT} seconds."
+            )
+            return web.json_response(
+                {"status": "failed", "reason": "Timed out waiting for a response."},
+                status=504,
+            )
+        finally:
+            WEBHOOK_PENDING_REQUESTS.dec()
+            # Make sure the handler never outlives its request. Another request may
+            # have re-used the same ID (e.g. a retried action), so only remove our own.
+            if self.response_handlers.get(event.request_id) is await_response:
+                del self.response_handlers[event.request_id]
 
-        result = await_response.result()
         if result is NoResponse:
             return web.Response(status=200)
 
         return web.json_response(result)
+
+
+class _WorkerEventQueue:
+    """Wraps the event queue shared by all worker processes, so that the pool knows
+    which worker each event came from."""
+
+    def __init__(self, queue: multiprocessing.Queue, worker_index: int):
+        self.queue = queue
+        self.worker_index = worker_index
+
+    def put(self, event: WebHookEvent):
+        self.queue.put((self.worker_index, event))
+
+
+def _run_worker(
+    settings: Settings,
+    worker_index: int,
+    event_queue: multiprocessing.Queue,
+    response_queue: multiprocessing.Queue,
+    webhook_routes: Optional[Dict[re.Pattern, bool]],
+):
+    """Entry point of a WebHookServerPool worker process."""
+    # A forked worker starts with a copy of the metrics of the main process, which
+    # already includes those.
+    REGISTRY.clear()
+    server = WebHookServer(
+        settings,
+        event_queue=_WorkerEventQueue(event_queue, worker_index),
+        response_queue=response_queue,
+        reuse_port=True,
+        forward_metrics=True,
+    )
+    if webhook_routes is not None:
+        server.register_webhook_routes(webhook_routes)
+
+    async def serve():
+        await server.start()
+        logging.info(f"Webhook server worker {worker_index} started.")
+        while True:
+            await asyncio.sleep(3600)
+
+    asyncio.run(serve())
+
+
+class WebHookServerPool:
+    """Runs several WebHookServer processes that share the same port through
+    SO_REUSEPORT, so that incoming webhooks are spread out over multiple cores.
+
+    Events from all workers are forwarded to the single event queue that the
+    EventHandler listens to, and responses are routed back to the worker that received
+    the corresponding request. Can be used as a drop-in replacement for WebHookServer.
+
+    Arguments:
+    - settings: Settings, the settings of the bot.
+    - num_workers: int, how many server processes to run.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        num_workers: int,
+        event_queue: Optional[Queue] = None,
+        response_queue: Optional[Queue] = None,
+    ):
+        self.settings = settings
+        self.num_workers = num_workers
+        self.running = False
+
+        # Queues to communicate with the EventHandler and Driver in this process.
+        self.event_queue = event_queue or Queue()
+        self.response_queue = response_queue or Queue()
+
+        # Queues to communicate with the worker processes.
+        self._worker_events = multiprocessing.Queue()
+        self._worker_responses = [multiprocessing.Queue() for _ in range(num_workers)]
+        self._processes: List[multiprocessing.Process] = []
+        # Maps the id of every pending request to the index of the worker that is
+        # waiting for it, and the time after which we stop waiting.
+        self._routes: Dict[str, Tuple[int, float]] = {}
+        self.webhook_routes: Optional[Dict[re.Pattern, bool]] = None
+
+    @property
+    def url(self):
+        return self.settings.WEBHOOK_HOST_URL
+
+    @property
+    def port(self):
+        return self.settings.WEBHOOK_HOST_PORT
+
+    def get_pending_requests(self):
+        """Returns the number of requests that are still waiting for a response."""
+        return len(self._routes)
+
+    def register_webhook_routes(self, routes: Dict[re.Pattern, bool]):
+        """See WebHookServer.register_webhook_routes."""
+        self.webhook_routes = dict(routes)
+
+    def match_route(self, webhook_id: str) -> Optional[bool]:
+        """See WebHookServer.match_route."""
+        return match_webhook_route(self.webhook_routes, webhook_id)
+
+    async def start(self):
+        for index in range(self.num_workers):
+            process = multiprocessing.Process(
+                target=_run_worker,
+                args=(
+                    self.settings,
+                    index,
+                    self._worker_events,
+                    self._worker_responses[index],
+                    self.webhook_routes,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+        self.running = True
+
+        loop = asyncio.get_event_loop()
+        loop.create_task(self._forward_events_loop())
+        loop.create_task(self._route_responses_loop())
+
+    async def stop(self):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        self.running = False
+
+    async def _forward_events_loop(self):
+        """Passes events from the worker processes on to the EventHandler, keeping track
+        of where the response should be sent."""
+        while True:
+            try:
+                worker_index, event = self._worker_events.get_nowait()
+                if isinstance(event, MetricsSnapshot):
+                    self._update_metrics(worker_index, event)
+                else:
+                    # Fire-and-forget requests were already answered by the worker
+                    if not event.responded:
+                        self._add_route(event.request_id, worker_index)
+                    self.event_queue.put(event)
+            except Empty:
+                pass
+            await asyncio.sleep(0.0001)
+
+    def _add_route(self, request_id: str, worker_index: int):
+        # Workers give up after WEBHOOK_RESPONSE_TIMEOUT, so there's no need to
+        # remember the route for longer than that.
+        timeout = self.settings.WEBHOOK_RESPONSE_TIMEOUT
+        deadline = time.monotonic() + timeout if timeout else float("inf")
+        self._routes[request_id] = (worker_index, deadline)
+
+    def _update_metrics(self, worker_index: int, metrics: MetricsSnapshot):
+        REGISTRY.set_remote(("webhook_worker", worker_index), metrics.snapshot)
+        if metrics.request_id is not None:
+            self._worker_responses[worker_index].put(
+                (metrics.request_id, REGISTRY.render())
+            )
+
+    async def _route_responses_loop(self):
+        """Sends responses back to the worker process that is waiting for them."""
+        last_purge = time.monotonic()
+        while True:
+            try:
+                request_id, response = self.response_queue.get_nowait()
+                try:
+                    worker_index, _ = self._routes.pop(request_id)
+                    self._worker_responses[worker_index].put((request_id, response))
+                except KeyError:
+                    # This request already received a response or timed out.
+                    pass
+            except Empty:
+                pass
+
+            # Every now and then, forget about requests that won't get a response.
+            now = time.monotonic()
+            if now - last_purge > 1:
+                for request_id, (_, deadline) in list(self._routes.items()):
+                    if deadline < now:
+                        del self._routes[request_id]
+                last_purge = now
+
+            await asyncio.sleep(0.0001)
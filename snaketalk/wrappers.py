@@ -1,5 +1,5 @@
 from functools import cached_property
-from typing import Dict
+from typing import Dict, Optional
 
 
 class EventWrapper:
@@ -15,6 +15,8 @@ class EventWrapper:
         body: Dict,
     ):
         self.body = body
+        # Id of the trace that follows the handling of this event, if it is traced.
+        self.trace_id: Optional[str] = None
 
 
 class Message(EventWrapper):
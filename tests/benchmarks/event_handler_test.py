@@ -0,0 +1,46 @@
+import asyncio
+import json
+
+import pytest
+
+from snaketalk import Plugin, Settings, listen_to
+from snaketalk.driver import Driver
+from snaketalk.event_handler import EventHandler
+
+from ..unit_tests.event_handler_test import create_message
+
+
+async def listener(self, message):
+    pass
+
+
+def create_handler(num_listeners: int):
+    driver = Driver()
+    plugin = Plugin().initialize(driver)
+    for i in range(num_listeners):
+        plugin.register_function(listen_to(f"^command{i} (.*)$")(listener))
+    return EventHandler(driver, Settings(), plugins=[plugin])
+
+
+@pytest.mark.parametrize("num_listeners", [10, 100, 1000])
+def test_handle_post(benchmark, num_listeners):
+    handler = create_handler(num_listeners)
+    body = create_message(text="command0 with some arguments").body
+    post = json.dumps(body["data"]["post"])
+    mentions = json.dumps(body["data"]["mentions"])
+
+    def handle_post():
+        # _handle_post parses the JSON strings in place, so every call needs a new body
+        data = {**body["data"], "post": post, "mentions": mentions}
+        return handle_post_coroutine({**body, "data": data})
+
+    async def handle_post_coroutine(new_body):
+        await handler._handle_post(new_body)
+        # Let the listener tasks run as well
+        await asyncio.sleep(0)
+
+    loop = asyncio.new_event_loop()
+    try:
+        benchmark(lambda: loop.run_until_complete(handle_post()))
+    finally:
+        loop.close()
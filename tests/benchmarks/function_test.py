@@ -0,0 +1,37 @@
+import click
+
+from snaketalk import Plugin, listen_to
+from snaketalk.driver import Driver
+
+from ..unit_tests.event_handler_test import create_message
+
+
+def regex_function(self, message, argument):
+    return argument
+
+
+@click.command()
+@click.argument("argument", type=str)
+@click.option("--flag", is_flag=True)
+def click_function(self, message, argument, flag):
+    return argument
+
+
+def test_regex_function(benchmark):
+    function = listen_to("^regex (.*)$")(regex_function)
+    function.plugin = Plugin().initialize(Driver())
+    message = create_message(text="regex some_argument")
+
+    def call_function():
+        # A single call is too fast to time reliably
+        for _ in range(1000):
+            function(message, "some_argument")
+
+    benchmark(call_function)
+
+
+def test_click_function(benchmark):
+    function = listen_to("^click")(click_function)
+    function.plugin = Plugin().initialize(Driver())
+    message = create_message(text="click some_argument --flag")
+    assert benchmark(function, message, "some_argument --flag") == "some_argument"
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from snaketalk import schedule
+
+
+def job():
+    pass
+
+
+def test_run_pending_idle(benchmark):
+    for _ in range(10000):
+        schedule.every(1).hours.do(job)
+    # None of these jobs are due, so this measures the cost of checking them
+    try:
+        benchmark(schedule.run_pending)
+    finally:
+        schedule.clear()
+
+
+def test_run_pending_due(benchmark):
+    def schedule_jobs():
+        schedule.clear()
+        now = datetime.now()
+        for _ in range(100):
+            schedule.once(now).do(job)
+
+    # Every due job records its lag and is started on its own thread by the patched
+    # Scheduler._run_job.
+    try:
+        benchmark.pedantic(schedule.run_pending, setup=schedule_jobs, rounds=50)
+    finally:
+        schedule.clear()
@@ -0,0 +1,20 @@
+from snaketalk.threadpool import ThreadPool
+
+
+def task():
+    pass
+
+
+def test_task_throughput(benchmark):
+    pool = ThreadPool(num_workers=4)
+    pool.start()
+
+    def run_tasks():
+        for _ in range(1000):
+            pool.add_task(task)
+        pool._queue.join()
+
+    try:
+        benchmark.pedantic(run_tasks, rounds=20, warmup_rounds=1)
+    finally:
+        pool.stop()
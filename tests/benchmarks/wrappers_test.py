@@ -0,0 +1,31 @@
+from snaketalk.wrappers import Message
+
+from ..unit_tests.event_handler_test import create_message
+
+
+def test_message_construction(benchmark):
+    body = create_message().body
+
+    def construct_messages():
+        # A single construction is too fast to time reliably
+        for _ in range(1000):
+            Message(body)
+
+    benchmark(construct_messages)
+
+
+def test_message_properties(benchmark):
+    body = create_message().body
+
+    def access_properties():
+        # Each property is computed once and then cached on the instance
+        message = Message(body)
+        for _ in range(10):
+            message.text
+            message.channel_id
+            message.is_direct_message
+            message.mentions
+            message.sender_name
+            message.reply_id
+
+    benchmark(access_properties)
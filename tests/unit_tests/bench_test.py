@@ -0,0 +1,64 @@
+import json
+
+from snaketalk import ExamplePlugin
+from snaketalk.bench import format_report, load_plugin, run_benchmark
+from snaketalk.recording import EventRecorder
+
+
+def test_load_plugin():
+    assert isinstance(load_plugin("snaketalk:ExamplePlugin"), ExamplePlugin)
+    assert isinstance(load_plugin("snaketalk.plugins.ExamplePlugin"), ExamplePlugin)
+
+
+def test_run_benchmark():
+    results = run_benchmark(
+        messages=["ping", "not a command"],
+        rate=20,
+        duration=0.5,
+        webhook_rate=10,
+        port=3288,
+        webhook_port=3289,
+        drain_timeout=1,
+        trace_memory=True,
+    )
+    # Only the pings are answered
+    assert results["messages"]["sent"] == 10
+    assert results["messages"]["replies"] == 5
+    assert (
+        0
+        < results["messages"]["latency"]["p50"]
+        <= results["messages"]["latency"]["max"]
+    )
+    assert results["webhooks"]["statuses"] == {"200": 5}
+    assert results["cpu"]["user"] > 0
+    assert results["memory"]["traced_peak_mib"] > 0
+
+    report = format_report(results)
+    assert "Replies received: 5" in report
+    assert "Webhooks sent:    5 (200: 5)" in report
+
+
+def test_replay_benchmark(tmp_path):
+    path = tmp_path / "events.jsonl.gz"
+    recorder = EventRecorder(path)
+    for i in range(5):
+        post = {"id": f"post{i}", "channel_id": "channel", "root_id": ""}
+        post.update(user_id="user", message="ping" if i % 2 == 0 else "hi")
+        event = {
+            "event": "posted",
+            "data": {
+                "channel_type": "O",
+                "post": json.dumps(post),
+                "sender_name": "me",
+            },
+        }
+        recorder.record(json.dumps(event), timestamp=i * 0.1)
+    recorder.close()
+
+    results = run_benchmark(
+        recording=path, speed=0, port=3290, webhook_port=3291, drain_timeout=1
+    )
+    assert results["messages"]["sent"] == 5
+    # Only the pings are answered
+    assert results["messages"]["replies"] == 3
+    assert results["webhooks"]["sent"] == 0
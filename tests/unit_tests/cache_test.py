@@ -0,0 +1,202 @@
+import asyncio
+import threading
+from unittest import mock
+
+import pytest
+
+from snaketalk import Plugin, cached_reply, listen_to
+from snaketalk.cache import ReplyCache
+
+from .event_handler_test import create_message
+
+
+def create_plugin():
+    plugin = Plugin()
+    plugin.driver = mock.Mock()
+    return plugin
+
+
+@mock.patch("snaketalk.cache.time.monotonic")
+class TestReplyCache:
+    def test_ttl(self, monotonic):
+        monotonic.return_value = 0
+        cache = ReplyCache(ttl=10, maxsize=10)
+        cache.put("key", "value")
+        assert cache.get("key") == (True, "value")
+        monotonic.return_value = 11
+        assert cache.get("key") == (False, None)
+
+    def test_maxsize(self, monotonic):
+        monotonic.return_value = 0
+        cache = ReplyCache(ttl=10, maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        # Using a makes b the least recently used value
+        cache.get("a")
+        cache.put("c", 3)
+        assert cache.get("a") == (True, 1)
+        assert cache.get("b") == (False, None)
+        assert cache.get("c") == (True, 3)
+
+
+class TestCachedReply:
+    def test_sync(self):
+        calls = []
+
+        @cached_reply(ttl=60, key="text")
+        def reply(self, message):
+            calls.append(message.text)
+            return f"reply to {message.text}"
+
+        plugin = create_plugin()
+        reply(plugin, create_message(text="hi"))
+        reply(plugin, create_message(text="hi"))
+        reply(plugin, create_message(text="hello"))
+
+        assert calls == ["hi", "hello"]
+        plugin.driver.reply_to.assert_has_calls(
+            [
+                mock.call(mock.ANY, "reply to hi"),
+                mock.call(mock.ANY, "reply to hi"),
+                mock.call(mock.ANY, "reply to hello"),
+            ]
+        )
+
+    def test_key(self):
+        calls = []
+
+        @cached_reply(key=("user", "channel"))
+        def by_user(self, message):
+            calls.append(message.text)
+
+        @cached_reply(key=lambda message: message.sender_name)
+        def by_name(self, message):
+            calls.append(message.text)
+
+        plugin = create_plugin()
+        # Both messages come from the same user in the same channel
+        by_user(plugin, create_message(text="hi"))
+        by_user(plugin, create_message(text="hello"))
+        by_name(plugin, create_message(text="hi", sender_name="betty"))
+        by_name(plugin, create_message(text="hello", sender_name="charlie"))
+
+        assert calls == ["hi", "hi", "hello"]
+        # None is cached as well, but never sent
+        plugin.driver.reply_to.assert_not_called()
+
+    def test_sync_concurrent(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        @cached_reply()
+        def reply(self, message):
+            calls.append(message.text)
+            if len(calls) == 1:
+                started.set()
+                release.wait()
+            return "done"
+
+        plugin = create_plugin()
+        first = threading.Thread(target=reply, args=(plugin, create_message()))
+        second = threading.Thread(target=reply, args=(plugin, create_message()))
+        first.start()
+        started.wait()
+        # Worker threads don't wait for each other, but compute the reply themselves
+        second.start()
+        second.join(timeout=1)
+        assert not second.is_alive()
+        release.set()
+        first.join()
+
+        assert calls == ["hello", "hello"]
+        assert plugin.driver.reply_to.call_count == 2
+        assert reply.cache.pending == {}
+
+    def test_per_instance(self):
+        @cached_reply()
+        def reply(self, message):
+            return f"reply from {self.name}"
+
+        @cached_reply()
+        async def async_reply(self, message):
+            return f"reply from {self.name}"
+
+        first, second = create_plugin(), create_plugin()
+        first.name, second.name = "first", "second"
+        for plugin in [first, second]:
+            reply(plugin, create_message())
+            asyncio.run(async_reply(plugin, create_message()))
+
+        # Each plugin instance gets its own replies
+        for plugin in [first, second]:
+            plugin.driver.reply_to.assert_has_calls(
+                [mock.call(mock.ANY, f"reply from {plugin.name}")] * 2
+            )
+
+    def test_async_coalescing(self):
+        calls = []
+
+        @cached_reply()
+        async def reply(self, message):
+            calls.append(message.text)
+            await asyncio.sleep(0.01)
+            return "done"
+
+        async def run(plugin):
+            await asyncio.gather(*[reply(plugin, create_message()) for _ in range(5)])
+
+        plugin = create_plugin()
+        asyncio.run(run(plugin))
+        assert calls == ["hello"]
+        assert plugin.driver.reply_to.call_count == 5
+
+    def test_async_cancellation(self):
+        calls = []
+
+        @cached_reply()
+        async def reply(self, message):
+            calls.append(message.text)
+            await asyncio.sleep(0.05)
+            return "done"
+
+        async def run(plugin):
+            owner = asyncio.create_task(reply(plugin, create_message()))
+            await asyncio.sleep(0)
+            waiters = [reply(plugin, create_message()) for _ in range(3)]
+            waiting = asyncio.ensure_future(asyncio.gather(*waiters))
+            await asyncio.sleep(0.01)
+            owner.cancel()
+            # One of the waiters takes over, and the others wait for it
+            await asyncio.wait_for(waiting, timeout=1)
+            assert owner.cancelled()
+
+        plugin = create_plugin()
+        asyncio.run(run(plugin))
+        assert calls == ["hello", "hello"]
+        assert plugin.driver.reply_to.call_count == 3
+        assert reply.cache.pending == {}
+
+    def test_exception(self):
+        @cached_reply()
+        def reply(self, message):
+            raise ValueError("failed")
+
+        plugin = create_plugin()
+        with pytest.raises(ValueError):
+            reply(plugin, create_message())
+        # Failed calls are not cached
+        assert reply.cache.pending == {}
+        with pytest.raises(ValueError):
+            reply(plugin, create_message())
+
+    def test_listen_to(self):
+        @listen_to("^!info$")
+        @cached_reply(ttl=60)
+        async def info(self, message):
+            """Info."""
+            return "info"
+
+        assert info.is_coroutine
+        assert info.name.endswith("info")
+        assert info.docstring == "Info."
@@ -0,0 +1,231 @@
+import asyncio
+import re
+import ssl
+import threading
+from unittest import mock
+
+import certifi
+from aiohttp import web
+
+from snaketalk import Settings
+from snaketalk.driver import Driver
+from snaketalk.webhook_server import WebHookServer
+
+
+class TestDriver:
+    def test_http_session(self):
+        driver = Driver()
+
+        async def get_sessions():
+            return driver.get_http_session(), driver.get_http_session()
+
+        # Within the same event loop, the same session should be re-used
+        loop = asyncio.new_event_loop()
+        first, second = loop.run_until_complete(get_sessions())
+        assert first is second
+        assert not first.closed
+
+        driver.close_http_sessions()
+        assert first.closed
+        assert driver._http_sessions == {}
+        loop.close()
+
+    def test_close_http_session_closed_loop(self):
+        driver = Driver()
+
+        async def get_session():
+            return driver.get_http_session()
+
+        session = asyncio.run(get_session())
+        driver.close_http_sessions()
+        assert session.closed
+
+    def test_ssl_context(self):
+        assert Driver({"verify": True}).get_ssl_context() is None
+        assert Driver({"verify": False}).get_ssl_context() is False
+        # A CA bundle path is trusted, just like the REST client does
+        driver = Driver({"verify": certifi.where()})
+        context = driver.get_ssl_context()
+        assert isinstance(context, ssl.SSLContext)
+        assert context.verify_mode == ssl.CERT_REQUIRED
+        assert driver.get_ssl_context() is context
+
+    def test_post_webhook(self):
+        peers = []
+
+        async def hook(request: web.Request):
+            peers.append(request.transport.get_extra_info("peername"))
+            # Large enough that it isn't read as part of the headers
+            body = {"received": await request.json(), "padding": "x" * 1024 * 1024}
+            return web.json_response(body)
+
+        async def post_webhooks():
+            app = web.Application()
+            app.router.add_post("/hooks/{webhook_id}", hook)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", 3292).start()
+            try:
+                driver = Driver({"url": "127.0.0.1", "port": 3292, "scheme": "http"})
+                responses = [
+                    await driver.call_webhook("hook", {"text": text})
+                    for text in ["one", "two"]
+                ]
+                await driver.get_http_session().close()
+            finally:
+                await runner.cleanup()
+            return responses
+
+        responses = asyncio.run(post_webhooks())
+        # The responses can still be read after the connection was released
+        assert [response.status for response in responses] == [200, 200]
+        assert asyncio.run(responses[1].json())["received"] == {"text": "two"}
+        # Both requests went over the same keep-alive connection
+        assert peers[0] == peers[1]
+
+    def test_http_session_per_loop(self):
+        async def hook(request: web.Request):
+            return web.json_response({})
+
+        # Run a webhook endpoint, and a loop that takes the role of the bot's main
+        # loop, in the background.
+        server_loop = asyncio.new_event_loop()
+        runner = web.AppRunner(web.Application())
+        runner.app.router.add_post("/hooks/{webhook_id}", hook)
+        server_loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 3293)
+        server_loop.run_until_complete(site.start())
+        thread = threading.Thread(target=server_loop.run_forever)
+        thread.start()
+
+        driver = Driver({"url": "127.0.0.1", "port": 3293, "scheme": "http"})
+        try:
+            # Every asyncio.run call has its own loop, but the session of a closed
+            # loop is closed and forgotten as soon as a new one is needed.
+            sessions = []
+            for _ in range(3):
+                assert asyncio.run(driver.call_webhook("hook", {})).status == 200
+                sessions.extend(driver._http_sessions.values())
+            assert len(driver._http_sessions) == 1
+            assert [session.closed for session in sessions] == [True, True, False]
+            driver.close_http_sessions()
+
+            # While the main loop runs, all requests are sent from there instead
+            driver._http_loop = server_loop
+            for _ in range(3):
+                assert asyncio.run(driver.call_webhook("hook", {})).status == 200
+            assert list(driver._http_sessions.keys()) == [server_loop]
+        finally:
+            asyncio.run_coroutine_threadsafe(runner.cleanup(), server_loop).result()
+            driver.close_http_sessions()
+            server_loop.call_soon_threadsafe(server_loop.stop)
+            thread.join()
+            server_loop.close()
+
+    def test_fire_and_forget_loopback_error(self, caplog):
+        driver = Driver()
+        server = WebHookServer(Settings())
+        server.register_webhook_routes({re.compile("forget"): True})
+        server.running = True
+
+        async def loopback(event):
+            await asyncio.sleep(0.01)
+            raise ValueError("Listener failed")
+
+        driver.register_webhook_server(server, loopback=loopback)
+
+        async def trigger():
+            response = await driver.trigger_own_webhook("forget", {})
+            # The handler keeps running in the background until it fails
+            assert len(driver._loopback_tasks) == 1
+            await asyncio.sleep(0.1)
+            return response.status
+
+        assert asyncio.run(trigger()) == 202
+        assert driver._loopback_tasks == set()
+        assert "Listener failed" in caplog.text
+
+    def test_call_webhook_batch(self):
+        driver = Driver()
+
+        async def post_webhook(webhook_id, options):
+            return webhook_id, options
+
+        async def call_webhooks():
+            return await asyncio.gather(
+                driver.call_webhook("hook", {"text": "one"}, batch_delay=0.1),
+                driver.call_webhook(
+                    "hook",
+                    {"text": "two", "attachments": [{"text": "attachment"}]},
+                    batch_delay=0.1,
+                ),
+                # Different options, so this should be sent separately
+                driver.call_webhook(
+                    "hook", {"text": "three", "channel": "other"}, batch_delay=0.1
+                ),
+            )
+
+        with mock.patch.object(driver, "_post_webhook", wraps=post_webhook) as mocked:
+            results = asyncio.run(call_webhooks())
+
+        assert mocked.call_count == 2
+        merged = (
+            "hook",
+            {"text": "one\ntwo", "attachments": [{"text": "attachment"}]},
+        )
+        assert results == [
+            merged,
+            merged,
+            ("hook", {"text": "three", "channel": "other"}),
+        ]
+        assert driver._webhook_batches == {}
+
+        # Without a delay, every call results in a separate post
+        with mock.patch.object(driver, "_post_webhook", wraps=post_webhook) as mocked:
+            asyncio.run(driver.call_webhook("hook", {"text": "one"}))
+            mocked.assert_called_once_with("hook", {"text": "one"})
+
+    def test_trigger_own_webhook_loopback(self):
+        driver = Driver()
+        server = WebHookServer(Settings(WEBHOOK_RESPONSE_TIMEOUT=0.5))
+        server.register_webhook_routes(
+            {re.compile("respond"): False, re.compile("forget"): True}
+        )
+        server.running = True
+
+        received = []
+
+        async def loopback(event):
+            received.append(event)
+            if event.webhook_id == "respond":
+                # Respond from another thread, like a threaded listener would.
+                threading.Thread(
+                    target=driver.respond_to_web, args=(event, {"text": "hi!"})
+                ).start()
+
+        driver.register_webhook_server(server, loopback=loopback)
+
+        async def trigger(webhook_id):
+            response = await driver.trigger_own_webhook(webhook_id, {"text": "hey"})
+            return response.status, await response.json()
+
+        # The response of the listener is passed back without touching the network
+        assert asyncio.run(trigger("respond")) == (200, {"text": "hi!"})
+        assert received[-1].text == "hey"
+        assert server.response_queue.empty()
+
+        # Fire-and-forget webhooks are acknowledged right away
+        assert asyncio.run(trigger("forget")) == (202, None)
+        assert received[-1].responded
+        assert driver._loopback_tasks == set()
+
+        # Webhooks without listeners never reach the EventHandler
+        assert asyncio.run(trigger("nothing")) == (200, None)
+        assert len(received) == 2
+
+        # If the listener doesn't respond in time, we get the same timeout response
+        # as the server would send.
+        server.register_webhook_routes({re.compile("respond_late"): False})
+        status, _ = asyncio.run(trigger("respond_late"))
+        assert status == 504
+        assert driver._loopback_handlers == {}
@@ -124,6 +124,7 @@ class TestEventHandler:
 
         handle_post.assert_called_once_with(create_message().body)
 
+    @mock.patch("snaketalk.driver.Driver.user_id", new="qmw86q7qsjriura9jos75i4why")
     @mock.patch("snaketalk.driver.Driver.username", new="my_username")
     def test_handle_post(self):
         # Create an initialized plugin so its listeners are registered
@@ -151,6 +152,70 @@ class TestEventHandler:
             # Assert the function was called, so we know the asserts succeeded.
             mocked.assert_called_once()
 
+    @mock.patch("snaketalk.driver.Driver.user_id", new="qmw86q7qsjriura9jos75i4why")
+    @mock.patch("snaketalk.driver.Driver.username", new="my_username")
+    def test_rate_limit(self):
+        driver = Driver()
+        plugin = ExamplePlugin().initialize(driver)
+        handler = EventHandler(
+            driver,
+            Settings(RATE_LIMIT=(2, 60), RATE_LIMIT_REPLY="Slow down!"),
+            plugins=[plugin],
+        )
+
+        def create_post():
+            body = create_message(text="@my_username sleep 5").body.copy()
+            body["data"]["post"] = json.dumps(body["data"]["post"])
+            body["data"]["mentions"] = json.dumps(body["data"]["mentions"])
+            return body
+
+        with mock.patch.object(plugin, "call_function") as call_function, mock.patch(
+            "snaketalk.driver.ThreadPool.add_task"
+        ) as add_task:
+            for _ in range(4):
+                asyncio.run(handler._handle_post(create_post()))
+
+            # Only the first two messages are handled
+            assert call_function.call_count == 2
+            assert handler.rate_limiter.dropped == {plugin.sleep_reply: 2}
+            # And the sender is told to slow down only once
+            add_task.assert_called_once()
+            assert add_task.call_args[0][-1] == "Slow down!"
+
+    @mock.patch("snaketalk.driver.Driver.user_id", new="qmw86q7qsjriura9jos75i4why")
+    def test_listener_index(self):
+        driver = Driver()
+        plugin = ExamplePlugin().initialize(driver)
+        handler = EventHandler(driver, Settings(), plugins=[plugin])
+
+        def handled_functions(**kwargs):
+            body = create_message(**kwargs).body.copy()
+            body["data"]["post"] = json.dumps(body["data"]["post"])
+            body["data"]["mentions"] = json.dumps(body["data"]["mentions"])
+            with mock.patch.object(plugin, "call_function") as call_function:
+                asyncio.run(handler._handle_post(body))
+            return [call[0][0] for call in call_function.call_args_list]
+
+        # sleep_reply needs a mention or a direct message
+        assert handled_functions(text="sleep 5", mentions=[]) == []
+        assert handled_functions(text="sleep 5") == [plugin.sleep_reply]
+        assert handled_functions(text="sleep 5", mentions=[], channel_type="D") == [
+            plugin.sleep_reply
+        ]
+        # users_access only responds to direct messages
+        assert handled_functions(text="admin", sender_name="admin") == []
+
+        # Users that are not allowed are told so without calling the function
+        with mock.patch("snaketalk.driver.ThreadPool.add_task") as add_task:
+            assert (
+                handled_functions(text="admin", channel_type="D", sender_name="betty")
+                == []
+            )
+            add_task.assert_called_once()
+        assert handled_functions(
+            text="admin", channel_type="D", sender_name="Admin"
+        ) == [plugin.users_access]
+
     def test_handle_webhook(self):
         # Create an initialized plugin so its listeners are registered
         driver = Driver()
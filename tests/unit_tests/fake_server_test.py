@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import ClientSession
+from mattermostdriver.exceptions import NoAccessTokenProvided, ResourceNotFound
+from requests import HTTPError
+
+from snaketalk.driver import Driver
+from snaketalk.fake_server import FakeMattermostServer
+
+
+def create_driver(server: FakeMattermostServer, token="token"):
+    return Driver(
+        {
+            "url": "127.0.0.1",
+            "port": server.port,
+            "token": token,
+            "scheme": "http",
+            "request_timeout": 5,
+        }
+    )
+
+
+@pytest.fixture
+def server():
+    server = FakeMattermostServer(port=3285, bot_username="snaketalk")
+    server.start_thread()
+    yield server
+    server.stop_thread()
+
+
+class TestFakeMattermostServer:
+    def test_rest(self, server, tmp_path):
+        driver = create_driver(server)
+        driver.login()
+        assert driver.username == "snaketalk"
+        assert driver.user_id == server.bot["id"]
+
+        user = server.add_user("betty")
+        assert driver.get_user_info(user["id"])["email"] == "betty@example.com"
+        with pytest.raises(ResourceNotFound):
+            driver.get_user_info("unknown")
+
+        channel = server.add_channel("off-topic")
+        root = server.send_message(channel["id"], user["id"], "hello")
+        path = tmp_path / "file.txt"
+        path.write_text("file contents")
+        driver.create_post(
+            channel["id"], "hi there", root_id=root["id"], file_paths=[path]
+        )
+        driver.react_to(
+            type("Message", (), {"id": root["id"]}), "+1"  # Only the id is used
+        )
+
+        assert server.wait_for_posts(2)
+        thread = driver.get_thread(root["id"])
+        assert thread["order"][0] == root["id"]
+        reply = thread["posts"][thread["order"][-1]]
+        assert reply["message"] == "hi there"
+        assert server.files[reply["file_ids"][0]] == b"file contents"
+        assert server.reactions[0]["emoji_name"] == "+1"
+
+        # Requests with another token are refused
+        with pytest.raises(NoAccessTokenProvided):
+            create_driver(server, token="wrong").login()
+
+    def test_websocket(self, server):
+        user = server.add_user("betty")
+        channel = server.add_channel("betty__snaketalk", channel_type="D")
+
+        async def receive_post():
+            async with ClientSession() as session:
+                url = f"http://127.0.0.1:{server.port}/api/v4/websocket"
+                async with session.ws_connect(url) as websocket:
+                    await websocket.send_json(
+                        {
+                            "seq": 1,
+                            "action": "authentication_challenge",
+                            "data": {"token": "token"},
+                        }
+                    )
+                    assert (await websocket.receive_json())["event"] == "hello"
+                    assert (await websocket.receive_json())["status"] == "OK"
+
+                    server.send_message(channel["id"], user["id"], "@snaketalk hi")
+                    return await websocket.receive_json(timeout=5)
+
+        event = asyncio.run(receive_post())
+        assert event["event"] == "posted"
+        assert event["data"]["channel_type"] == "D"
+        assert event["data"]["sender_name"] == "@betty"
+        assert json.loads(event["data"]["post"])["message"] == "@snaketalk hi"
+        assert json.loads(event["data"]["mentions"]) == [server.bot["id"]]
+
+    def test_faults(self):
+        server = FakeMattermostServer(port=3286, error_rate=1.0)
+        server.start_thread()
+        try:
+            with pytest.raises(HTTPError) as e:
+                create_driver(server).login()
+            assert e.value.response.status_code == 500
+        finally:
+            server.stop_thread()
+
+        server = FakeMattermostServer(port=3287, rate_limit=(2, 60))
+        server.start_thread()
+        try:
+            driver = create_driver(server)
+            driver.login()
+            driver.get_user_info(server.bot["id"])
+            with pytest.raises(HTTPError) as e:
+                driver.get_user_info(server.bot["id"])
+            assert e.value.response.status_code == 429
+            assert server.request_counts[("GET", "/api/v4/users/{user_id}")] == 3
+        finally:
+            server.stop_thread()
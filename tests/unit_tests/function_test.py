@@ -1,5 +1,6 @@
 import asyncio
 import re
+import time
 from unittest import mock
 
 import click
@@ -87,15 +88,50 @@ class TestMessageFunction:
         MessageFunction(function3, matcher=re.compile(""))
 
     def test_click_coroutine(self):
-        with pytest.raises(
-            ValueError,
-            match="Combining click functions and coroutines is currently not supported",
-        ):
+        @click.command()
+        @click.option("--arg1", type=str, default="nothing")
+        async def wrapped(self, message, arg1):
+            return arg1
+
+        f = MessageFunction(wrapped, matcher=re.compile(""))
+        assert f.is_coroutine
+
+        # The arguments are parsed right away, after which the callback can be awaited
+        async def run(*args):
+            return await f(create_message(), *args)
+
+        assert asyncio.run(run("--arg1=yes")) == "yes"
+
+        # Incorrect arguments are reported to the user, but can still be awaited.
+        f.plugin = ExamplePlugin().initialize(Driver(), Settings())
+        with mock.patch.object(f.plugin.driver, "reply_to") as mock_function:
+            assert asyncio.run(run("--nonexistent-arg")) is True
+            mock_function.assert_called_once()
+
+    def test_click_coroutine_context(self):
+        @click.command()
+        @click.option("--arg1", type=str, default="nothing")
+        async def wrapped(self, message, arg1):
+            await asyncio.sleep(0)
+            # The context is still active after the coroutine was suspended
+            ctx = click.get_current_context()
+            if arg1 == "fail":
+                raise click.BadParameter("Can't fail.", ctx=ctx)
+            return ctx.params["arg1"]
+
+        f = MessageFunction(wrapped, matcher=re.compile(""))
+        f.plugin = ExamplePlugin().initialize(Driver(), Settings())
 
-            @listen_to("")
-            @click.command()
-            async def coroutine(self, message):
-                pass
+        async def run(*args):
+            return await f(create_message(), *args)
+
+        assert asyncio.run(run("--arg1=yes")) == "yes"
+
+        # Click errors raised by the coroutine are reported to the user as well
+        with mock.patch.object(f.plugin.driver, "reply_to") as mock_function:
+            assert asyncio.run(run("--arg1=fail")) is None
+            mock_function.assert_called_once()
+            assert "Can't fail." in mock_function.call_args[0][1]
 
     def test_wrap_function(self):  # noqa
         def wrapped(self, message, arg1, arg2):
@@ -136,6 +172,60 @@ class TestMessageFunction:
             f(create_message(), "-f --arg2=no --nonexistent-arg")
             mock_function.assert_called_once()
 
+    def test_click_parse_cache(self):
+        @click.command()
+        @click.option("--arg1", type=str, default="nothing")
+        def wrapped(self, message, arg1):
+            return arg1
+
+        @click.command()
+        @click.option("--file", type=click.File())
+        def with_file(self, message, file):
+            pass
+
+        f = MessageFunction(wrapped, matcher=re.compile(""))
+        with mock.patch.object(
+            f._parse_command, "make_context", wraps=f._parse_command.make_context
+        ) as make_context, mock.patch.object(
+            wrapped, "make_parser", wraps=wrapped.make_parser
+        ) as make_parser:
+            assert f(create_message(), "--arg1=yes") == "yes"
+            assert f(create_message(), "--arg1=yes") == "yes"
+            # The second call should have re-used the parsed arguments
+            make_context.assert_called_once()
+            assert f(create_message(), "--arg1=no") == "no"
+            assert make_context.call_count == 2
+            # The parser built at registration is used for every call
+            make_parser.assert_not_called()
+
+        @click.command()
+        @click.option("--time", type=float, default=lambda: time.time())
+        def with_dynamic_default(self, message, time):
+            pass
+
+        @click.command()
+        @click.option("--name", envvar="SNAKETALK_TEST_NAME")
+        def with_envvar(self, message, name):
+            pass
+
+        # Parameters with side effects or changing values should be parsed every time
+        for command in [with_file, with_dynamic_default, with_envvar]:
+            f = MessageFunction(command, matcher=re.compile(""))
+            assert not hasattr(f._parse_click_arguments, "cache_info")
+
+    def test_click_context(self):
+        @click.command()
+        @click.option("--arg1", type=str, default="nothing")
+        @click.pass_context
+        def wrapped(ctx, self, message, arg1):
+            assert click.get_current_context() is ctx
+            return ctx.params["arg1"], message.text
+
+        f = MessageFunction(wrapped, matcher=re.compile(""))
+        # Also when the arguments come from the cache
+        for _ in range(2):
+            assert f(create_message(), "--arg1=yes") == ("yes", "hello")
+
     @mock.patch("snaketalk.driver.Driver.user_id", "qmw86q7qsjriura9jos75i4why")
     def test_needs_mention(self):  # noqa
         wrapped = mock.create_autospec(example_listener)
@@ -193,6 +283,30 @@ class TestMessageFunction:
         wrapped.assert_not_called()
         driver.reply_to.assert_called_once()
 
+    def test_debounce(self):
+        def batched(self, messages):
+            return [message.sender_name for message in messages]
+
+        f = listen_to("", debounce=1, allowed_users=["betty"])(batched)
+        f.plugin = ExamplePlugin().initialize(Driver())
+        f.plugin.driver.reply_to = mock.Mock()
+
+        # Only the messages that meet the requirements are passed on
+        assert f([create_message(), create_message(sender_name="someone")]) == ["betty"]
+        f.plugin.driver.reply_to.assert_called_once()
+        assert "Handles all messages in a channel" in f.get_help_string()
+
+        # Debounced functions receive a list of messages
+        with pytest.raises(TypeError):
+            listen_to("", debounce=1)(example_listener)
+
+        @click.command()
+        def command(self, messages):
+            pass
+
+        with pytest.raises(ValueError):
+            listen_to("", debounce=1)(command)
+
 
 def example_webhook_listener(self, event):
     # Used to copy the arg specs to mock.Mock functions.
@@ -211,6 +325,12 @@ class TestWebHookFunction:
         # Verify that the regexp is correct
         assert wrapped_function.matcher == re.compile(pattern)
         assert wrapped_function.function == example_webhook_listener
+        assert not wrapped_function.fire_and_forget
+
+        wrapped_function = listen_webhook(pattern, fire_and_forget=True)(
+            example_webhook_listener
+        )
+        assert wrapped_function.fire_and_forget
 
     def test_arguments(self):
         # This function misses the `event` argument
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+import time
+
+from snaketalk.loop_monitor import LoopMonitor
+
+
+class TestLoopMonitor:
+    def test_lag(self):
+        monitor = LoopMonitor(interval=0.01)
+
+        async def main():
+            monitor.start()
+            await asyncio.sleep(0.05)
+            # Block the loop, so that the monitor wakes up late
+            time.sleep(0.1)
+            await asyncio.sleep(0.05)
+            monitor.stop()
+
+        asyncio.run(main())
+        assert monitor.max_lag >= 0.05
+        # Without a threshold, we don't look for blocking code
+        assert monitor.blocked_calls == 0
+
+    def test_blocking_call(self, caplog):
+        monitor = LoopMonitor(interval=0.01, block_threshold=0.1)
+
+        def blocking_listener():
+            time.sleep(0.3)
+
+        async def listener():
+            blocking_listener()
+
+        async def main():
+            monitor.start()
+            await asyncio.sleep(0.05)
+            await asyncio.create_task(listener(), name="MyPlugin.listener")
+            await asyncio.sleep(0.05)
+            monitor.stop()
+
+        with caplog.at_level(logging.WARNING):
+            asyncio.run(main())
+
+        # The stall is reported once, with the task name and its stack trace
+        assert monitor.blocked_calls == 1
+        assert "blocked" in caplog.text
+        assert "MyPlugin.listener" in caplog.text
+        assert "blocking_listener" in caplog.text
@@ -0,0 +1,59 @@
+import tracemalloc
+
+import pytest
+
+from snaketalk.memory import MemoryTracker
+
+from .event_handler_test import create_message
+
+
+class TestMemoryTracker:
+    def test_count_objects(self):
+        before = MemoryTracker.count_objects()
+        messages = [create_message() for _ in range(10)]
+        counts = MemoryTracker.count_objects()
+        assert counts["Message"] - before["Message"] == 10
+        assert set(counts.keys()) == {
+            "Message",
+            "WebHookEvent",
+            "schedule.Job",
+            "pending futures",
+        }
+        del messages
+
+    def test_top_growth(self):
+        tracker = MemoryTracker()
+        with pytest.raises(RuntimeError):
+            tracker.top_growth()
+
+        tracker.start()
+        try:
+            data = [bytearray(1024) for _ in range(1000)]  # noqa
+            growth = tracker.top_growth(limit=5)
+            # The list comprehension above allocated the most memory
+            assert growth[0].traceback[0].filename == __file__
+            assert growth[0].size_diff >= 1000 * 1024
+
+            report = tracker.report()
+            assert "| Message |" in report
+            assert "Traced memory" in report
+            assert __file__ in report
+        finally:
+            tracker.stop()
+        assert "Traced memory" not in tracker.report()
+
+    def test_already_tracing(self):
+        # Somebody else was tracing before us, so we shouldn't stop their tracing
+        tracemalloc.start()
+        try:
+            tracker = MemoryTracker()
+            tracker.start()
+            tracker.stop()
+            assert not tracker.tracing
+            assert tracemalloc.is_tracing()
+        finally:
+            tracemalloc.stop()
+
+        tracker.start()
+        tracker.stop()
+        assert not tracemalloc.is_tracing()
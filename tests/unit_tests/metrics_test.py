@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+from snaketalk.metrics import Counter, Gauge, Histogram, Registry
+
+
+class TestMetrics:
+    def test_counter(self):
+        counter = Counter("requests_total", "Requests.")
+        counter.inc(method="GET")
+        counter.inc(2, method="GET")
+        counter.inc(method="POST")
+
+        # Values recorded on other threads end up in their own shard
+        thread = threading.Thread(target=counter.inc, kwargs={"method": "GET"})
+        thread.start()
+        thread.join()
+
+        assert counter.get(method="GET") == 4
+        assert counter.collect() == (
+            "# HELP requests_total Requests.\n"
+            "# TYPE requests_total counter\n"
+            'requests_total{method="GET"} 4.0\n'
+            'requests_total{method="POST"} 1.0\n'
+        )
+
+    def test_finished_threads(self):
+        counter = Counter("requests_total", "Requests.")
+        histogram = Histogram("latency_seconds", "Latency.", buckets=[1])
+
+        def record():
+            counter.inc()
+            histogram.observe(0.5)
+
+        for _ in range(100):
+            thread = threading.Thread(target=record)
+            thread.start()
+            thread.join()
+
+        assert counter.get() == 100
+        assert histogram.get_count() == 100
+        # The shards of finished threads are folded together once collected
+        assert len(counter._shards) == 0
+        assert len(histogram._shards) == 0
+        counter.inc()
+        assert counter.get() == 101
+        assert len(counter._shards) == 1
+
+    def test_remote(self):
+        registry = Registry()
+        counter = registry.counter("events_total", "Events.")
+        histogram = registry.histogram("latency_seconds", "Latency.", buckets=[1])
+        counter.inc(3)
+        histogram.observe(0.5)
+
+        other = Registry()
+        other.counter("events_total", "Events.").inc(2)
+        other.histogram("latency_seconds", "Latency.", buckets=[1]).observe(2)
+        registry.set_remote("worker", other.snapshot())
+        # Newer snapshots replace the old ones
+        registry.set_remote("worker", other.snapshot())
+
+        assert counter.get() == 5
+        assert histogram.get_count() == 2
+        assert 'latency_seconds_bucket{le="1.0"} 1.0\n' in registry.render()
+
+    def test_histogram(self):
+        histogram = Histogram("latency_seconds", "Latency.", buckets=[0.1, 1])
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        assert histogram.get_count() == 4
+        assert histogram.collect() == (
+            "# HELP latency_seconds Latency.\n"
+            "# TYPE latency_seconds histogram\n"
+            'latency_seconds_bucket{le="0.1"} 2.0\n'
+            'latency_seconds_bucket{le="1.0"} 3.0\n'
+            'latency_seconds_bucket{le="+Inf"} 4.0\n'
+            "latency_seconds_sum 5.65\n"
+            "latency_seconds_count 4.0\n"
+        )
+
+    def test_gauge(self):
+        gauge = Gauge("queue_size", "Queue size.", label="pool")
+        assert gauge.collect().endswith("gauge\n")
+        gauge.set_function(lambda: {"default": 3})
+        assert 'queue_size{pool="default"} 3.0\n' in gauge.collect()
+
+        # Values can also be recorded, and travel in snapshots like those of counters
+        registry = Registry()
+        pending = registry.gauge("pending_requests", "Pending requests.")
+        pending.inc(2)
+        pending.dec()
+        other = Registry()
+        other.gauge("pending_requests", "Pending requests.").inc(3)
+        registry.set_remote("worker", other.snapshot())
+        assert pending.get() == 4
+        assert "pending_requests 4.0\n" in registry.render()
+
+    def test_registry(self):
+        registry = Registry()
+        counter = registry.counter("events_total", 'Events with "quotes".')
+        counter.inc(event='"posted"')
+        assert 'events_total{event="\\"posted\\""} 1.0' in registry.render()
+
+        with pytest.raises(ValueError):
+            registry.counter("events_total", "Duplicate.")
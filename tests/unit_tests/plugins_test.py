@@ -3,9 +3,12 @@ import re
 from unittest import mock
 
 import click
+import pytest
 
 from snaketalk import Plugin, listen_to, listen_webhook
 from snaketalk.driver import Driver
+from snaketalk.process_pool import ProcessPool
+from snaketalk.threadpool import ThreadPool
 
 from .event_handler_test import create_message
 
@@ -92,7 +95,108 @@ class TestPlugin:
             )
             mock_function.assert_called_once_with(p, message)
 
+    @mock.patch("snaketalk.driver.ThreadPool.add_task")
+    def test_debounce(self, add_task):
+        class DebouncedPlugin(Plugin):
+            @listen_to("alert", debounce=0.05)
+            def alerts(self, messages):
+                pass
+
+        p = DebouncedPlugin().initialize(Driver())
+        messages = [create_message(text="alert") for _ in range(3)]
+
+        async def receive():
+            await asyncio.gather(
+                *[p.call_function(DebouncedPlugin.alerts, m) for m in messages]
+            )
+
+        asyncio.run(receive())
+        # All messages from the same channel are handled in a single call
+        add_task.assert_called_once_with(DebouncedPlugin.alerts, messages)
+        assert DebouncedPlugin.alerts.batches == {}
+
+        async def cancel_first():
+            owner = asyncio.ensure_future(
+                p.call_function(DebouncedPlugin.alerts, messages[0])
+            )
+            await asyncio.sleep(0.01)
+            await p.call_function(DebouncedPlugin.alerts, messages[1])
+            owner.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await owner
+            # The cancelled batch is dropped, and the next message starts a new one
+            assert DebouncedPlugin.alerts.batches == {}
+            await p.call_function(DebouncedPlugin.alerts, messages[2])
+
+        add_task.reset_mock()
+        asyncio.run(cancel_first())
+        add_task.assert_called_once_with(DebouncedPlugin.alerts, [messages[2]])
+        assert DebouncedPlugin.alerts.batches == {}
+
+    def test_executor(self):
+        class ThreadedPlugin(FakePlugin):
+            executor = "thread"
+            executor_workers = 3
+
+        driver = Driver()
+        p = ThreadedPlugin().initialize(driver)
+        assert isinstance(p.pool, ThreadPool)
+        assert p.pool.num_workers == 3
+        assert driver.plugin_pools == {"ThreadedPlugin": p.pool}
+
+        # Regular functions are sent to the dedicated pool instead of the global one
+        message = create_message(text="pattern")
+        with mock.patch.object(p.pool, "add_task") as add_task:
+            asyncio.run(p.call_function(ThreadedPlugin.my_function, message))
+            add_task.assert_called_once_with(ThreadedPlugin.my_function, message)
+
+        class InlinePlugin(FakePlugin):
+            executor = "inline"
+
+        p = InlinePlugin().initialize(Driver())
+        assert p.pool is None
+        # Inline functions are called directly
+        with mock.patch.object(p.my_function, "function") as mock_function:
+            asyncio.run(p.call_function(InlinePlugin.my_function, message))
+            mock_function.assert_called_once_with(p, message)
+
+        class ProcessPlugin(FakePlugin):
+            executor = "process"
+            executor_workers = 2
+
+        driver = Driver()
+        p = ProcessPlugin().initialize(driver)
+        assert isinstance(p.pool, ProcessPool)
+        with mock.patch.object(p.pool, "add_task") as add_task:
+            asyncio.run(p.call_function(ProcessPlugin.my_function, message))
+            add_task.assert_called_once_with(ProcessPlugin.my_function, message)
+
+            # Webhook functions can't run in a separate process, so they fall back to
+            # the global threadpool.
+            with mock.patch.object(driver.threadpool, "add_task") as threadpool_task:
+                event = create_message()
+                asyncio.run(p.call_function(ProcessPlugin.webhook_listener, event))
+                threadpool_task.assert_called_once_with(
+                    ProcessPlugin.webhook_listener, event
+                )
+
+        class UnknownPlugin(FakePlugin):
+            executor = "gpu"
+
+        with pytest.raises(ValueError, match="Unknown executor"):
+            UnknownPlugin().initialize(Driver())
+
     def test_help_string(self, snapshot):
         p = FakePlugin().initialize(Driver())
         # Compare the help string with the snapshotted version.
         snapshot.assert_match(p.get_help_string())
+
+        # The help string is only built once
+        with mock.patch.object(p, "_build_help_string") as build_help_string:
+            p.get_help_string()
+            build_help_string.assert_not_called()
+
+            # Unless the listeners change
+            p.register_function(listen_to("new_pattern")(FakePlugin.my_function))
+            p.get_help_string()
+            build_help_string.assert_called_once()
@@ -0,0 +1,97 @@
+import os
+import time
+from unittest import mock
+
+import click
+import pytest
+
+from snaketalk import Plugin, listen_to
+from snaketalk.driver import Driver
+from snaketalk.function import MessageFunction
+
+from .event_handler_test import create_message
+
+
+# Defined at module level so that the worker processes can find it.
+class ProcessPlugin(Plugin):
+    @listen_to("^sum ([0-9]+)$", executor="process")
+    def sum_numbers(self, message, number):
+        total = sum(range(int(number) + 1))
+        self.driver.reply_to(message, f"{total} {os.getpid()}")
+
+    @listen_to("^click_sum", executor="process")
+    @click.command()
+    @click.argument("number", type=int)
+    def click_sum(self, message, number):
+        self.driver.reply_to(message, str(sum(range(number + 1))))
+
+    @listen_to("^fetch$", executor="process")
+    def fetch(self, message):
+        # Only a few driver methods can be used from a worker process
+        self.driver.get_user_info(message.user_id)
+
+
+@pytest.fixture(scope="function")
+def driver():
+    driver = Driver(num_processes=2)
+    driver.reply_to = mock.Mock()
+    yield driver
+    driver.process_pool.stop()
+
+
+def wait_for_calls(mocked: mock.Mock, count: int, timeout: float = 10):
+    start = time.time()
+    while mocked.call_count < count and time.time() < start + timeout:
+        time.sleep(0.05)
+    assert mocked.call_count == count
+
+
+class TestProcessPool:
+    def test_executor_arguments(self):
+        def function(self, message):
+            pass
+
+        with pytest.raises(ValueError, match="Unknown executor"):
+            listen_to("", executor="gpu")(function)
+
+        async def coroutine(self, message):
+            pass
+
+        with pytest.raises(ValueError, match="can't have an executor"):
+            listen_to("", executor="process")(coroutine)
+
+        assert isinstance(listen_to("", executor="process")(function), MessageFunction)
+
+    def test_add_task(self, driver):
+        plugin = ProcessPlugin().initialize(driver)
+        pool = driver.process_pool
+        # The processes are only started when they are needed
+        assert not pool.alive
+
+        message = create_message(text="sum 100")
+        pool.add_task(plugin.sum_numbers, message, "100")
+        assert pool.alive
+        wait_for_calls(driver.reply_to, 1)
+
+        # The reply was sent by the driver in this process, but computed in another
+        reply_message, reply = driver.reply_to.call_args[0]
+        assert reply_message.id == message.id
+        total, pid = reply.split(" ")
+        assert total == "5050"
+        assert int(pid) != os.getpid()
+
+        # Click commands work as well
+        pool.add_task(plugin.click_sum, create_message(text="click_sum 10"), "10")
+        wait_for_calls(driver.reply_to, 2)
+        assert driver.reply_to.call_args[0][1] == "55"
+
+        # Unsupported driver methods raise an error in the worker, but don't break
+        # the pool.
+        pool.add_task(plugin.fetch, create_message(text="fetch"))
+        pool.add_task(plugin.sum_numbers, message, "3")
+        wait_for_calls(driver.reply_to, 3)
+        assert driver.reply_to.call_args[0][1].startswith("6 ")
+
+        pool.stop()
+        assert not pool.alive
+        assert pool.get_busy_workers() == 0
@@ -0,0 +1,33 @@
+import threading
+import time
+
+from snaketalk.profiler import SamplingProfiler
+
+
+def busy_function(stop: threading.Event):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+class TestSamplingProfiler:
+    def test_run(self, tmp_path):
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_function, args=(stop,), name="busy")
+        thread.start()
+        profiler = SamplingProfiler(interval=0.001)
+        samples = profiler.run(0.1)
+        stop.set()
+        thread.join()
+
+        busy_stacks = [stack for stack in samples if stack.startswith("busy;")]
+        assert len(busy_stacks) > 0
+        assert all("busy_function (profiler_test.py:" in s for s in busy_stacks)
+        # The profiling thread itself is not sampled
+        assert not any("SamplingProfiler.run" in stack for stack in samples)
+
+        path = tmp_path / "profile.txt"
+        profiler.write_collapsed(path)
+        lines = path.read_text().splitlines()
+        assert len(lines) == len(samples)
+        stack, count = lines[0].rsplit(" ", 1)
+        assert samples[stack] == int(count)
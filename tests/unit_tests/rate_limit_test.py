@@ -0,0 +1,88 @@
+from unittest import mock
+
+import pytest
+
+from snaketalk import listen_to
+from snaketalk.rate_limit import RateLimiter, TokenBucket
+
+from .event_handler_test import create_message
+
+
+def example_listener(self, message):
+    pass
+
+
+@mock.patch("snaketalk.rate_limit.time.monotonic")
+class TestRateLimiter:
+    def test_token_bucket(self, monotonic):
+        monotonic.return_value = 0
+        bucket = TokenBucket(calls=2, period=10)
+        # We can use the full burst right away, but not more
+        assert bucket.consume(0)
+        assert bucket.consume(0)
+        assert not bucket.consume(1)
+        # After half the period, one token has been refilled
+        assert bucket.consume(5)
+        assert not bucket.consume(5)
+        # But never more than the maximum burst
+        assert bucket.consume(100)
+        assert bucket.consume(100)
+        assert not bucket.consume(100)
+
+    def test_invalid_limit(self, monotonic):
+        for calls, period in [(0, 10), (-1, 10), (1, 0), (1, -5)]:
+            with pytest.raises(ValueError):
+                TokenBucket(calls, period)
+            with pytest.raises(ValueError):
+                RateLimiter(default_limit=(calls, period))
+            # Listeners are checked when they are registered, not on the first message
+            with pytest.raises(ValueError):
+                listen_to("", rate_limit=(calls, period))(example_listener)
+
+    def test_check(self, monotonic):
+        monotonic.return_value = 0
+        limiter = RateLimiter(default_limit=(1, 10), reply="Slow down!")
+        function = listen_to("")(example_listener)
+        message = create_message(text="hello")
+
+        assert limiter.check(function, message) == (True, False)
+        # The second message is dropped, and the sender is asked to slow down once
+        assert limiter.check(function, message) == (False, True)
+        assert limiter.check(function, message) == (False, False)
+        assert limiter.dropped == {function: 2}
+
+        # Other listeners have their own limits, even if they have the same name
+        limited = listen_to("other", rate_limit=(2, 10))(example_listener)
+        assert limiter.check(limited, message) == (True, False)
+        assert limiter.check(limited, message) == (True, False)
+        assert limiter.check(limited, message) == (False, True)
+        assert limited.name == function.name
+        assert limiter.dropped == {function: 2, limited: 1}
+
+        # As do other users and channels
+        other_user = create_message(text="hello")
+        other_user.body["data"]["post"]["user_id"] = "someone_else"
+        assert limiter.check(function, other_user) == (True, False)
+
+        # Once the period has passed, the sender can try again
+        monotonic.return_value = 10
+        assert limiter.check(function, message) == (True, False)
+        assert limiter.check(function, message) == (False, True)
+
+        # Without any limit, everything is allowed
+        limiter = RateLimiter()
+        assert all(limiter.check(function, message) == (True, False) for _ in range(5))
+        assert limiter._buckets == {}
+
+    def test_purge(self, monotonic):
+        monotonic.return_value = 0
+        limiter = RateLimiter(default_limit=(1, 10))
+        function = listen_to("")(example_listener)
+        limiter.check(function, create_message())
+        assert len(limiter._buckets) == 1
+
+        # Buckets that are full again are removed
+        limiter._purge(5)
+        assert len(limiter._buckets) == 1
+        limiter._purge(10)
+        assert limiter._buckets == {}
@@ -0,0 +1,109 @@
+import asyncio
+import gzip
+import json
+import time
+from unittest import mock
+
+from snaketalk import Settings
+from snaketalk.driver import Driver
+from snaketalk.event_handler import EventHandler
+from snaketalk.recording import EventRecorder, read_recording, replay_recording
+
+
+def test_record_and_read(tmp_path):
+    path = tmp_path / "events.jsonl.gz"
+    recorder = EventRecorder(path)
+    recorder.record('{"event": "hello"}', timestamp=1.0)
+    recorder.record(b'{"event": "posted"}', timestamp=2.0)
+    recorder.close()
+    # A new recorder appends to the existing recording
+    recorder = EventRecorder(path)
+    recorder.record('{"event": "typing"}', timestamp=3.0)
+    recorder.close()
+
+    assert list(read_recording(path)) == [
+        (1.0, '{"event": "hello"}'),
+        (2.0, '{"event": "posted"}'),
+        (3.0, '{"event": "typing"}'),
+    ]
+
+
+def test_read_truncated_recording(tmp_path):
+    path = tmp_path / "events.jsonl.gz"
+    recorder = EventRecorder(path, flush_interval=0)
+    for i in range(3):
+        recorder.record(f'{{"seq": {i}}}', timestamp=float(i))
+    # Simulate a crash: the file was flushed but the gzip stream never finished
+    contents = path.read_bytes()
+    recorder.close()
+    path.write_bytes(contents)
+
+    assert [frame for _, frame in read_recording(path)] == [
+        '{"seq": 0}',
+        '{"seq": 1}',
+        '{"seq": 2}',
+    ]
+
+
+def test_record_zero_timestamp(tmp_path):
+    path = tmp_path / "events.jsonl.gz"
+    recorder = EventRecorder(path)
+    recorder.record('{"event": "hello"}', timestamp=0.0)
+    recorder.close()
+
+    assert list(read_recording(path)) == [(0.0, '{"event": "hello"}')]
+
+
+def test_flush_interval(tmp_path):
+    path = tmp_path / "events.jsonl.gz"
+
+    async def record():
+        recorder = EventRecorder(path, flush_interval=0.1)
+        recorder.record('{"event": "hello"}', timestamp=1.0)
+        # Nothing is written until the interval has passed
+        assert list(read_recording(path)) == []
+        # After that, the frame is written without another frame coming in
+        await asyncio.sleep(0.3)
+        assert list(read_recording(path)) == [(1.0, '{"event": "hello"}')]
+        recorder.close()
+
+    asyncio.run(record())
+
+
+def test_replay_recording(tmp_path):
+    path = tmp_path / "events.jsonl.gz"
+    with gzip.open(path, "wt") as f:
+        for i in range(3):
+            f.write(json.dumps({"time": 100 + i * 0.5, "data": f"frame {i}"}) + "\n")
+
+    async def replay(speed):
+        handled = []
+
+        async def handle_event(data):
+            handled.append((data, time.perf_counter()))
+
+        start = time.perf_counter()
+        assert await replay_recording(path, handle_event, speed=speed) == 3
+        return [frame for frame, _ in handled], handled[-1][1] - start
+
+    # The 1 second between the first and last frame is sped up 10 times
+    frames, elapsed = asyncio.run(replay(speed=10))
+    assert frames == ["frame 0", "frame 1", "frame 2"]
+    assert 0.1 <= elapsed < 0.5
+
+    frames, elapsed = asyncio.run(replay(speed=0))
+    assert frames == ["frame 0", "frame 1", "frame 2"]
+    assert elapsed < 0.1
+
+
+@mock.patch("snaketalk.event_handler.EventHandler._handle_post")
+def test_event_handler_records(handle_post, tmp_path):
+    path = tmp_path / "events.jsonl.gz"
+    handler = EventHandler(Driver(), Settings(RECORD_FILE=str(path)), plugins=[])
+    frames = ['{"event": "hello"}', '{"event": "typing", "data": {}}']
+    for frame in frames:
+        asyncio.run(handler._handle_event(frame))
+    handler.recorder.close()
+
+    assert [frame for _, frame in read_recording(path)] == frames
+    assert EventHandler(Driver(), Settings(), plugins=[]).recorder is None
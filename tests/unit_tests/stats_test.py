@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from snaketalk import Plugin, listen_to
+from snaketalk.driver import Driver
+from snaketalk.stats import ListenerStats, get_event_type, percentile
+from snaketalk.threadpool import ThreadPool
+
+from .event_handler_test import create_message
+
+
+class StatsPlugin(Plugin):
+    @listen_to("sync")
+    def sync_function(self, message):
+        pass
+
+    @listen_to("async")
+    async def async_function(self, message):
+        raise ValueError("failed")
+
+
+class TestListenerStats:
+    def test_percentile(self):
+        assert percentile([], 0.5) == 0
+        values = list(range(1, 101))
+        assert percentile(values, 0.5) == 51
+        assert percentile(values, 0.99) == 100
+
+    def test_record(self):
+        stats = ListenerStats(window=3)
+        for duration in [1, 2, 3, 4]:
+            stats.record(
+                "f", "Message", queue_wait=0.1, duration=duration, success=True
+            )
+        stats.record("f", "WebHookEvent", queue_wait=0.1, duration=5, success=False)
+
+        result = stats.get("f")
+        # Totals count every call, the rest only the last 3 calls
+        assert result["calls"] == 5
+        assert result["failures"] == 1
+        assert result["event_types"] == {"Message": 2, "WebHookEvent": 1}
+        assert result["duration"] == {"p50": 4, "p90": 5, "p99": 5}
+        assert result["queue_wait"]["p50"] == 0.1
+        assert list(stats.summary().keys()) == ["f"]
+
+        stats.clear()
+        assert stats.get("f")["calls"] == 0
+
+    def test_event_type(self):
+        assert get_event_type(create_message()) == "Message"
+        assert get_event_type([create_message()]) == "Message"
+
+    def test_instrumentation(self, monkeypatch):
+        stats = ListenerStats()
+        monkeypatch.setattr("snaketalk.threadpool.LISTENER_STATS", stats)
+        monkeypatch.setattr("snaketalk.plugins.base.LISTENER_STATS", stats)
+        plugin = StatsPlugin().initialize(Driver())
+
+        # Functions on the threadpool are recorded by the worker thread
+        pool = ThreadPool(num_workers=1)
+        pool.add_task(StatsPlugin.sync_function, create_message())
+        pool.start()
+        time.sleep(0.1)
+        pool.stop()
+        assert stats.get(StatsPlugin.sync_function.name)["calls"] == 1
+
+        # Coroutines are recorded by the plugin, including failures
+        try:
+            asyncio.run(
+                plugin.call_function(StatsPlugin.async_function, create_message())
+            )
+        except ValueError:
+            pass
+        result = stats.get(StatsPlugin.async_function.name)
+        assert result["calls"] == 1
+        assert result["failures"] == 1
+        assert result["queue_wait"]["p50"] == 0
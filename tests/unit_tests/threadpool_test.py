@@ -27,6 +27,7 @@ class TestThreadPool:
         time.sleep(1)  # wait for workers to start
         print(threadpool.get_busy_workers())
         assert threadpool.get_busy_workers() == 2
+        assert threadpool.get_queue_size() == 0
         time.sleep(6)  # wait for workers to finish
         assert threadpool.get_busy_workers() == 0
         threadpool.stop()
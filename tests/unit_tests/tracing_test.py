@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+
+import pytest
+
+from snaketalk.threadpool import ThreadPool
+from snaketalk.tracing import TRACER, Tracer
+
+
+def read_trace(path):
+    # The trace file is an array without closing bracket
+    return json.loads(path.read_text().rstrip(",\n") + "]")
+
+
+@pytest.fixture
+def tracer(tmp_path):
+    TRACER.configure(str(tmp_path / "trace.json"), sample_rate=1.0)
+    yield TRACER
+    TRACER.configure(None)
+
+
+class TestTracer:
+    def test_disabled(self, tmp_path):
+        tracer = Tracer()
+        with tracer.trace("event") as trace_id:
+            assert trace_id is None
+            with tracer.span("span"):
+                pass
+        # Events that are not sampled aren't traced either
+        tracer.configure(str(tmp_path / "trace.json"), sample_rate=0)
+        with tracer.trace("event") as trace_id:
+            assert trace_id is None
+        tracer.close()
+        assert not (tmp_path / "trace.json").exists()
+
+    def test_trace(self, tracer, tmp_path):
+        with tracer.trace("event") as trace_id:
+            assert tracer.current_trace_id() == trace_id
+            with tracer.span("child", extra="value"):
+                pass
+        # Spans outside of a trace are ignored
+        with tracer.span("outside"):
+            pass
+        assert tracer.current_trace_id() is None
+        tracer.close()
+
+        events = read_trace(tmp_path / "trace.json")
+        assert [event["name"] for event in events] == ["child", "event"]
+        assert all(event["args"]["trace_id"] == trace_id for event in events)
+        assert events[0]["args"]["extra"] == "value"
+        # The child span lies within the root span
+        assert events[1]["ts"] <= events[0]["ts"]
+        assert events[0]["dur"] <= events[1]["dur"]
+
+    def test_threadpool(self, tracer, tmp_path):
+        def task():
+            with tracer.span("inside_task"):
+                pass
+
+        pool = ThreadPool(num_workers=1)
+        with tracer.trace("event") as trace_id:
+            pool.add_task(task)
+        pool.start()
+        time.sleep(0.1)
+        pool.stop()
+        tracer.close()
+
+        # The worker thread continues the trace in which the task was added
+        events = read_trace(tmp_path / "trace.json")
+        assert {event["name"] for event in events} == {
+            "event",
+            "threadpool_queue",
+            "TestTracer.test_threadpool.<locals>.task",
+            "inside_task",
+        }
+        assert all(event["args"]["trace_id"] == trace_id for event in events)
+
+    def test_concurrent_record(self, tmp_path):
+        tracer = Tracer()
+        tracer.configure(str(tmp_path / "trace.json"))
+        tracer.flush_size = 10
+
+        def record_spans():
+            with tracer.trace("event"):
+                for _ in range(999):
+                    with tracer.span("span"):
+                        pass
+
+        threads = [threading.Thread(target=record_spans) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        tracer.close()
+
+        # No spans get lost while another thread flushes
+        assert len(read_trace(tmp_path / "trace.json")) == 4 * 1000
@@ -1,4 +1,6 @@
 import asyncio
+import json
+import re
 import threading
 import time
 
@@ -6,8 +8,14 @@ import pytest
 from aiohttp import ClientSession
 
 from snaketalk import Settings
+from snaketalk.metrics import (
+    EVENTS_RECEIVED,
+    WEBHOOK_PENDING_REQUESTS,
+    WEBHOOK_RESPONSE_SECONDS,
+    WEBHOOK_TIMEOUTS,
+)
 from snaketalk.threadpool import ThreadPool
-from snaketalk.webhook_server import NoResponse, WebHookServer
+from snaketalk.webhook_server import NoResponse, WebHookServer, WebHookServerPool
 
 
 @pytest.fixture(scope="function")
@@ -21,7 +29,14 @@ class TestWebHookServer:
     def test_start(self, threadpool):
         # Test server startup with a different port so it won't clash with the
         # integration tests
-        server = WebHookServer(Settings(WEBHOOK_HOST_PORT=3281))
+        server = WebHookServer(
+            Settings(
+                WEBHOOK_HOST_PORT=3281,
+                WEBHOOK_RESPONSE_TIMEOUT=3,
+                WEBHOOK_MAX_BODY_SIZE=1024,
+                WEBHOOK_THREADED_PARSE_SIZE=128,
+            )
+        )
         threadpool.start_webhook_server_thread(server)
         threadpool.start()
         time.sleep(0.5)
@@ -32,6 +47,9 @@ class TestWebHookServer:
         # Run the other tests sequentially
         self.test_obtain_response(server)
         self.test_process_webhook(server)
+        self.test_response_timeout(server)
+        self.test_body_size(server)
+        self.test_metrics(server)
 
         # Test shutdown procedure
         threadpool.stop()
@@ -102,3 +120,248 @@ class TestWebHookServer:
         thread = threading.Thread(target=provide_response)
         thread.start()
         assert asyncio.run(send_request({"text": "Hello!"})) == response
+
+    @pytest.mark.skip("Called from test_start since we can't parallellize this.")
+    def test_response_timeout(self, server):
+        """Checks whether requests that never receive a response are cleaned up."""
+        assert server.get_pending_requests() == 0
+        timed_out = server.timed_out_requests
+
+        async def send_request(data):
+            async with ClientSession() as session:
+                response = await session.post(
+                    f"{server.url}:{server.port}/hooks/test_hook", json=data
+                )
+                return response.status
+
+        # Assertions in the thread would get lost, so check its results afterwards
+        pending = []
+
+        def check_pending():
+            time.sleep(0.5)
+            pending.append(
+                (server.get_pending_requests(), WEBHOOK_PENDING_REQUESTS.get())
+            )
+
+        thread = threading.Thread(target=check_pending)
+        thread.start()
+        # Once the deadline passes, the server should give up and respond by itself
+        assert asyncio.run(send_request({"text": "Hello?"})) == 504
+        thread.join()
+        # The event was forwarded, but nobody responded to it
+        assert pending == [(1, 1)]
+        assert WEBHOOK_PENDING_REQUESTS.get() == 0
+        assert server.get_pending_requests() == 0
+        assert server.timed_out_requests == timed_out + 1
+
+        # A late response for the expired request is simply ignored
+        event = server.event_queue.get_nowait()
+        server.response_queue.put((event.request_id, NoResponse))
+        time.sleep(0.1)
+        assert server.response_queue.empty()
+        assert server.response_handlers == {}
+
+    @pytest.mark.skip("Called from test_start since we can't parallellize this.")
+    def test_body_size(self, server):
+        """Checks whether large request bodies are rejected or parsed in a thread."""
+        url = f"{server.url}:{server.port}/hooks/test_hook"
+
+        async def send_request(**kwargs):
+            async with ClientSession() as session:
+                response = await session.post(url, timeout=1, **kwargs)
+                return response.status
+
+        # This body is too large, so it should be rejected without creating an event
+        large_body = json.dumps({"text": "a" * 2048})
+        assert asyncio.run(send_request(data=large_body)) == 413
+
+        # Same thing for a streamed body that doesn't announce its size up front
+        async def stream_body():
+            for i in range(0, len(large_body), 256):
+                yield large_body[i : i + 256].encode()
+
+        assert asyncio.run(send_request(data=stream_body())) == 413
+        assert server.event_queue.empty()
+
+        # A JSON null body is small enough, it's just not a valid webhook event
+        assert asyncio.run(send_request(data="null")) == 400
+        assert server.event_queue.empty()
+
+        # This body is above the threaded parsing size, but still allowed
+        events = []
+
+        def provide_response():
+            event = server.event_queue.get()
+            events.append(event)
+            server.response_queue.put((event.request_id, NoResponse))
+
+        thread = threading.Thread(target=provide_response)
+        thread.start()
+        assert asyncio.run(send_request(json={"text": "a" * 512})) == 200
+        thread.join()
+        assert [event.text for event in events] == ["a" * 512]
+
+    @pytest.mark.skip("Called from test_start since we can't parallellize this.")
+    def test_metrics(self, server):
+        async def get_metrics():
+            async with ClientSession() as session:
+                response = await session.get(f"{server.url}:{server.port}/metrics")
+                return response.status, await response.text()
+
+        status, text = asyncio.run(get_metrics())
+        assert status == 200
+        # The previous tests sent webhook requests that were answered with a 413
+        assert 'snaketalk_webhook_response_seconds_count{status="413"}' in text
+        assert "# TYPE snaketalk_listener_seconds histogram" in text
+
+    def test_webhook_routes(self, threadpool):
+        server = WebHookServer(Settings(WEBHOOK_HOST_PORT=3283))
+        server.register_webhook_routes(
+            {
+                re.compile("ping"): False,
+                re.compile("^build_[0-9]+$"): False,
+                re.compile("ci_events"): True,
+            }
+        )
+        threadpool.start_webhook_server_thread(server)
+        threadpool.start()
+        time.sleep(0.5)
+
+        async def send_request(webhook_id):
+            async with ClientSession() as session:
+                response = await session.post(
+                    f"{server.url}:{server.port}/hooks/{webhook_id}",
+                    json={"text": "Hello!"},
+                    timeout=1,
+                )
+                return response.status
+
+        def provide_response():
+            event = server.event_queue.get()
+            server.response_queue.put((event.request_id, NoResponse))
+
+        # Requests that match any of the listeners are forwarded, regardless of
+        # whether they match an exact route or one of the regexps.
+        for webhook_id in ["ping", "ping_pong", "build_12"]:
+            thread = threading.Thread(target=provide_response)
+            thread.start()
+            assert asyncio.run(send_request(webhook_id)) == 200
+            thread.join()
+            assert server.event_queue.empty()
+
+        # Requests to other webhooks are answered right away, without any event.
+        for webhook_id in ["pong", "build_12a"]:
+            assert asyncio.run(send_request(webhook_id)) == 200
+            assert server.event_queue.empty()
+            assert server.response_handlers == {}
+
+        # Fire-and-forget requests are acknowledged before anyone handles them
+        assert asyncio.run(send_request("ci_events")) == 202
+        event = server.event_queue.get_nowait()
+        assert event.webhook_id == "ci_events"
+        assert event.responded
+        assert server.response_handlers == {}
+
+        threadpool.stop()
+
+
+class TestWebHookServerPool:
+    def test_start(self, threadpool):
+        EVENTS_RECEIVED.inc(event="pool_test")
+        responses_before = WEBHOOK_RESPONSE_SECONDS.get_count(status="200")
+        timeouts_before = WEBHOOK_TIMEOUTS.get()
+        pool = WebHookServerPool(
+            Settings(WEBHOOK_HOST_PORT=3282, WEBHOOK_RESPONSE_TIMEOUT=2),
+            num_workers=2,
+        )
+        threadpool.start_webhook_server_thread(pool)
+        threadpool.start()
+        time.sleep(1)
+        assert pool.running
+        assert all(process.is_alive() for process in pool._processes)
+
+        async def send_request(data):
+            async with ClientSession() as session:
+                response = await session.post(
+                    f"{pool.url}:{pool.port}/hooks/test_hook", json=data, timeout=5
+                )
+                return await response.json()
+
+        pending = []
+
+        def provide_response(response):
+            # Events from any of the workers end up in the single event queue
+            event = pool.event_queue.get()
+            pending.append(pool.get_pending_requests())
+            pool.response_queue.put((event.request_id, response))
+
+        # Send a couple of requests, which should each be routed back to the worker
+        # that received them.
+        for i in range(4):
+            response = {"text": f"response {i}"}
+            thread = threading.Thread(target=provide_response, args=(response,))
+            thread.start()
+            assert asyncio.run(send_request({"text": "Hello!"})) == response
+            thread.join()
+        assert pending == [1, 1, 1, 1]
+        assert pool.get_pending_requests() == 0
+
+        # Every worker exposes the metrics of the main process and all workers
+        async def get_metrics():
+            async with ClientSession() as session:
+                response = await session.get(f"{pool.url}:{pool.port}/metrics")
+                return await response.text()
+
+        time.sleep(1.5)  # Let both workers report their metrics
+        for _ in range(4):
+            text = asyncio.run(get_metrics())
+            assert 'snaketalk_events_received_total{event="pool_test"} 1.0' in text
+            assert (
+                'snaketalk_webhook_response_seconds_count{status="200"}'
+                f" {responses_before + 4.0}" in text
+            )
+
+        # Requests that time out are counted by the worker, but exposed by the main
+        # process as well.
+        async def send_unanswered_request():
+            async with ClientSession() as session:
+                response = await session.post(
+                    f"{pool.url}:{pool.port}/hooks/test_hook", json={}, timeout=5
+                )
+                return response.status
+
+        assert asyncio.run(send_unanswered_request()) == 504
+        pool.event_queue.get(timeout=1)
+        time.sleep(1.5)
+        assert WEBHOOK_TIMEOUTS.get() == timeouts_before + 1
+        assert WEBHOOK_PENDING_REQUESTS.get() == 0
+
+        threadpool.stop()
+        assert not pool.running
+        assert pool._processes == []
+
+    def test_fire_and_forget(self, threadpool):
+        pool = WebHookServerPool(
+            Settings(WEBHOOK_HOST_PORT=3284, WEBHOOK_RESPONSE_TIMEOUT=None),
+            num_workers=2,
+        )
+        pool.register_webhook_routes({re.compile("ci_events"): True})
+        threadpool.start_webhook_server_thread(pool)
+        threadpool.start()
+        time.sleep(1)
+
+        async def send_request():
+            async with ClientSession() as session:
+                response = await session.post(
+                    f"{pool.url}:{pool.port}/hooks/ci_events", json={}, timeout=5
+                )
+                return response.status
+
+        for _ in range(4):
+            assert asyncio.run(send_request()) == 202
+            event = pool.event_queue.get(timeout=5)
+            assert event.responded
+        # Nobody waits for a response, so there is no route to remember
+        assert pool.get_pending_requests() == 0
+
+        threadpool.stop()